@@ -19,6 +19,11 @@ sudo chmod 755 "${STATE_DIR}"
 
 # 2) Install CLI -> /usr/local/bin/interheart (from repo interheart.sh)
 sudo install -m 0755 "${REPO_DIR}/interheart.sh" /usr/local/bin/interheart
+# shared schema + target management (used by the CLI and the WebUI)
+sudo install -D -m 0644 "${REPO_DIR}/webui/datastore.py" /usr/local/lib/interheart/datastore.py
+sudo install -D -m 0644 "${REPO_DIR}/webui/icmp.py" /usr/local/lib/interheart/icmp.py
+sudo install -D -m 0644 "${REPO_DIR}/webui/heartbeat.py" /usr/local/lib/interheart/heartbeat.py
+sudo install -D -m 0644 "${REPO_DIR}/webui/statefile.py" /usr/local/lib/interheart/statefile.py
 
 # 3) Init DB (creates /var/lib/interheart/state.db)
 sudo /usr/local/bin/interheart init-db || true
@@ -36,6 +41,7 @@ fi
 echo "[interheart] Installing systemd units"
 sudo cp -f "${INSTALL_DIR}/webui/systemd/interheart.service" /etc/systemd/system/interheart.service
 sudo cp -f "${INSTALL_DIR}/webui/systemd/interheart.timer" /etc/systemd/system/interheart.timer
+sudo cp -f "${INSTALL_DIR}/webui/systemd/interheart-scheduler.service" /etc/systemd/system/interheart-scheduler.service
 sudo cp -f "${INSTALL_DIR}/webui/systemd/interheart-webui.service" /etc/systemd/system/interheart-webui.service
 
 # Optional sudoers (only if you use it)
@@ -50,3 +56,4 @@ sudo systemctl daemon-reload
 echo "[interheart] Done."
 echo "Next:"
 echo "  sudo systemctl enable --now interheart.timer interheart-webui.service"
+echo "  (or, instead of the timer: sudo systemctl enable --now interheart-scheduler.service)"
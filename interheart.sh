@@ -3,12 +3,71 @@ set -euo pipefail
 
 # interheart CLI
 # Stores state in /var/lib/interheart/state.db
-# Requires: sqlite3, curl, ping
+# Requires: sqlite3, python3 (ping only without ICMP socket access)
 
-STATE_DIR="/var/lib/interheart"
+STATE_DIR="${INTERHEART_STATE_DIR:-/var/lib/interheart}"
 DB="${STATE_DIR}/state.db"
 LOG_TAG="interheart"
 
+# Probe engine (run-now):
+# - RUN_CONCURRENCY: max targets probed at the same time
+# - RUN_DEADLINE_SEC: wall-clock budget for one run (0 = no deadline).
+#   Targets that could not be probed before the deadline keep their next_due
+#   and are picked up by the next run.
+RUN_CONCURRENCY="${INTERHEART_CONCURRENCY:-32}"
+RUN_DEADLINE_SEC="${INTERHEART_RUN_DEADLINE:-0}"
+
+# Ping check (webui/icmp.py, one process and socket per run):
+# - PING_COUNT echoes per target, PING_SPACING_MS apart, PING_TIMEOUT_MS
+#   wait after the last one, at most PING_RATE echoes/s over the whole run
+# - a target is reachable when it answered and lost at most PING_MAX_LOSS %
+PING_COUNT="${INTERHEART_PING_COUNT:-3}"
+PING_SPACING_MS="${INTERHEART_PING_SPACING_MS:-200}"
+PING_TIMEOUT_MS="${INTERHEART_PING_TIMEOUT_MS:-1000}"
+PING_RATE="${INTERHEART_PING_RATE:-2000}"
+PING_MAX_LOSS="${INTERHEART_PING_MAX_LOSS:-50}"
+
+# Heartbeats (webui/heartbeat.py): keep-alive connections per receiver host,
+# at most HB_PER_HOST requests in flight per host. Heartbeats a receiver did
+# not answer are kept in the hb_outbox table and retried by later runs.
+HB_PER_HOST="${INTERHEART_HB_PER_HOST:-4}"
+
+# Resident scheduler (interheart daemon):
+# - SCHED_PID_FILE: lets CLI mutations wake the daemon (SIGHUP) to reload targets
+# - SCHED_RESYNC_SEC: periodic reload as a safety net for out-of-band DB edits
+# - SCHED_MAX_BATCHES: max overlapping run-now batches; RUN_CONCURRENCY is split
+#   between them so the daemon never has more than RUN_CONCURRENCY probes in flight
+SCHED_PID_FILE="${STATE_DIR}/scheduler.pid"
+SCHED_RESYNC_SEC="${INTERHEART_SCHED_RESYNC:-300}"
+SCHED_MAX_BATCHES="${INTERHEART_SCHED_MAX_BATCHES:-2}"
+
+# History retention (datastore.py retention): raw samples are kept in weekly
+# partitions (history_w<ts / HISTORY_PARTITION_SEC>, same constant as
+# datastore.PARTITION_SECONDS). Expiry drops whole partitions, at most once
+# per RETENTION_EVERY_SEC. Policy: INTERHEART_HISTORY_DAYS (default 90),
+# INTERHEART_DB_MAX_MB (0 = no size cap), INTERHEART_TOMBSTONE_SEC.
+HISTORY_PARTITION_SEC=604800
+RETENTION_EVERY_SEC=3600
+RETENTION_STAMP="${STATE_DIR}/retention.stamp"
+
+# Target management (add/edit/enable/disable/remove/list/status/get) and the
+# schema live in datastore.py, shared with the WebUI. Looked up next to this
+# script first (repo checkout), then at the installed locations.
+DATASTORE="${INTERHEART_DATASTORE:-}"
+if [[ -z "$DATASTORE" ]]; then
+  for _ds in "$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/webui/datastore.py" \
+             /usr/local/lib/interheart/datastore.py \
+             /opt/interheart/webui/datastore.py; do
+    if [[ -f "$_ds" ]]; then DATASTORE="$_ds"; break; fi
+  done
+  unset _ds
+fi
+ICMP_PROBER="${INTERHEART_ICMP_PROBER:-${DATASTORE%/*}/icmp.py}"
+HEARTBEAT="${INTERHEART_HEARTBEAT:-${DATASTORE%/*}/heartbeat.py}"
+# /state snapshot (webui/statefile.py), rewritten after every run that
+# committed results; optional, the WebUI falls back to reading the DB
+STATEFILE="${INTERHEART_STATEFILE:-${DATASTORE%/*}/statefile.py}"
+
 mkdir -p "${STATE_DIR}" >/dev/null 2>&1 || true
 
 have_cmd() { command -v "$1" >/dev/null 2>&1; }
@@ -18,97 +77,163 @@ die() {
   exit 1
 }
 
-mask_endpoint() {
-  # Keep scheme + host, hide path/query
-  # https://host/path?x=1  -> https://host/***
-  local url="${1:-}"
-  if [[ -z "$url" ]]; then
-    echo "-"
-    return
-  fi
-  # extract scheme://host[:port]
-  local scheme host rest
-  scheme="$(echo "$url" | awk -F:// '{print $1}')"
-  rest="$(echo "$url" | sed -E 's#^[a-zA-Z]+://##')"
-  host="$(echo "$rest" | awk -F/ '{print $1}')"
-  if [[ -n "$scheme" && -n "$host" ]]; then
-    echo "${scheme}://${host}/***"
-  else
-    echo "***"
-  fi
-}
-
 require_deps() {
   have_cmd sqlite3 || die "ERROR: Missing sqlite3"
-  have_cmd curl    || die "ERROR: Missing curl"
-  have_cmd ping    || die "ERROR: Missing ping"
+  have_cmd python3 || die "ERROR: Missing python3"
+  [[ -n "$DATASTORE" && -f "$DATASTORE" ]] || die "ERROR: datastore.py not found (set INTERHEART_DATASTORE)"
+  [[ -f "$ICMP_PROBER" ]] || die "ERROR: icmp.py not found (set INTERHEART_ICMP_PROBER)"
+  [[ -f "$HEARTBEAT" ]] || die "ERROR: heartbeat.py not found (set INTERHEART_HEARTBEAT)"
 }
 
-init_db() {
+datastore() {
+  # datastore <command> [args...]: run a datastore.py command against ${DB}
   require_deps
+  python3 "$DATASTORE" --db "${DB}" "$@"
+}
+
+init_db() {
   mkdir -p "${STATE_DIR}" >/dev/null 2>&1 || true
-  sqlite3 "${DB}" <<'SQL'
-PRAGMA journal_mode=WAL;
-PRAGMA synchronous=NORMAL;
-
-CREATE TABLE IF NOT EXISTS targets (
-  name TEXT PRIMARY KEY,
-  ip TEXT NOT NULL,
-  endpoint TEXT NOT NULL,
-  interval INTEGER NOT NULL DEFAULT 60,
-  enabled INTEGER NOT NULL DEFAULT 1,
-  created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
-  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
-);
-
-CREATE TABLE IF NOT EXISTS runtime (
-  name TEXT PRIMARY KEY,
-  status TEXT NOT NULL DEFAULT 'unknown',
-  next_due INTEGER NOT NULL DEFAULT 0,
-  last_ping INTEGER NOT NULL DEFAULT 0,
-  last_sent INTEGER NOT NULL DEFAULT 0,
-  last_rtt_ms INTEGER NOT NULL DEFAULT -1
-);
-
-CREATE TABLE IF NOT EXISTS history (
-  ts INTEGER NOT NULL,
-  name TEXT NOT NULL,
-  status TEXT NOT NULL,   -- 'up' | 'down' | 'disabled'
-  rtt_ms INTEGER NOT NULL DEFAULT -1,
-  curl_http INTEGER NOT NULL DEFAULT 0
-);
-
-CREATE INDEX IF NOT EXISTS idx_history_name_ts ON history(name, ts);
-
-CREATE INDEX IF NOT EXISTS idx_targets_enabled ON targets(enabled);
-CREATE INDEX IF NOT EXISTS idx_runtime_next_due ON runtime(next_due);
-SQL
-}
-
-sql_one() {
-  local q="$1"
-  sqlite3 -noheader -batch "${DB}" "${q}"
-}
-
-sql_exec() {
-  local q="$1"
-  sqlite3 -batch "${DB}" "${q}"
+  datastore init-db >/dev/null
+}
+
+# ---- Schema migrations (PRAGMA user_version) ----
+# Defined in datastore.py (MIGRATIONS). Must match datastore.SCHEMA_VERSION;
+# lets every run skip the Python start-up when the DB is already current.
+DB_SCHEMA_VERSION=11
+
+migrate_db() {
+  local v
+  v="$(sqlite3 -noheader -batch "${DB}" "PRAGMA user_version;" 2>/dev/null || echo 0)"
+  [[ "$v" =~ ^[0-9]+$ ]] || v=0
+  (( v >= DB_SCHEMA_VERSION )) && return 0
+  datastore migrate || die "ERROR: DB migration failed"
+}
+
+# ---- Database session (run-now/test) ----
+# A run holds one sqlite3 process: reads go through a sentinel-terminated
+# query, writes are queued and committed in batched transactions instead of
+# one process + one WAL commit per statement.
+# sqlite3 stderr goes to a private file that is checked after every flush, so
+# a failed BEGIN (lock timeout) or statement is logged and counted instead of
+# silently degrading the batch.
+DB_ROWS=()
+DB_PENDING=""
+DB_PENDING_N=0
+DB_LAST_FLUSH_MS=0
+DB_BATCH_ROWS="${INTERHEART_BATCH_ROWS:-200}"
+DB_BATCH_MS=1000
+DB_ERR_FILE=""
+DB_ERR_SEEN=0
+DB_FLUSH_FAILED=0
+
+db_open() {
+  DB_ERR_FILE="$(mktemp "${TMPDIR:-/tmp}/interheart-db.XXXXXX")"
+  DB_ERR_SEEN=0
+  DB_FLUSH_FAILED=0
+  coproc DB_SESSION { sqlite3 -batch -noheader "${DB}" 2>"${DB_ERR_FILE}"; }
+  printf '.timeout 5000\n' >&"${DB_SESSION[1]}"
+  DB_LAST_FLUSH_MS="$(now_ms)"
+}
+
+db_check() {
+  # db_check <what>: wait for the session to catch up, then log any new
+  # sqlite3 errors. Returns 1 if there were errors.
+  local what="$1" size line
+  printf "SELECT '__eoq__';\n" >&"${DB_SESSION[1]}"
+  while IFS= read -r line <&"${DB_SESSION[0]}"; do
+    [[ "$line" != "__eoq__" ]] || break
+  done
+  size="$(wc -c <"${DB_ERR_FILE}" 2>/dev/null || echo 0)"
+  [[ "$size" -gt "$DB_ERR_SEEN" ]] || return 0
+  while IFS= read -r line; do
+    [[ -n "$line" ]] && log_warn "db: ${what}: ${line}"
+  done < <(tail -c +"$((DB_ERR_SEEN + 1))" "${DB_ERR_FILE}")
+  DB_ERR_SEEN="$size"
+  return 1
+}
+
+db_query() {
+  # db_query <sql>: result rows ('|'-separated) into DB_ROWS
+  DB_ROWS=()
+  printf '%s\nSELECT '\''__eoq__'\'';\n' "$1" >&"${DB_SESSION[1]}"
+  local line
+  while IFS= read -r line <&"${DB_SESSION[0]}"; do
+    [[ "$line" != "__eoq__" ]] || break
+    DB_ROWS+=("$line")
+  done
+}
+
+db_queue() {
+  # db_queue <sql>: commit with the next batch; flushes when the batch is
+  # full or older than DB_BATCH_MS so the WebUI still sees live progress
+  DB_PENDING+="$1"$'\n'
+  DB_PENDING_N=$((DB_PENDING_N + 1))
+  if [[ "$DB_PENDING_N" -ge "$DB_BATCH_ROWS" || $(( $(now_ms) - DB_LAST_FLUSH_MS )) -ge "$DB_BATCH_MS" ]]; then
+    db_flush
+  fi
+}
+
+db_flush() {
+  if [[ "$DB_PENDING_N" -gt 0 ]]; then
+    printf 'BEGIN IMMEDIATE;\n%sCOMMIT;\n' "$DB_PENDING" >&"${DB_SESSION[1]}"
+    if ! db_check "batch of ${DB_PENDING_N} statements"; then
+      DB_FLUSH_FAILED=$((DB_FLUSH_FAILED + 1))
+    fi
+  fi
+  DB_PENDING=""
+  DB_PENDING_N=0
+  DB_LAST_FLUSH_MS="$(now_ms)"
+}
+
+db_close() {
+  db_flush
+  local pid="${DB_SESSION_PID:-}"
+  printf '.quit\n' >&"${DB_SESSION[1]}"
+  [[ -z "$pid" ]] || wait "$pid" 2>/dev/null || true
+  if [[ "$DB_FLUSH_FAILED" -gt 0 ]]; then
+    log_warn "db: ${DB_FLUSH_FAILED} batch(es) hit errors; see messages above"
+  fi
+  rm -f "${DB_ERR_FILE}"
 }
 
 ensure_exists() {
-  [[ -f "${DB}" ]] || init_db
+  if [[ -f "${DB}" ]]; then
+    migrate_db
+  else
+    init_db
+  fi
 }
 
 now_epoch() {
   date +%s
 }
 
+validate_name() {
+  # same rule as datastore.validate_name: letters, numbers, dash, underscore, dot
+  [[ "$1" =~ ^[a-zA-Z0-9._-]+$ ]]
+}
+
+now_ms() {
+  # bash 5 exposes a microsecond clock without forking date
+  if [[ -n "${EPOCHREALTIME:-}" ]]; then
+    local us="${EPOCHREALTIME/[.,]/}"
+    echo $(( us / 1000 ))
+  else
+    date +%s%3N
+  fi
+}
+
 log_info() {
   # journal tag
   # If called by systemd/journal, stdout may be captured; keep it simple.
   echo "$*"
 }
 
+log_warn() {
+  # stderr: reaches the journal without mixing into output the WebUI parses
+  echo "WARN: $*" >&2
+}
+
 usage() {
   cat <<EOF
 interheart
@@ -117,355 +242,485 @@ Usage:
   interheart init-db
   interheart add <name> <ip> <endpoint> <interval_seconds>
   interheart remove <name>
+  interheart remove --names <a,b,...|->
   interheart list
   interheart status
   interheart get <name>
   interheart edit <old_name> <new_name> <ip> <endpoint> <interval_seconds> <enabled 0|1>
   interheart disable <name>
   interheart enable <name>
+  interheart enable|disable --names <a,b,...|->
   interheart set-target-interval <name> <interval_seconds>
   interheart test <name>
-  interheart run-now [--targets name1,name2,...] [--force]
+  interheart test --names <a,b,...|->
+  interheart run-now [--targets name1,name2,...] [--force] [--concurrency N] [--deadline SEC]
+                     [--trigger timer|manual]
+  interheart daemon
 
 Notes:
   - Data stored in: ${DB}
+  - run-now probes up to ${RUN_CONCURRENCY} targets at once (INTERHEART_CONCURRENCY)
+  - --names applies to all listed targets in one transaction ("-" reads
+    names from stdin) and prints one "ok:"/"error:" line per name
+  - run-now deadline: ${RUN_DEADLINE_SEC}s, 0 = none (INTERHEART_RUN_DEADLINE)
+  - ping check: ${PING_COUNT} echoes per target (INTERHEART_PING_COUNT), up
+    when at most ${PING_MAX_LOSS}% are lost (INTERHEART_PING_MAX_LOSS)
+  - heartbeats reuse keep-alive connections per receiver host, at most
+    ${HB_PER_HOST} in flight per host (INTERHEART_HB_PER_HOST); unanswered
+    heartbeats are retried by later runs from the hb_outbox table
+  - history is kept in weekly partitions for INTERHEART_HISTORY_DAYS days
+    (default 90), optionally capped at INTERHEART_DB_MAX_MB; expired weeks
+    are dropped whole and the space is returned by incremental vacuum
+  - targets sharing an interval are spread evenly across it (phase grid);
+    added/enabled/re-timed targets start within min(interval,
+    INTERHEART_FIRST_SPREAD_SEC=300s) instead of all at once
+  - every run-now/test is recorded in the runs table (trigger, duration,
+    counters) with one event per probe result in events (WebUI: Runs)
+  - daemon keeps running and probes each target when its next_due is reached
+    (use instead of interheart.timer; reloads targets on SIGHUP)
 EOF
 }
 
-validate_name() {
-  local name="$1"
-  [[ -n "$name" ]] || return 1
-  # allow: letters, numbers, dash, underscore, dot
-  [[ "$name" =~ ^[a-zA-Z0-9._-]+$ ]] || return 1
-  return 0
-}
-
-validate_ip() {
-  local ip="$1"
-  [[ "$ip" =~ ^([0-9]{1,3}\.){3}[0-9]{1,3}$ ]] || return 1
-  local o1 o2 o3 o4
-  IFS='.' read -r o1 o2 o3 o4 <<<"$ip"
-  for o in "$o1" "$o2" "$o3" "$o4"; do
-    [[ "$o" -ge 0 && "$o" -le 255 ]] || return 1
-  done
-  return 0
-}
-
-validate_interval() {
-  local s="$1"
-  [[ "$s" =~ ^[0-9]+$ ]] || return 1
-  [[ "$s" -ge 10 && "$s" -le 86400 ]] || return 1
-  return 0
-}
-
-validate_endpoint() {
-  local u="$1"
-  [[ -n "$u" ]] || return 1
-  [[ "$u" =~ ^https?:// ]] || return 1
-  return 0
+notify_scheduler() {
+  # Ask a running `interheart daemon` to reload targets (no-op without one)
+  [[ "${SCHED_NOTIFY:-1}" == "1" ]] || return 0
+  local pid cmdline
+  pid="$(cat "${SCHED_PID_FILE}" 2>/dev/null || true)"
+  [[ "$pid" =~ ^[0-9]+$ ]] || return 0
+  # guard against a stale pid file pointing at an unrelated process
+  cmdline="$(tr '\0' ' ' <"/proc/${pid}/cmdline" 2>/dev/null || true)"
+  [[ "$cmdline" == *interheart*daemon* ]] || return 0
+  kill -HUP "$pid" 2>/dev/null || true
 }
 
 cmd_add() {
   ensure_exists
-  local name="${1:-}"
-  local ip="${2:-}"
-  local endpoint="${3:-}"
-  local interval="${4:-}"
-
-  validate_name "$name" || die "ERROR: Invalid name (allowed: a-zA-Z0-9._-)"
-  validate_ip "$ip" || die "ERROR: Invalid IP"
-  validate_endpoint "$endpoint" || die "ERROR: Endpoint must start with http:// or https://"
-  validate_interval "$interval" || die "ERROR: Interval must be 10-86400 seconds"
-
-  local exists
-  exists="$(sql_one "SELECT 1 FROM targets WHERE name='$(printf "%q" "$name" | sed "s/^'//;s/'$//")' LIMIT 1;")" || true
-  # (printf %q quote is shell-ish; use sqlite safe quoting below)
-  # We'll do safe quoting by replacing single quotes.
-  local n_esc ip_esc ep_esc
-  n_esc="${name//\'/\'\'}"
-  ip_esc="${ip//\'/\'\'}"
-  ep_esc="${endpoint//\'/\'\'}"
-
-  local exists2
-  exists2="$(sql_one "SELECT 1 FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-  [[ -z "$exists2" ]] || die "ERROR: Target already exists: ${name}"
-
-  local now
-  now="$(now_epoch)"
-
-  sql_exec "INSERT INTO targets(name,ip,endpoint,interval,enabled,created_at,updated_at)
-            VALUES('${n_esc}','${ip_esc}','${ep_esc}',${interval},1,${now},${now});"
-
-  # create runtime baseline
-  sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-            VALUES('${n_esc}','unknown',0,0,0,-1);"
-
-  log_info "OK: Added ${name}"
+  datastore add "$@"
 }
 
 cmd_remove() {
   ensure_exists
-  local name="${1:-}"
-  validate_name "$name" || die "ERROR: Invalid name"
-  local n_esc="${name//\'/\'\'}"
-
-  local exists
-  exists="$(sql_one "SELECT 1 FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-  [[ -n "$exists" ]] || die "ERROR: Not found: ${name}"
+  datastore remove "$@"
+}
 
-  sql_exec "DELETE FROM targets WHERE name='${n_esc}';"
-  sql_exec "DELETE FROM runtime WHERE name='${n_esc}';"
-  log_info "OK: Removed ${name}"
+# ---- Batch mutations ----
+# enable/disable/remove/test accept `--names a,b,c` (or `--names -` to read
+# names from stdin, one per line or comma-separated) and print one
+# "ok: <name>" / "error: <name>: <reason>" line per name. Mutations commit in
+# one transaction (datastore.py); `test` probes the targets concurrently.
+BATCH_NAMES=()
+
+read_names_arg() {
+  # read_names_arg <csv|-> into BATCH_NAMES (trimmed, de-duplicated)
+  local src="$1" raw t
+  if [[ "$src" == "-" ]]; then
+    raw="$(cat)"
+  else
+    raw="$src"
+  fi
+  BATCH_NAMES=()
+  local -A seen=()
+  while IFS= read -r t; do
+    t="${t#"${t%%[![:space:]]*}"}"
+    t="${t%"${t##*[![:space:]]}"}"
+    [[ -n "$t" && -z "${seen[$t]:-}" ]] || continue
+    seen[$t]=1
+    BATCH_NAMES+=("$t")
+  done < <(printf '%s\n' "${raw//,/$'\n'}")
+  [[ ${#BATCH_NAMES[@]} -gt 0 ]] || die "ERROR: Empty --names list"
 }
 
 cmd_list() {
   ensure_exists
-
-  echo "Targets:"
-  echo "--------------------------------------------------------------------------------"
-  echo "NAME                 IP               INTERVAL   ENABLED   ENDPOINT"
-  echo "--------------------------------------------------------------------------------"
-
-  # fixed-width-ish formatting
-  sqlite3 -noheader -batch "${DB}" \
-    "SELECT name, ip, interval, enabled, endpoint FROM targets ORDER BY name COLLATE NOCASE;" \
-  | while IFS='|' read -r name ip interval enabled endpoint; do
-      local masked
-      masked="$(mask_endpoint "$endpoint")"
-      printf "%-20s %-16s %-9ss %-8s %s\n" "$name" "$ip" "$interval" "$enabled" "$masked"
-    done
+  datastore list
 }
 
 cmd_status() {
   ensure_exists
-  local now
-  now="$(now_epoch)"
-
-  echo "State:"
-  echo "----------------------------------------------------------------------------------------------------------------------------"
-  echo "NAME                 STATUS     NEXT_IN     NEXT_DUE     LAST_PING   LAST_RESP   LAT_MS"
-  echo "----------------------------------------------------------------------------------------------------------------------------"
-
-  # Join targets + runtime
-  sqlite3 -noheader -batch "${DB}" \
-    "SELECT t.name,
-            CASE WHEN t.enabled=0 THEN 'disabled' ELSE COALESCE(r.status,'unknown') END AS status,
-            COALESCE(r.next_due,0) AS next_due,
-            COALESCE(r.last_ping,0) AS last_ping,
-            COALESCE(r.last_sent,0) AS last_sent,
-            COALESCE(r.last_rtt_ms,-1) AS last_rtt_ms
-     FROM targets t
-     LEFT JOIN runtime r ON r.name=t.name
-     ORDER BY t.name COLLATE NOCASE;" \
-  | while IFS='|' read -r name status next_due last_ping last_sent last_rtt_ms; do
-      local next_in
-      if [[ "$next_due" =~ ^[0-9]+$ && "$next_due" -gt 0 ]]; then
-        if [[ "$next_due" -le "$now" ]]; then next_in=0; else next_in=$((next_due - now)); fi
-      else
-        next_in=0
-        next_due=0
-      fi
-
-      printf "%-20s %-10s %-10s %-10s %-10s %-10s %-6s\n" \
-        "$name" "$status" "${next_in}" "${next_due}" "${last_ping:-0}" "${last_sent:-0}" "${last_rtt_ms:-1}"
-    done
+  datastore status
 }
 
 cmd_get() {
   ensure_exists
-  local name="${1:-}"
-  validate_name "$name" || die "ERROR: Invalid name"
-  local n_esc="${name//\'/\'\'}"
-
-  local row
-  row="$(sqlite3 -noheader -batch "${DB}" \
-    "SELECT name, ip, endpoint, interval, enabled FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-
-  [[ -n "$row" ]] || die "ERROR: Not found: ${name}"
-
-  # Output format required by WebUI:
-  # name|ip|endpoint|interval|enabled
-  echo "$row"
+  # Output format required by WebUI: name|ip|endpoint|interval|enabled
+  datastore get "$@"
 }
 
 cmd_disable() {
   ensure_exists
-  local name="${1:-}"
-  validate_name "$name" || die "ERROR: Invalid name"
-  local n_esc="${name//\'/\'\'}"
+  datastore disable "$@"
+}
 
-  local exists
-  exists="$(sql_one "SELECT 1 FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-  [[ -n "$exists" ]] || die "ERROR: Not found: ${name}"
+cmd_enable() {
+  ensure_exists
+  datastore enable "$@"
+}
 
-  local now
-  now="$(now_epoch)"
+cmd_set_interval() {
+  ensure_exists
+  datastore set-target-interval "$@"
+}
 
-  sql_exec "UPDATE targets SET enabled=0, updated_at=${now} WHERE name='${n_esc}';"
-  # keep status coherent
-  sql_exec "UPDATE runtime SET status='disabled' WHERE name='${n_esc}';"
-  log_info "OK: Disabled ${name}"
+cmd_edit() {
+  ensure_exists
+  datastore edit "$@"
 }
 
-cmd_enable() {
+cmd_test() {
+  # cmd_test <name>...: probe the targets now (concurrently), whether enabled
+  # or not, and record the results. With --names each result line is
+  # prefixed with "<name>: " and unknown names are reported, not fatal.
   ensure_exists
-  local name="${1:-}"
-  validate_name "$name" || die "ERROR: Invalid name"
-  local n_esc="${name//\'/\'\'}"
+  local -a names=("$@")
+  local batch=0 name in_list="" failed=0
+  [[ ${#BATCH_NAMES[@]} -eq 0 ]] || batch=1
 
-  local exists
-  exists="$(sql_one "SELECT 1 FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-  [[ -n "$exists" ]] || die "ERROR: Not found: ${name}"
+  for name in "${names[@]}"; do
+    in_list="${in_list:+${in_list},}'${name//\'/\'\'}'"
+  done
 
-  local now
+  db_open
+  db_query "SELECT t.name, t.ip, t.interval, COALESCE(p.phase,0), t.endpoint
+            FROM targets t LEFT JOIN sched_phase p ON p.name=t.name WHERE t.name IN (${in_list});"
+  local -a queue=()
+  local -A known=() phase_of=()
+  local row ip interval phase endpoint
+  for row in "${DB_ROWS[@]}"; do
+    IFS='|' read -r name ip interval phase endpoint <<<"$row"
+    known[$name]=1
+    phase_of[$name]="$phase"
+    queue+=("${name}|${ip}|${interval}|${endpoint}")
+  done
+  local -a missing=()
+  for name in "${names[@]}"; do
+    [[ -z "${known[$name]:-}" ]] || continue
+    if [[ "$batch" -eq 0 ]]; then
+      db_close
+      die "ERROR: Not found: ${name}"
+    fi
+    echo "error: ${name}: not found"
+    missing+=("$name")
+    failed=$((failed + 1))
+  done
+
+  local now start_ms
   now="$(now_epoch)"
+  start_ms="$(now_ms)"
+  maybe_retention "$now"
+  run_begin test "$now"
+  for name in "${missing[@]}"; do
+    queue_event error "$name" "not found"
+  done
 
-  sql_exec "UPDATE targets SET enabled=1, updated_at=${now} WHERE name='${n_esc}';"
-  # runtime will be recalculated at next run; set unknown now
-  sql_exec "UPDATE runtime SET status='unknown' WHERE name='${n_esc}';"
-  log_info "OK: Enabled ${name}"
+  # Disabled targets still get a ping test (schedule is written as usual)
+  local p_ok rtt_ms code http_ms stats prefix="" msg level
+  local ping_ok=0 ping_fail=0 sent=0 curl_fail=0
+  while IFS='|' read -r name interval p_ok rtt_ms code http_ms stats; do
+    [[ -n "$name" ]] || continue
+    [[ "$batch" -eq 0 ]] || prefix="${name}: "
+    queue_probe_metrics "$name" "$rtt_ms" "$code" "$http_ms"
+    next_slot "$now" "$interval" "${phase_of[$name]:-0}"
+    ping_summary "$stats"
+    if [[ "$p_ok" -eq 1 ]]; then
+      ping_ok=$((ping_ok + 1))
+      if [[ "$code" =~ ^[23] ]]; then
+        # Mark up
+        sent=$((sent + 1))
+        queue_result "$name" up "$SCHED_NEXT" "$now" "$now" "$rtt_ms" "$code" "$stats"
+        level="info"
+        msg="ping_ok=1 curl_http=${code} ${PING_SUMMARY}"
+        echo "${prefix}OK: ${msg}"
+      else
+        # Mark down (endpoint), retry soon
+        curl_fail=$((curl_fail + 1))
+        queue_result "$name" down $((now + 5)) "$now" "$now" "$rtt_ms" "$code" "$stats"
+        level="warn"
+        msg="ping_ok=1 curl_http=${code} ${PING_SUMMARY}"
+        echo "${prefix}WARN: ${msg}"
+      fi
+    else
+      # Mark down (ping)
+      ping_fail=$((ping_fail + 1))
+      queue_result "$name" down "$SCHED_NEXT" "$now" 0 -1 0 "$stats"
+      level="error"
+      msg="ping_ok=0 ${PING_SUMMARY}"
+      echo "${prefix}FAIL: ${msg}"
+    fi
+    queue_event "$level" "$name" "$msg"
+  done < <(printf '%s\n' "${queue[@]}" | probe_pool "$RUN_CONCURRENCY" 0)
+
+  queue_run_end $(( $(now_ms) - start_ms )) total="${#names[@]}" due="${#queue[@]}" skipped="${#missing[@]}" \
+    disabled=0 ping_ok="$ping_ok" ping_fail="$ping_fail" sent="$sent" curl_fail="$curl_fail" deferred=0
+  db_close
+  write_state_snapshot
+  notify_scheduler
+  [[ "$failed" -eq 0 ]]
 }
 
-cmd_set_interval() {
-  ensure_exists
-  local name="${1:-}"
-  local interval="${2:-}"
-  validate_name "$name" || die "ERROR: Invalid name"
-  validate_interval "$interval" || die "ERROR: Interval must be 10-86400 seconds"
-  local n_esc="${name//\'/\'\'}"
-  local now
-  now="$(now_epoch)"
-
-  local exists
-  exists="$(sql_one "SELECT 1 FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-  [[ -n "$exists" ]] || die "ERROR: Not found: ${name}"
+maybe_retention() {
+  # maybe_retention <now>: run `datastore retention` when the partitions the
+  # runner writes to are missing or the last pass is RETENTION_EVERY_SEC old.
+  # Needs the open session (before anything is queued).
+  local now="$1" k stamp_ts=0
+  k=$((now / HISTORY_PARTITION_SEC))
+  db_query "SELECT count(*) FROM sqlite_master WHERE type='table' AND name IN ('history_w${k}','history_w$((k + 1))');"
+  stamp_ts="$(stat -c %Y "${RETENTION_STAMP}" 2>/dev/null || echo 0)"
+  if [[ "${DB_ROWS[0]:-0}" -ge 2 && $((now - stamp_ts)) -lt "$RETENTION_EVERY_SEC" ]]; then
+    return 0
+  fi
+  touch "${RETENTION_STAMP}" 2>/dev/null || true
+  datastore retention || log_warn "retention failed; history partitions may be missing"
+}
 
-  sql_exec "UPDATE targets SET interval=${interval}, updated_at=${now} WHERE name='${n_esc}';"
-  log_info "OK: Interval set for ${name} -> ${interval}s"
+# ---- Scheduling phase ----
+# Probes land on each target's phase grid (phase + k * interval, phases in
+# sched_phase, spread by datastore.rebalance_phases) so targets sharing an
+# interval do not run in lockstep.
+SCHED_NEXT=0
+
+next_slot() {
+  # next_slot <now> <interval> <phase>: first t >= now + interval/2 with
+  # t = phase (mod interval), into SCHED_NEXT (same as datastore.next_slot).
+  # The floor keeps a target whose phase just moved (rebalance) from being
+  # probed again a second later; it reaches its slot within 1.5 intervals.
+  local now="$1" iv="$2" ph="${3:-0}" t
+  t=$(( now + (iv + 1) / 2 ))
+  SCHED_NEXT=$(( t + ((ph - t) % iv + iv) % iv ))
 }
 
-cmd_edit() {
-  ensure_exists
-  local old_name="${1:-}"
-  local new_name="${2:-}"
-  local ip="${3:-}"
-  local endpoint="${4:-}"
-  local interval="${5:-}"
-  local enabled="${6:-}"
-
-  validate_name "$old_name" || die "ERROR: Invalid old_name"
-  validate_name "$new_name" || die "ERROR: Invalid new_name"
-  validate_ip "$ip" || die "ERROR: Invalid IP"
-  validate_endpoint "$endpoint" || die "ERROR: Endpoint must start with http:// or https://"
-  validate_interval "$interval" || die "ERROR: Interval must be 10-86400 seconds"
-  [[ "$enabled" == "0" || "$enabled" == "1" ]] || die "ERROR: enabled must be 0 or 1"
-
-  local old_esc new_esc ip_esc ep_esc
-  old_esc="${old_name//\'/\'\'}"
-  new_esc="${new_name//\'/\'\'}"
-  ip_esc="${ip//\'/\'\'}"
-  ep_esc="${endpoint//\'/\'\'}"
-
-  local exists_old
-  exists_old="$(sql_one "SELECT 1 FROM targets WHERE name='${old_esc}' LIMIT 1;")" || true
-  [[ -n "$exists_old" ]] || die "ERROR: Not found: ${old_name}"
-
-  # if renaming, ensure new doesn't exist
-  if [[ "$old_name" != "$new_name" ]]; then
-    local exists_new
-    exists_new="$(sql_one "SELECT 1 FROM targets WHERE name='${new_esc}' LIMIT 1;")" || true
-    [[ -z "$exists_new" ]] || die "ERROR: Target exists: ${new_name}"
+queue_result() {
+  # queue_result <name> <status> <next_due> <ts> <last_sent> <rtt_ms> <http_code> [<ping stats>]
+  # ping stats: loss_pct|min_us|avg_us|max_us|mdev_us from icmp_probe (-1 =
+  # none, stored as NULL). history stores datastore.STATUS_* codes: 1 up,
+  # 2 heartbeat failed (ping ok), 3 down (no ping), 0 disabled
+  local n_esc="${1//\'/\'\'}" code=3 loss min_us avg_us max_us mdev_us
+  if [[ "$2" == "up" ]]; then
+    code=1
+  elif [[ "$2" == "disabled" ]]; then
+    code=0
+  elif (( $6 >= 0 )); then
+    code=2
   fi
+  IFS='|' read -r loss min_us avg_us max_us mdev_us <<<"${8:--1|-1|-1|-1|-1}"
+  db_queue "INSERT INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms,
+                                loss_pct,rtt_min_us,rtt_avg_us,rtt_max_us,rtt_mdev_us)
+            VALUES('${n_esc}','${2}',${3},${4},${5},${6},NULLIF(${loss:--1},-1),NULLIF(${min_us:--1},-1),
+                   NULLIF(${avg_us:--1},-1),NULLIF(${max_us:--1},-1),NULLIF(${mdev_us:--1},-1))
+            ON CONFLICT(name) DO UPDATE SET status=excluded.status, next_due=excluded.next_due,
+              last_ping=excluded.last_ping, last_sent=excluded.last_sent, last_rtt_ms=excluded.last_rtt_ms,
+              loss_pct=excluded.loss_pct, rtt_min_us=excluded.rtt_min_us, rtt_avg_us=excluded.rtt_avg_us,
+              rtt_max_us=excluded.rtt_max_us, rtt_mdev_us=excluded.rtt_mdev_us;
+            INSERT OR REPLACE INTO history_w$(( $4 / HISTORY_PARTITION_SEC ))(target_id,ts,status,rtt_ms,curl_http,
+                                                                             rtt_us,jitter_us,loss_pct)
+            SELECT id,${4},${code},${6},${7:-0},NULLIF(${avg_us:--1},-1),NULLIF(${mdev_us:--1},-1),
+                   NULLIF(${loss:--1},-1) FROM target_ids WHERE name='${n_esc}';"
+  queue_rollup "$n_esc" "$2" "$4" "$6"
+}
 
-  local now
-  now="$(now_epoch)"
+PING_SUMMARY=""
 
-  # Update targets (rename + values)
-  sql_exec "UPDATE targets
-            SET name='${new_esc}',
-                ip='${ip_esc}',
-                endpoint='${ep_esc}',
-                interval=${interval},
-                enabled=${enabled},
-                updated_at=${now}
-            WHERE name='${old_esc}';"
-
-  # runtime key rename if needed
-  if [[ "$old_name" != "$new_name" ]]; then
-    sql_exec "UPDATE runtime SET name='${new_esc}' WHERE name='${old_esc}';"
+ping_summary() {
+  # ping_summary <loss_pct|min_us|avg_us|max_us|mdev_us>: output fragment
+  # "loss_pct=.. rtt_us=min/avg/max/mdev" into PING_SUMMARY
+  local loss min_us avg_us max_us mdev_us
+  IFS='|' read -r loss min_us avg_us max_us mdev_us <<<"$1"
+  PING_SUMMARY="loss_pct=${loss}"
+  if (( avg_us >= 0 )); then
+    PING_SUMMARY+=" rtt_us=${min_us}/${avg_us}/${max_us}/${mdev_us}"
   fi
+}
 
-  # reflect enabled state into runtime status (best effort)
-  if [[ "$enabled" == "0" ]]; then
-    sql_exec "UPDATE runtime SET status='disabled' WHERE name='${new_esc}';"
-  else
-    # don't force "up"; just set unknown
-    sql_exec "UPDATE runtime SET status='unknown' WHERE name='${new_esc}';"
-  fi
+# ---- Run records (datastore migration v10) ----
+# run_begin registers the run before anything is probed (the WebUI finds it
+# by pid); events are queued with the probe results and the counters are
+# written with the last batch.
+RUN_ID=0
+RUN_OPEN=0
+
+run_close_stale() {
+  # Runs whose process is gone without writing its counters (SIGKILL, crash)
+  # are closed as aborted: ended set, counters left NULL
+  local row id pid ids=""
+  db_query "SELECT id, pid FROM runs WHERE ended IS NULL;"
+  for row in "${DB_ROWS[@]}"; do
+    id="${row%%|*}"
+    pid="${row#*|}"
+    [[ "$id" =~ ^[0-9]+$ ]] || continue
+    if [[ "$pid" =~ ^[0-9]+$ ]] && kill -0 "$pid" 2>/dev/null; then
+      continue
+    fi
+    ids="${ids:+${ids},}${id}"
+  done
+  [[ -n "$ids" ]] || return 0
+  db_queue "INSERT INTO events(run_id,ts,target,level,message)
+            SELECT id, ${EPOCHSECONDS:-$(now_epoch)}, NULL, 'error', 'run aborted: runner exited before finishing'
+            FROM runs WHERE id IN (${ids});"
+  db_queue "UPDATE runs SET ended=${EPOCHSECONDS:-$(now_epoch)} WHERE id IN (${ids}) AND ended IS NULL;"
+  log_warn "closed aborted run(s): ${ids}"
+}
 
-  log_info "OK: Updated ${old_name} -> ${new_name}"
+run_abort() {
+  # EXIT/TERM/INT trap of a run: close its runs row as aborted (outside the
+  # session, which may already be gone); no-op once queue_run_end ran
+  [[ "$RUN_OPEN" -eq 1 && "$RUN_ID" -gt 0 ]] || return 0
+  RUN_OPEN=0
+  sqlite3 -batch "${DB}" ".timeout 5000" \
+    "INSERT INTO events(run_id,ts,target,level,message) VALUES(${RUN_ID},$(now_epoch),NULL,'error','run aborted by signal or error');
+     UPDATE runs SET ended=$(now_epoch) WHERE id=${RUN_ID} AND ended IS NULL;" >/dev/null 2>&1 || true
 }
 
-cmd_test() {
-  ensure_exists
-  local name="${1:-}"
-  validate_name "$name" || die "ERROR: Invalid name"
-  local n_esc="${name//\'/\'\'}"
+run_begin() {
+  # run_begin <trigger> <started epoch>: insert the runs row, id into RUN_ID
+  run_close_stale
+  db_query "INSERT INTO runs(started,trigger,pid) VALUES(${2},'${1}',${BASHPID});
+            SELECT last_insert_rowid();"
+  RUN_ID="${DB_ROWS[0]:-0}"
+  [[ "$RUN_ID" =~ ^[0-9]+$ ]] || RUN_ID=0
+  RUN_OPEN=1
+  trap run_abort EXIT
+  trap 'run_abort; exit 143' TERM
+  trap 'run_abort; exit 130' INT
+}
 
-  local row
-  row="$(sqlite3 -noheader -batch "${DB}" \
-    "SELECT ip, endpoint, interval, enabled FROM targets WHERE name='${n_esc}' LIMIT 1;")" || true
-  [[ -n "$row" ]] || die "ERROR: Not found: ${name}"
+queue_event() {
+  # queue_event <level info|warn|error> <target or ""> <message>
+  local t_sql="NULL" m_esc="${3//\'/\'\'}"
+  [[ -z "$2" ]] || t_sql="'${2//\'/\'\'}'"
+  db_queue "INSERT INTO events(run_id,ts,target,level,message)
+            VALUES(NULLIF(${RUN_ID},0),${EPOCHSECONDS:-$(now_epoch)},${t_sql},'${1}','${m_esc}');"
+}
 
-  local ip endpoint interval enabled
-  IFS='|' read -r ip endpoint interval enabled <<<"$row"
+queue_run_end() {
+  # queue_run_end <duration_ms> total=<n> due=<n> ...: final counters
+  local dur="$1" kv sets=""
+  shift
+  for kv in "$@"; do
+    sets+=", ${kv%%=*}=${kv#*=}"
+  done
+  db_queue "UPDATE runs SET ended=${EPOCHSECONDS:-$(now_epoch)}, duration_ms=${dur}${sets} WHERE id=${RUN_ID};"
+  RUN_OPEN=0
+}
 
-  local now
-  now="$(now_epoch)"
-  # Keep history reasonably small (90 days)
-  sql_exec "DELETE FROM history WHERE ts < $((now - 90*24*3600));" >/dev/null 2>&1 || true
-
-  local ping_ok=0 rtt_ms=-1
-  local t0 t1
-  t0="$(date +%s%3N 2>/dev/null || true)"
-  if ping -c 1 -W 1 "$ip" >/dev/null 2>&1; then
-    ping_ok=1
-    t1="$(date +%s%3N 2>/dev/null || true)"
-    if [[ -n "$t0" && -n "$t1" ]]; then rtt_ms=$((t1 - t0)); else rtt_ms=0; fi
+queue_rollup() {
+  # queue_rollup <name_esc> <status> <ts> <rtt_ms>
+  # Fold one sample into history_daily. Mirrors the v1 backfill in datastore.py:
+  # any non-down sample closes the open down streak.
+  local n_esc="$1" status="$2" ts="$3" rtt="$4"
+  local ok=0 hb=0 dn=0 rsum=0 rcnt=0 rval=NULL open=0
+  if [[ "$status" == "up" ]]; then
+    ok=1
+  elif [[ "$status" == "down" ]]; then
+    open="$ts"
+    if (( rtt >= 0 )); then hb=1; else dn=1; fi
   fi
-
-  if [[ "$enabled" != "1" ]]; then
-    # Don't mutate schedule for disabled targets, but still allow a ping test.
-    :
+  if [[ "$status" == "up" || "$status" == "down" ]] && (( rtt >= 0 )); then
+    rsum="$rtt"; rcnt=1; rval="$rtt"
   fi
+  db_queue "INSERT INTO history_daily(name,day,ok_cnt,hb_cnt,down_cnt,rtt_sum,rtt_cnt,rtt_min,rtt_max,worst_down_s,streak_start,last_ts)
+            VALUES('${n_esc}',date(${ts},'unixepoch','localtime'),${ok},${hb},${dn},${rsum},${rcnt},${rval},${rval},0,${open},${ts})
+            ON CONFLICT(name,day) DO UPDATE SET
+              ok_cnt=ok_cnt+excluded.ok_cnt, hb_cnt=hb_cnt+excluded.hb_cnt, down_cnt=down_cnt+excluded.down_cnt,
+              rtt_sum=rtt_sum+excluded.rtt_sum, rtt_cnt=rtt_cnt+excluded.rtt_cnt,
+              rtt_min=MIN(COALESCE(rtt_min,excluded.rtt_min),COALESCE(excluded.rtt_min,rtt_min)),
+              rtt_max=MAX(COALESCE(rtt_max,excluded.rtt_max),COALESCE(excluded.rtt_max,rtt_max)),
+              worst_down_s=CASE WHEN excluded.streak_start>0 AND streak_start>0
+                                THEN MAX(worst_down_s, excluded.last_ts-streak_start) ELSE worst_down_s END,
+              streak_start=CASE WHEN excluded.streak_start=0 THEN 0
+                                WHEN streak_start>0 THEN streak_start ELSE excluded.streak_start END,
+              last_ts=MAX(last_ts,excluded.last_ts);"
+}
 
-  if [[ "$ping_ok" -eq 1 ]]; then
-    # curl endpoint
-    local code
-    code="$(curl -sS -o /dev/null -m 5 -w "%{http_code}" "$endpoint" || true)"
-    if [[ "$code" =~ ^[23] ]]; then
-      # Mark up
-      sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-                VALUES('${n_esc}','up', $((now + interval)), ${now}, ${now}, ${rtt_ms});" >/dev/null 2>&1 || true
-      sql_exec "INSERT INTO history(ts,name,status,rtt_ms,curl_http)
-                VALUES(${now},'${n_esc}','up',${rtt_ms},${code:-0});" >/dev/null 2>&1 || true
-      echo "OK: ping_ok=1 curl_http=${code}"
-    else
-      # Mark down (endpoint)
-      sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-                VALUES('${n_esc}','down', $((now + 5)), ${now}, ${now}, ${rtt_ms});" >/dev/null 2>&1 || true
-      sql_exec "INSERT INTO history(ts,name,status,rtt_ms,curl_http)
-                VALUES(${now},'${n_esc}','down',${rtt_ms},${code:-0});" >/dev/null 2>&1 || true
-      echo "WARN: ping_ok=1 curl_http=${code}"
+# ---- Metrics (served by the WebUI at /metrics) ----
+# Counters and histograms are folded into the DB with the probe results
+# (tables `metrics` and `probe_hist`, datastore migration v6). Bucket upper
+# bounds must match datastore.PROBE_BUCKETS_MS / RUN_BUCKETS_MS.
+METRIC_PROBE_BUCKETS_MS=(5 10 25 50 100 250 500 1000 2500 5000)
+METRIC_RUN_BUCKETS_MS=(500 1000 2500 5000 10000 30000 60000)
+METRIC_BUCKET=0
+
+metric_bucket() {
+  # metric_bucket <value_ms> <bounds...>: bucket index into METRIC_BUCKET
+  local v="$1" b
+  shift
+  METRIC_BUCKET=0
+  for b in "$@"; do
+    if (( v <= b )); then
+      return 0
     fi
-  else
-    # Mark down (ping)
-    sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-              VALUES('${n_esc}','down', $((now + interval)), ${now}, 0, -1);" >/dev/null 2>&1 || true
-    sql_exec "INSERT INTO history(ts,name,status,rtt_ms,curl_http)
-              VALUES(${now},'${n_esc}','down',-1,0);" >/dev/null 2>&1 || true
-    echo "FAIL: ping_ok=0"
+    METRIC_BUCKET=$((METRIC_BUCKET + 1))
+  done
+}
+
+queue_probe_metrics() {
+  # queue_probe_metrics <name> <rtt_ms> <http_code> <http_ms>
+  # rtt_ms/http_ms < 0: no ping reply / no heartbeat request
+  local n_esc="${1//\'/\'\'}" rtt="$2" code="$3" http_ms="$4" sql
+  sql="INSERT INTO metrics(key,value) VALUES('probes',1)
+         ON CONFLICT(key) DO UPDATE SET value=value+1;"
+  if (( rtt >= 0 )); then
+    metric_bucket "$rtt" "${METRIC_PROBE_BUCKETS_MS[@]}"
+    sql+="INSERT INTO probe_hist(name,kind,b${METRIC_BUCKET},sum_ms,count) VALUES('${n_esc}','rtt',1,${rtt},1)
+            ON CONFLICT(name,kind) DO UPDATE SET b${METRIC_BUCKET}=b${METRIC_BUCKET}+1,
+              sum_ms=sum_ms+excluded.sum_ms, count=count+1;"
   fi
+  if (( http_ms >= 0 )); then
+    metric_bucket "$http_ms" "${METRIC_PROBE_BUCKETS_MS[@]}"
+    sql+="INSERT INTO probe_hist(name,kind,b${METRIC_BUCKET},sum_ms,count) VALUES('${n_esc}','http',1,${http_ms},1)
+            ON CONFLICT(name,kind) DO UPDATE SET b${METRIC_BUCKET}=b${METRIC_BUCKET}+1,
+              sum_ms=sum_ms+excluded.sum_ms, count=count+1;
+          INSERT INTO metrics(key,value) VALUES('http_code:${code}',1)
+            ON CONFLICT(key) DO UPDATE SET value=value+1;"
+  fi
+  db_queue "$sql"
+}
+
+queue_run_metrics() {
+  # queue_run_metrics <duration_ms> <probes> <overrun 0|1> <now>
+  local dur="$1" probes="$2" overrun="$3" now="$4"
+  metric_bucket "$dur" "${METRIC_RUN_BUCKETS_MS[@]}"
+  db_queue "INSERT INTO metrics(key,value) VALUES
+              ('runs',1),('run_overruns',${overrun}),('run_duration_ms_sum',${dur}),
+              ('run_duration_b${METRIC_BUCKET}',1),('db_batch_failures',${DB_FLUSH_FAILED})
+              ON CONFLICT(key) DO UPDATE SET value=value+excluded.value;
+            INSERT INTO metrics(key,value) VALUES
+              ('last_run_ts',${now}),('last_run_duration_ms',${dur}),('last_run_probes',${probes})
+              ON CONFLICT(key) DO UPDATE SET value=excluded.value;"
+}
+
+icmp_probe() {
+  # icmp_probe <deadline_ms>: ping the "name|ip|interval|endpoint" lines on
+  # stdin (webui/icmp.py) and print, as each target finishes:
+  #   name|ip|loss_pct|min_us|avg_us|max_us|mdev_us|interval|endpoint
+  # loss_pct=-1: deadline reached before the first echo; RTTs -1: no reply
+  require_deps
+  python3 "$ICMP_PROBER" --count "$PING_COUNT" --spacing-ms "$PING_SPACING_MS" \
+    --timeout-ms "$PING_TIMEOUT_MS" --rate "$PING_RATE" --deadline-ms "$1"
+}
+
+heartbeat_dispatch() {
+  # heartbeat_dispatch <concurrency> <deadline_ms>: icmp_probe records on
+  # stdin -> one result record per target (webui/heartbeat.py):
+  #   name|interval|ping_ok|rtt_ms|http_code|http_ms|loss_pct|min_us|avg_us|max_us|mdev_us
+  # ping_ok=2 means the run deadline was reached before the probe could
+  # finish; http_ms=-1 when no heartbeat request was made.
+  python3 "$HEARTBEAT" --db "${DB}" --concurrency "$1" --per-host "$HB_PER_HOST" \
+    --max-loss "$PING_MAX_LOSS" --deadline-ms "$2"
+}
+
+write_state_snapshot() {
+  # state.json next to the DB for the WebUI's /state; a missing or stale
+  # file only costs the WebUI a DB read (statefile.py logs its own errors)
+  [[ -f "$STATEFILE" ]] || return 0
+  python3 "$STATEFILE" --db "${DB}" || true
+}
+
+probe_pool() {
+  # Read "name|ip|interval|endpoint" lines on stdin, ping them all in one
+  # icmp_probe pass and send the heartbeats of the reachable ones over
+  # pooled connections (at most <concurrency> requests in flight). Records
+  # are printed as probes complete, so total run time follows the slowest
+  # probe instead of the sum of all probes.
+  icmp_probe "$2" | heartbeat_dispatch "$1" "$2"
 }
 
 cmd_run_now() {
@@ -473,6 +728,9 @@ cmd_run_now() {
 
   local targets_csv=""
   local force=0
+  local concurrency="$RUN_CONCURRENCY"
+  local deadline_sec="$RUN_DEADLINE_SEC"
+  local trigger="manual"
 
   while [[ $# -gt 0 ]]; do
     case "$1" in
@@ -484,47 +742,87 @@ cmd_run_now() {
         force=1
         shift
         ;;
+      --concurrency)
+        concurrency="${2:-}"
+        shift 2
+        ;;
+      --deadline)
+        deadline_sec="${2:-}"
+        shift 2
+        ;;
+      --trigger)
+        trigger="${2:-}"
+        shift 2
+        ;;
       *)
         die "ERROR: Unknown arg: $1"
         ;;
     esac
   done
 
+  [[ "$concurrency" =~ ^[0-9]+$ && "$concurrency" -ge 1 ]] || die "ERROR: --concurrency must be >= 1"
+  [[ "$deadline_sec" =~ ^[0-9]+$ ]] || die "ERROR: --deadline must be a number of seconds (0 = none)"
+  [[ "$trigger" == "timer" || "$trigger" == "manual" ]] || die "ERROR: --trigger must be timer or manual"
+  local t
+  local -a arr=()
+  IFS=',' read -ra arr <<<"$targets_csv"
+  for t in "${arr[@]}"; do
+    t="${t#"${t%%[![:space:]]*}"}"
+    t="${t%"${t##*[![:space:]]}"}"
+    [[ -z "$t" ]] || validate_name "$t" || die "ERROR: Invalid target name in --targets: $t"
+  done
+
   local start_ms end_ms dur_ms
-  start_ms="$(date +%s%3N 2>/dev/null || true)"
+  start_ms="$(now_ms)"
   local start_epoch
   start_epoch="$(now_epoch)"
 
-  local total=0 due=0 skipped=0 ping_ok=0 ping_fail=0 sent=0 curl_fail=0 disabled=0
+  local deadline_ms=0
+  if [[ "$deadline_sec" -gt 0 ]]; then
+    deadline_ms=$((start_ms + deadline_sec * 1000))
+  fi
+
+  local total=0 due=0 skipped=0 ping_ok=0 ping_fail=0 sent=0 curl_fail=0 disabled=0 deferred=0
 
   local now
   now="$start_epoch"
 
-  # Keep history reasonably small (90 days)
-  sql_exec "DELETE FROM history WHERE ts < $((now - 90*24*3600));" >/dev/null 2>&1 || true
+  db_open
 
-  # Build target list
-  local list_sql
+  maybe_retention "$now"
+  run_begin "$trigger" "$now"
+
+  # Build target list together with runtime (endpoint last: it is the only
+  # free-form column). Most overdue first, so a deadline never starves the
+  # same targets.
+  local list_sql where_sql=""
   if [[ -n "$targets_csv" ]]; then
     # selected targets => treat as force on those
     IFS=',' read -ra arr <<<"$targets_csv"
     local in_list=""
     for t in "${arr[@]}"; do
-      t="$(echo "$t" | xargs)"
+      t="${t#"${t%%[![:space:]]*}"}"
+      t="${t%"${t##*[![:space:]]}"}"
       [[ -n "$t" ]] || continue
-      validate_name "$t" || die "ERROR: Invalid target name in --targets: $t"
       local t_esc="${t//\'/\'\'}"
       if [[ -z "$in_list" ]]; then in_list="'${t_esc}'"; else in_list="${in_list},'${t_esc}'"; fi
     done
     [[ -n "$in_list" ]] || die "ERROR: Empty --targets list"
-    list_sql="SELECT name, ip, endpoint, interval, enabled FROM targets WHERE name IN (${in_list}) ORDER BY name COLLATE NOCASE;"
+    where_sql="WHERE t.name IN (${in_list})"
     force=1
-  else
-    list_sql="SELECT name, ip, endpoint, interval, enabled FROM targets ORDER BY name COLLATE NOCASE;"
   fi
-
-  # Iterate
-  while IFS='|' read -r name ip endpoint interval enabled; do
+  list_sql="SELECT t.name, t.ip, t.interval, t.enabled, COALESCE(r.next_due,0), COALESCE(p.phase,0), t.endpoint
+            FROM targets t LEFT JOIN runtime r ON r.name=t.name LEFT JOIN sched_phase p ON p.name=t.name
+            ${where_sql}
+            ORDER BY COALESCE(r.next_due,0), t.name COLLATE NOCASE;"
+
+  # Pick due targets
+  local -a queue=()
+  local -A phase_of=()
+  local row next_due phase is_due
+  db_query "$list_sql"
+  for row in "${DB_ROWS[@]}"; do
+      IFS='|' read -r name ip interval enabled next_due phase endpoint <<<"$row"
       total=$((total+1))
 
       if [[ "$enabled" != "1" ]]; then
@@ -534,10 +832,7 @@ cmd_run_now() {
       fi
 
       # due check
-      local next_due
-      next_due="$(sql_one "SELECT next_due FROM runtime WHERE name='${name//\'/\'\'}' LIMIT 1;" 2>/dev/null || true)"
-      next_due="${next_due:-0}"
-      local is_due=0
+      is_due=0
 
       if [[ "$force" -eq 1 ]]; then
         is_due=1
@@ -556,59 +851,279 @@ cmd_run_now() {
       fi
 
       due=$((due+1))
+      phase_of[$name]="$phase"
+      queue+=("${name}|${ip}|${interval}|${endpoint}")
+  done
 
-      # ping
-      local t0 t1 rtt_ms
-      t0="$(date +%s%3N 2>/dev/null || true)"
-      if ping -c 1 -W 1 "$ip" >/dev/null 2>&1; then
-        t1="$(date +%s%3N 2>/dev/null || true)"
-        if [[ -n "$t0" && -n "$t1" ]]; then
-          rtt_ms=$((t1 - t0))
-        else
-          rtt_ms=0
-        fi
-        ping_ok=$((ping_ok+1))
-
-        # curl endpoint on success
-        local http_code
-        http_code="$(curl -sS -o /dev/null -m 5 -w "%{http_code}" "$endpoint" || true)"
-        if [[ "$http_code" =~ ^[23] ]]; then
-          sent=$((sent+1))
-          # status up
-          sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-                    VALUES('${name//\'/\'\'}','up', $((now + interval)), ${now}, ${now}, ${rtt_ms});"
-          sql_exec "INSERT INTO history(ts,name,status,rtt_ms,curl_http)
-                    VALUES(${now},'${name//\'/\'\'}','up',${rtt_ms},${http_code:-0});" >/dev/null 2>&1 || true
-          echo "run: ${name} ping_ok=1 curl_http=${http_code} rtt_ms=${rtt_ms}"
-        else
-          curl_fail=$((curl_fail+1))
-          # status down (endpoint)
-          sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-                    VALUES('${name//\'/\'\'}','down', $((now + interval)), ${now}, ${now}, ${rtt_ms});"
-          sql_exec "INSERT INTO history(ts,name,status,rtt_ms,curl_http)
-                    VALUES(${now},'${name//\'/\'\'}','down',${rtt_ms},${http_code:-0});" >/dev/null 2>&1 || true
-          echo "run: ${name} ping_ok=1 curl_fail=1 curl_http=${http_code} rtt_ms=${rtt_ms}"
-        fi
-      else
-        ping_fail=$((ping_fail+1))
-        # ping fail: down
-        sql_exec "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms)
-                  VALUES('${name//\'/\'\'}','down', $((now + interval)), ${now}, 0, -1);"
-        sql_exec "INSERT INTO history(ts,name,status,rtt_ms,curl_http)
-                  VALUES(${now},'${name//\'/\'\'}','down',-1,0);" >/dev/null 2>&1 || true
-        echo "run: ${name} ping_ok=0"
-      fi
-    done < <(sqlite3 -noheader -batch "${DB}" "${list_sql}")
-
-  end_ms="$(date +%s%3N 2>/dev/null || true)"
+  # Probe concurrently; results are committed in batches as they come in
+  local p_ok rtt_ms http_code http_ms stats msg level
+  while IFS='|' read -r name interval p_ok rtt_ms http_code http_ms stats; do
+      [[ -n "$name" ]] || continue
+      [[ "$p_ok" == "2" ]] || queue_probe_metrics "$name" "$rtt_ms" "$http_code" "$http_ms"
+      next_slot "$now" "$interval" "${phase_of[$name]:-0}"
+      case "$p_ok" in
+        1)
+          ping_ok=$((ping_ok+1))
+          ping_summary "$stats"
+          if [[ "$http_code" =~ ^[23] ]]; then
+            sent=$((sent+1))
+            queue_result "$name" up "$SCHED_NEXT" "$now" "$now" "$rtt_ms" "$http_code" "$stats"
+            level="info"
+            msg="ping_ok=1 curl_http=${http_code} rtt_ms=${rtt_ms} ${PING_SUMMARY}"
+          else
+            curl_fail=$((curl_fail+1))
+            # status down (endpoint)
+            queue_result "$name" down "$SCHED_NEXT" "$now" "$now" "$rtt_ms" "$http_code" "$stats"
+            level="warn"
+            msg="ping_ok=1 curl_fail=1 curl_http=${http_code} rtt_ms=${rtt_ms} ${PING_SUMMARY}"
+          fi
+          ;;
+        0)
+          ping_fail=$((ping_fail+1))
+          queue_result "$name" down "$SCHED_NEXT" "$now" 0 -1 0 "$stats"
+          ping_summary "$stats"
+          level="error"
+          msg="ping_ok=0 ${PING_SUMMARY}"
+          ;;
+        *)
+          # deadline reached: leave runtime untouched so the next run picks it up
+          deferred=$((deferred+1))
+          level="warn"
+          msg="deferred=1"
+          ;;
+      esac
+      queue_event "$level" "$name" "$msg"
+      echo "run: ${name} ${msg}"
+    done < <(printf '%s\n' "${queue[@]}" | probe_pool "$concurrency" "$deadline_ms")
+
+  end_ms="$(now_ms)"
   if [[ -n "$start_ms" && -n "$end_ms" ]]; then
     dur_ms=$((end_ms - start_ms))
   else
     dur_ms=$(( ($(now_epoch) - start_epoch) * 1000 ))
   fi
 
-  # Print summary line (WebUI parses this)
-  echo "total=${total} due=${due} skipped=${skipped} ping_ok=${ping_ok} ping_fail=${ping_fail} sent=${sent} curl_fail=${curl_fail} disabled=${disabled} force=${force} duration_ms=${dur_ms}"
+  # overrun: the run hit its deadline (targets deferred) or outlasted it
+  local overrun=0
+  if [[ "$deferred" -gt 0 ]] || (( deadline_sec > 0 && dur_ms > deadline_sec * 1000 )); then
+    overrun=1
+  fi
+  queue_run_metrics "$dur_ms" $((ping_ok + ping_fail)) "$overrun" "$now"
+  queue_run_end "$dur_ms" total="$total" due="$due" skipped="$skipped" disabled="$disabled" \
+    ping_ok="$ping_ok" ping_fail="$ping_fail" sent="$sent" curl_fail="$curl_fail" deferred="$deferred"
+  db_close
+
+  # next_due moved for the probed targets
+  if [[ "$due" -gt 0 ]]; then
+    write_state_snapshot
+    notify_scheduler
+  fi
+
+  # Summary line for the console/journal (the WebUI reads the runs row)
+  echo "total=${total} due=${due} skipped=${skipped} ping_ok=${ping_ok} ping_fail=${ping_fail} sent=${sent} curl_fail=${curl_fail} disabled=${disabled} force=${force} deferred=${deferred} duration_ms=${dur_ms}"
+}
+
+# ---- Scheduler daemon ----
+# Enabled targets live in a binary min-heap keyed on their due time (ms).
+# The loop sleeps until the earliest deadline and probes exactly the targets
+# that are due. While a batch runs, its targets stay parked in the heap at
+# now + interval; when the batch exits they are re-pushed from the committed
+# runtime.next_due. Targets deferred by the run deadline (next_due not
+# advanced) come back after 2, 4, 8 ... s, at most one interval
+# (SCHED_DEFERS counts consecutive deferrals), so a target that is deferred
+# on every run cannot make the loop fork a batch each second.
+# Heap entries whose key no longer matches SCHED_DUE are stale and skipped.
+HEAP_KEY=()
+HEAP_VAL=()
+HEAP_TOP_KEY=0
+HEAP_TOP_VAL=""
+declare -A SCHED_INTERVAL=()
+declare -A SCHED_DUE=()
+declare -A SCHED_INFLIGHT=()
+declare -A SCHED_BATCHES=()
+declare -A SCHED_DEFERS=()
+SCHED_RELOAD=1
+SCHED_STOP=0
+
+heap_push() {
+  # heap_push <due_ms> <name>
+  local i=${#HEAP_KEY[@]} p k v
+  HEAP_KEY[i]="$1"
+  HEAP_VAL[i]="$2"
+  while [[ "$i" -gt 0 ]]; do
+    p=$(( (i - 1) / 2 ))
+    if [[ "${HEAP_KEY[p]}" -le "${HEAP_KEY[i]}" ]]; then
+      break
+    fi
+    k="${HEAP_KEY[p]}"; v="${HEAP_VAL[p]}"
+    HEAP_KEY[p]="${HEAP_KEY[i]}"; HEAP_VAL[p]="${HEAP_VAL[i]}"
+    HEAP_KEY[i]="$k"; HEAP_VAL[i]="$v"
+    i="$p"
+  done
+}
+
+heap_pop() {
+  # Remove the earliest entry into HEAP_TOP_KEY/HEAP_TOP_VAL
+  local n=${#HEAP_KEY[@]} i=0 l r m k v
+  HEAP_TOP_KEY="${HEAP_KEY[0]}"
+  HEAP_TOP_VAL="${HEAP_VAL[0]}"
+  n=$((n - 1))
+  HEAP_KEY[0]="${HEAP_KEY[n]}"
+  HEAP_VAL[0]="${HEAP_VAL[n]}"
+  unset 'HEAP_KEY[n]' 'HEAP_VAL[n]'
+  while true; do
+    l=$((2 * i + 1)); r=$((l + 1)); m="$i"
+    if [[ "$l" -lt "$n" && "${HEAP_KEY[l]}" -lt "${HEAP_KEY[m]}" ]]; then m="$l"; fi
+    if [[ "$r" -lt "$n" && "${HEAP_KEY[r]}" -lt "${HEAP_KEY[m]}" ]]; then m="$r"; fi
+    [[ "$m" -ne "$i" ]] || break
+    k="${HEAP_KEY[m]}"; v="${HEAP_VAL[m]}"
+    HEAP_KEY[m]="${HEAP_KEY[i]}"; HEAP_VAL[m]="${HEAP_VAL[i]}"
+    HEAP_KEY[i]="$k"; HEAP_VAL[i]="$v"
+    i="$m"
+  done
+}
+
+sched_load() {
+  # (Re)build the heap from enabled targets and runtime.next_due
+  local name interval next_due due_ms
+  local -A prev_due=()
+  for name in "${!SCHED_DUE[@]}"; do
+    prev_due[$name]="${SCHED_DUE[$name]}"
+  done
+
+  HEAP_KEY=()
+  HEAP_VAL=()
+  SCHED_INTERVAL=()
+  SCHED_DUE=()
+  while IFS='|' read -r name interval next_due; do
+    [[ -n "$name" ]] || continue
+    due_ms=$(( ${next_due:-0} * 1000 ))
+    # a batch still running has not committed its next_due yet
+    # (nor has a deferred target's backoff run out)
+    if [[ ( -n "${SCHED_INFLIGHT[$name]:-}" || -n "${SCHED_DEFERS[$name]:-}" ) && -n "${prev_due[$name]:-}" ]]; then
+      [[ "${prev_due[$name]}" -le "$due_ms" ]] || due_ms="${prev_due[$name]}"
+    fi
+    SCHED_INTERVAL[$name]="$interval"
+    SCHED_DUE[$name]="$due_ms"
+    heap_push "$due_ms" "$name"
+  done < <(sqlite3 -noheader -batch "${DB}" \
+    "SELECT t.name, t.interval, COALESCE(r.next_due,0)
+     FROM targets t LEFT JOIN runtime r ON r.name=t.name
+     WHERE t.enabled=1;")
+}
+
+sched_reap() {
+  # Collect finished batches and re-push their targets from runtime.next_due
+  local pid rc name in_list="" next_due due_ms now k delay
+  local -a names
+  for pid in "${!SCHED_BATCHES[@]}"; do
+    ! kill -0 "$pid" 2>/dev/null || continue
+    rc=0
+    wait "$pid" 2>/dev/null || rc=$?
+    # 127: already collected by `wait -n` in the main loop
+    if [[ "$rc" -ne 0 && "$rc" -ne 127 ]]; then
+      log_info "scheduler: batch pid=${pid} exited rc=${rc}"
+    fi
+    IFS=',' read -ra names <<<"${SCHED_BATCHES[$pid]}"
+    unset 'SCHED_BATCHES[$pid]'
+    for name in "${names[@]}"; do
+      unset 'SCHED_INFLIGHT[$name]'
+      [[ -n "${SCHED_INTERVAL[$name]:-}" ]] || continue
+      in_list="${in_list:+${in_list},}'${name//\'/\'\'}'"
+    done
+  done
+  [[ -n "$in_list" ]] || return 0
+
+  now="$(now_ms)"
+  while IFS='|' read -r name next_due; do
+    [[ -n "$name" && -n "${SCHED_INTERVAL[$name]:-}" ]] || continue
+    due_ms=$(( ${next_due:-0} * 1000 ))
+    if [[ "$due_ms" -lt "$now" ]]; then
+      # deferred: back off 2, 4, 8 ... s, capped at the interval
+      k=$(( ${SCHED_DEFERS[$name]:-0} + 1 ))
+      SCHED_DEFERS[$name]="$k"
+      [[ "$k" -le 16 ]] || k=16
+      delay=$(( 1 << k ))
+      [[ "$delay" -le "${SCHED_INTERVAL[$name]}" ]] || delay="${SCHED_INTERVAL[$name]}"
+      due_ms=$(( now + delay * 1000 ))
+    else
+      unset 'SCHED_DEFERS[$name]'
+    fi
+    SCHED_DUE[$name]="$due_ms"
+    heap_push "$due_ms" "$name"
+  done < <(sqlite3 -noheader -batch "${DB}" \
+    "SELECT t.name, COALESCE(r.next_due,0)
+     FROM targets t LEFT JOIN runtime r ON r.name=t.name
+     WHERE t.name IN (${in_list});")
+}
+
+cmd_daemon() {
+  ensure_exists
+
+  [[ "$SCHED_MAX_BATCHES" =~ ^[0-9]+$ && "$SCHED_MAX_BATCHES" -ge 1 ]] || die "ERROR: INTERHEART_SCHED_MAX_BATCHES must be >= 1"
+  local batch_conc=$(( RUN_CONCURRENCY / SCHED_MAX_BATCHES ))
+  [[ "$batch_conc" -ge 1 ]] || batch_conc=1
+
+  echo "$$" >"${SCHED_PID_FILE}"
+  trap 'SCHED_RELOAD=1' HUP
+  trap 'SCHED_STOP=1' TERM INT
+  # our own batches must not wake us up again
+  SCHED_NOTIFY=0
+
+  log_info "scheduler: started pid=$$ concurrency=${RUN_CONCURRENCY} batches=${SCHED_MAX_BATCHES} deadline=${RUN_DEADLINE_SEC}s"
+
+  local now wait_ms csv n name sleeper pid last_load=0
+  while [[ "$SCHED_STOP" -eq 0 ]]; do
+    [[ ${#SCHED_BATCHES[@]} -eq 0 ]] || sched_reap
+
+    now="$(now_ms)"
+    if [[ "$SCHED_RELOAD" -eq 1 || $((now - last_load)) -ge $((SCHED_RESYNC_SEC * 1000)) ]]; then
+      SCHED_RELOAD=0
+      last_load="$now"
+      sched_load
+      log_info "scheduler: loaded ${#SCHED_INTERVAL[@]} enabled targets"
+    fi
+
+    # Pop everything that is due and probe it as one concurrent batch. At the
+    # batch cap, due targets wait in the heap until a running batch exits.
+    csv=""
+    n=0
+    while [[ ${#SCHED_BATCHES[@]} -lt "$SCHED_MAX_BATCHES" && ${#HEAP_KEY[@]} -gt 0 && "${HEAP_KEY[0]}" -le "$now" ]]; do
+      heap_pop
+      name="$HEAP_TOP_VAL"
+      [[ -n "${SCHED_INTERVAL[$name]:-}" && "${SCHED_DUE[$name]:-}" == "$HEAP_TOP_KEY" ]] || continue
+      [[ -z "${SCHED_INFLIGHT[$name]:-}" ]] || continue
+      csv="${csv:+${csv},}${name}"
+      n=$((n + 1))
+      SCHED_INFLIGHT[$name]=1
+      SCHED_DUE[$name]=$(( now + ${SCHED_INTERVAL[$name]} * 1000 ))
+      heap_push "${SCHED_DUE[$name]}" "$name"
+    done
+    if [[ "$n" -gt 0 ]]; then
+      # probe in the background so a slow batch never delays the next deadline
+      ( cmd_run_now --targets "$csv" --concurrency "$batch_conc" --trigger timer ) &
+      SCHED_BATCHES[$!]="$csv"
+    fi
+
+    # Sleep until the next deadline (or until a batch exits while at the cap);
+    # SIGHUP/SIGTERM and batch exits interrupt the wait
+    if [[ ${#SCHED_BATCHES[@]} -ge "$SCHED_MAX_BATCHES" || ${#HEAP_KEY[@]} -eq 0 ]]; then
+      wait_ms=$(( SCHED_RESYNC_SEC * 1000 ))
+    else
+      wait_ms=$(( HEAP_KEY[0] - $(now_ms) ))
+    fi
+    [[ "$wait_ms" -gt 0 ]] || continue
+    [[ "$wait_ms" -le $((SCHED_RESYNC_SEC * 1000)) ]] || wait_ms=$((SCHED_RESYNC_SEC * 1000))
+    sleep "$(printf '%d.%03d' $((wait_ms / 1000)) $((wait_ms % 1000)))" &
+    sleeper=$!
+    wait -n 2>/dev/null || true
+    kill "$sleeper" 2>/dev/null || true
+    wait "$sleeper" 2>/dev/null || true
+  done
+
+  wait || true
+  rm -f "${SCHED_PID_FILE}"
+  log_info "scheduler: stopped"
 }
 
 main() {
@@ -629,8 +1144,8 @@ main() {
       cmd_add "$1" "$2" "$3" "$4"
       ;;
     remove)
-      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart remove <name>"
-      cmd_remove "$1"
+      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart remove <name> | --names <a,b,...|->"
+      cmd_remove "$@"
       ;;
     list)
       cmd_list
@@ -647,24 +1162,32 @@ main() {
       cmd_edit "$1" "$2" "$3" "$4" "$5" "$6"
       ;;
     disable)
-      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart disable <name>"
-      cmd_disable "$1"
+      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart disable <name> | --names <a,b,...|->"
+      cmd_disable "$@"
       ;;
     enable)
-      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart enable <name>"
-      cmd_enable "$1"
+      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart enable <name> | --names <a,b,...|->"
+      cmd_enable "$@"
       ;;
     set-target-interval)
       [[ $# -ge 2 ]] || die "ERROR: Usage: interheart set-target-interval <name> <interval_seconds>"
       cmd_set_interval "$1" "$2"
       ;;
     test)
-      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart test <name>"
-      cmd_test "$1"
+      [[ $# -ge 1 ]] || die "ERROR: Usage: interheart test <name> | --names <a,b,...|->"
+      if [[ "$1" == "--names" ]]; then
+        read_names_arg "${2:-}"
+        cmd_test "${BATCH_NAMES[@]}"
+      else
+        cmd_test "$1"
+      fi
       ;;
     run-now)
       cmd_run_now "$@"
       ;;
+    daemon)
+      cmd_daemon
+      ;;
     *)
       die "ERROR: Unknown command: ${cmd} (try: interheart --help)"
       ;;
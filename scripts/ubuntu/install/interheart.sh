@@ -22,8 +22,8 @@ detect_installed(){
 }
 
 stop_services(){
-  systemctl stop interheart.timer interheart.service interheart-webui.service 2>/dev/null || true
-  systemctl disable interheart.timer interheart.service interheart-webui.service 2>/dev/null || true
+  systemctl stop interheart.timer interheart.service interheart-scheduler.service interheart-webui.service 2>/dev/null || true
+  systemctl disable interheart.timer interheart.service interheart-scheduler.service interheart-webui.service 2>/dev/null || true
 }
 
 uninstall_all(){
@@ -1,16 +1,49 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, render_template, Response, send_file
+from flask import Flask, request, jsonify, render_template, Response, send_file, has_request_context
+from flask.json.provider import DefaultJSONProvider
 import os
+import bisect
+import collections
+import csv
+import io
 import subprocess
 import time
 import json
 import re
+import shutil
+import signal
 import socket
+import sqlite3
+import sys
+import tempfile
+import ipaddress
+import itertools
 import datetime
+import errno
+import gzip
 import logging
-from io import BytesIO
+import queue
+import threading
+import zlib
 from pathlib import Path
 
+import datastore
+import icmp
+import statefile
+from datastore import DataError, mask_endpoint
+from statefile import compute_snapshots_batch, human_ts
+
+# Optional speed-ups, used when installed: orjson encodes API responses,
+# brotli adds `br` to the negotiated response encodings.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
@@ -27,10 +60,27 @@ BIND_HOST = os.environ.get("WEBUI_BIND", "0.0.0.0")
 BIND_PORT = int(os.environ.get("WEBUI_PORT", "8088"))
 
 LOG_LINES_DEFAULT = 200
+# /logs reads a ring of parsed journal entries kept by one `journalctl -f`
+# follower (started on first use, stopped after LOG_FOLLOW_IDLE_SECONDS
+# without readers) instead of running journalctl per request.
+LOG_RING_SIZE = int(os.environ.get("INTERHEART_LOG_RING", "5000"))
+LOG_FOLLOW_IDLE_SECONDS = 600
+# /api/logs-export streams from journalctl: newest N lines or a time range
+LOG_EXPORT_MAX_LINES = 500000
+LOG_EXPORT_MAX_HOURS = 24 * 90
+# PDF exports are built in memory (reportlab), so they stay smaller
+LOG_EXPORT_MAX_PDF_LINES = 20000
 STATE_POLL_SECONDS = 2
+# Above this many targets the page renders only the first page and the
+# table pages, sorts and filters through /state?limit=... (state_view)
+STATE_PAGE_SIZE = max(10, int(os.environ.get("INTERHEART_PAGE_SIZE", "200")))
+STATE_VIEW_ARGS = ("limit", "offset", "sort", "dir", "status", "q", "fields")
+STATE_VIEW_MAX_LIMIT = 1000
 
 STATE_DIR = Path(os.environ.get("INTERHEART_STATE_DIR", "/var/lib/interheart"))
 DB_PATH = STATE_DIR / "state.db"
+# written by the runner after each run (statefile.py); served by /state
+STATE_SNAPSHOT_FILE = statefile.snapshot_path(DB_PATH)
 RUN_META_FILE = STATE_DIR / "run_meta.json"
 RUN_OUT_FILE = STATE_DIR / "run_last_output.txt"
 
@@ -42,10 +92,44 @@ _LAST_DEBUG_TS = 0
 SCAN_META_FILE = STATE_DIR / "scan_meta.json"
 SCAN_OUT_FILE = STATE_DIR / "scan_last_output.txt"
 
-SUMMARY_RE = re.compile(
-    r"total=(\d+)\s+due=(\d+)\s+skipped=(\d+)\s+ping_ok=(\d+)\s+ping_fail=(\d+)\s+sent=(\d+)\s+curl_fail=(\d+)"
+# Network scan profiles (UI "Speed"): ICMP echo rate, attempts per host,
+# how long to wait for late replies after the last packet of a subnet, and
+# the worker count for the `ping` fallback (no ICMP socket available).
+SCAN_PROFILES = {
+    "safe": {"rate": 500, "attempts": 2, "wait": 2.0, "workers": 32},
+    "normal": {"rate": 8000, "attempts": 2, "wait": 1.0, "workers": 128},
+    "fast": {"rate": 20000, "attempts": 1, "wait": 1.0, "workers": 256},
+}
+SCAN_MIN_PREFIX = 16
+SCAN_DNS_WORKERS = 32
+SCAN_DNS_TIMEOUT = 5.0
+SCAN_MAC_PREFIX_FILES = (
+    "/usr/share/nmap/nmap-mac-prefixes",
+    "/usr/share/ieee-data/oui.txt",
 )
 
+# Read-only SQLite pool for all WebUI reads (writes go through datastore.py)
+DB_POOL_SIZE = int(os.environ.get("INTERHEART_DB_POOL_SIZE", "4"))
+DB_READ_TIMEOUT = 2.0
+DB_MMAP_BYTES = 64 * 1024 * 1024
+
+# Live events (SSE): one background thread watches DB/run/scan state and fans
+# out to all connected browsers, instead of every tab polling on its own.
+EVENTS_TICK_SECONDS = 0.5
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_MAX_CLIENTS = int(os.environ.get("INTERHEART_EVENTS_MAX_CLIENTS", "32"))
+EVENTS_QUEUE_SIZE = 256
+
+# Response compression (compress_response): text/JSON bodies of at least
+# this many bytes go out gzip- or brotli-encoded when the client accepts it.
+COMPRESS_MIN_BYTES = int(os.environ.get("INTERHEART_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_MIMETYPES = frozenset((
+    "application/json", "text/html", "text/plain", "text/csv", "text/css",
+    "text/javascript", "application/javascript",
+))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
 def read_version() -> str:
     # try repo root VERSION first
     try:
@@ -115,45 +199,174 @@ def _debug_log(msg: str, force: bool = False):
 def die_json(msg: str, code: int = 500):
     return jsonify({"ok": False, "message": msg}), code
 
-def run_cmd(args):
+def run_cmd(args, input_text=None):
     cmd = [CLI] + args
-    p = subprocess.run(cmd, capture_output=True, text=True)
+    p = subprocess.run(cmd, capture_output=True, text=True, input=input_text)
     out = (p.stdout or "").strip()
     err = (p.stderr or "").strip()
     merged = out + (("\n" + err) if err else "")
     return p.returncode, merged.strip()
 
-def journalctl_lines(lines: int) -> str:
-    cmd = ["journalctl", "-t", "interheart", "-n", str(lines), "--no-pager", "--output=short-iso"]
-    p = subprocess.run(cmd, capture_output=True, text=True)
-    if p.returncode != 0:
-        raise RuntimeError((p.stderr or "journalctl failed").strip())
-
-    raw = (p.stdout or "").splitlines()
-    out_lines = []
-    rx = re.compile(r"^(\d{4}-\d{2}-\d{2}T\S+)\s+\S+\s+interheart\[\d+\]:\s*(.*)$")
-    for line in raw:
-        line = line.rstrip()
-        m = rx.match(line)
-        if m:
-            out_lines.append(f"{m.group(1)} {m.group(2)}")
-        else:
-            out_lines.append(line)
-    return "\n".join(out_lines).strip()
+def _log_level(text: str, priority) -> str:
+    """error | warn | info: journal PRIORITY when it says so, else the text."""
+    try:
+        prio = int(priority)
+    except (TypeError, ValueError):
+        prio = 6
+    ll = text.lower()
+    if prio <= 3 or "error" in ll or "fail" in ll:
+        return "error"
+    if prio == 4 or "warn" in ll:
+        return "warn"
+    return "info"
+
+
+def _log_match(entry, level: str, q: str) -> bool:
+    """entry = (seq, cursor, text, level, text.lower()); q lower-cased."""
+    if level in ("error", "warn", "info") and entry[3] != level:
+        return False
+    return not q or q in entry[4]
+
 
-def parse_run_summary(text: str):
-    m = SUMMARY_RE.search(text or "")
-    if not m:
+def _journal_entry(line: bytes):
+    """(cursor, "ts message", level) of one `journalctl -o json` line, or None."""
+    try:
+        rec = json.loads(line)
+    except ValueError:
         return None
-    return {
-        "total": int(m.group(1)),
-        "due": int(m.group(2)),
-        "skipped": int(m.group(3)),
-        "ping_ok": int(m.group(4)),
-        "ping_fail": int(m.group(5)),
-        "sent": int(m.group(6)),
-        "curl_fail": int(m.group(7)),
-    }
+    msg = rec.get("MESSAGE") or ""
+    if isinstance(msg, list):  # non-UTF-8 messages come as byte arrays
+        msg = bytes(msg).decode("utf-8", "replace")
+    try:
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(int(rec["__REALTIME_TIMESTAMP"]) / 1e6))
+    except (KeyError, ValueError):
+        ts = "-"
+    return rec.get("__CURSOR") or "", f"{ts} {msg.rstrip()}", _log_level(msg, rec.get("PRIORITY"))
+
+
+class JournalReader:
+    """Bounded ring of parsed `interheart` journal entries.
+
+    Primed once with the last LOG_RING_SIZE entries, then fed by a single
+    `journalctl -f -o json` follower that resumes from the last cursor after
+    it exits (error, idle stop). Readers only touch the ring: a poll with
+    `after=<cursor>` walks the entries newer than that cursor.
+    """
+
+    def __init__(self, size: int = LOG_RING_SIZE):
+        self.ring = collections.deque(maxlen=size)
+        self.seq_of = {}  # cursor -> seq, for the entries in the ring
+        self.error = ""
+        self._seq = 0
+        self._cursor = ""
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._last_read = 0.0
+
+    def _cmd(self, *extra):
+        return ["journalctl", "-t", "interheart", "-o", "json", "--no-pager", *extra]
+
+    def _add(self, line: bytes):
+        parsed = _journal_entry(line)
+        if not parsed:
+            return
+        cursor, text, level = parsed
+        with self._lock:
+            if len(self.ring) == self.ring.maxlen:
+                self.seq_of.pop(self.ring[0][1], None)
+            self._seq += 1
+            self.ring.append((self._seq, cursor, text, level, text.lower()))
+            self.seq_of[cursor] = self._seq
+            self._cursor = cursor or self._cursor
+
+    def _ensure(self):
+        self._last_read = time.time()
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            primed = self._seq > 0
+            cursor = self._cursor
+        if not primed:
+            p = subprocess.run(self._cmd("-n", str(self.ring.maxlen)), capture_output=True, timeout=30)
+            if p.returncode != 0:
+                self.error = (p.stderr.decode(errors="replace") or "journalctl failed").strip()
+                return
+            for line in p.stdout.splitlines():
+                self._add(line)
+            with self._lock:
+                cursor = self._cursor
+        extra = ["-f", f"--after-cursor={cursor}"] if cursor else ["-f", "-n", "0"]
+        try:
+            proc = subprocess.Popen(self._cmd(*extra), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self.error = str(e)
+            return
+        self.error = ""
+        self._thread = threading.Thread(target=self._follow, args=(proc,), name="interheart-journal", daemon=True)
+        self._thread.start()
+
+    def _follow(self, proc):
+        import select
+        buf = b""
+        try:
+            while True:
+                r, _, _ = select.select([proc.stdout], [], [], 5.0)
+                if not r:
+                    if time.time() - self._last_read > LOG_FOLLOW_IDLE_SECONDS:
+                        return
+                    continue
+                chunk = os.read(proc.stdout.fileno(), 65536)
+                if not chunk:
+                    self.error = "journalctl follower exited"
+                    return
+                buf += chunk
+                *lines, buf = buf.split(b"\n")
+                for line in lines:
+                    if line:
+                        self._add(line)
+        finally:
+            try:
+                proc.kill()
+                proc.wait(timeout=2)
+            except Exception:
+                pass
+
+    def read(self, after: str = "", limit: int = LOG_LINES_DEFAULT, level: str = "all", q: str = "") -> dict:
+        """Matching entries (oldest first, at most `limit`) after `after`.
+
+        `cursor` is the newest entry in the ring, matching or not: pass it as
+        `after` next time. `reset` means `after` is no longer in the ring (or
+        from another WebUI process) and the result is a fresh tail.
+        """
+        self._ensure()
+        q = (q or "").strip().lower()
+        level = (level or "all").strip().lower()
+        with self._lock:
+            start, reset = 0, False
+            if after:
+                seq = self.seq_of.get(after)
+                if seq is None:
+                    reset = True
+                elif self.ring:
+                    start = seq - self.ring[0][0] + 1
+            out = collections.deque(
+                (e[2], e[3]) for e in itertools.islice(self.ring, start, None) if _log_match(e, level, q)
+            )
+            while len(out) > limit:
+                out.popleft()
+            cursor = self.ring[-1][1] if self.ring else after
+        return {"entries": list(out), "cursor": cursor, "reset": reset, "error": self.error}
+
+
+JOURNAL = JournalReader()
+
 
 def pid_is_running(pid: int) -> bool:
     if not pid or pid <= 0:
@@ -211,294 +424,246 @@ def load_scan_meta() -> dict:
     return {}
 
 def save_scan_meta(meta: dict):
+    # Written while the scan worker streams results: replace atomically so
+    # readers never see a half-written file.
     ensure_state_dir()
     try:
-        SCAN_META_FILE.write_text(json.dumps(meta), encoding="utf-8")
+        tmp = SCAN_META_FILE.with_name(f".{SCAN_META_FILE.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
         try:
-            os.chmod(str(SCAN_META_FILE), 0o644)
+            os.chmod(str(tmp), 0o644)
         except Exception:
             pass
+        os.replace(str(tmp), str(SCAN_META_FILE))
     except Exception:
         pass
 
-def mask_endpoint(url: str) -> str:
-    if not url:
-        return "-"
-    # scheme://host[:port]/*** (hide path/query)
-    try:
-        scheme = re.split(r"://", url, maxsplit=1)[0]
-        rest = re.sub(r"^[a-zA-Z]+://", "", url)
-        host = rest.split("/", 1)[0]
-        if scheme and host:
-            return f"{scheme}://{host}/***"
-    except Exception:
-        pass
-    return "***"
-
-# --- Data from CLI: list/status/get ---
-def parse_list_targets(list_output: str):
-    """Parse `interheart list` output.
+# ---- SQLite read pool ----
+class ReadPool:
+    """Small pool of long-lived read-only connections to state.db.
 
-    The CLI prints a simple fixed-width table:
-      NAME IP INTERVAL ENABLED ENDPOINT
-      ---------------- ...
-      <rows>
+    The Flask dev server runs each request on a fresh thread, so connections
+    are checked out/in rather than pinned to a thread; a connection is only
+    ever used by one thread at a time. Each one is opened once with
+    mode=ro + query_only, mmap I/O and a statement cache, so the hot path
+    has no connect/PRAGMA/sqlite_master overhead.
 
-    Older versions printed a long dashed separator line; we tolerate both.
+    busy_timeout is 0 on purpose: lock waits are retried here with backoff,
+    which makes contention with the writer visible in stats() instead of
+    disappearing inside SQLite.
     """
-    targets = []
-    saw_header = False
-    for raw in (list_output or "").splitlines():
-        line = (raw or "").rstrip("\n").rstrip()
-        if not line.strip():
-            continue
-
-        # Header line
-        if line.strip().startswith("NAME"):
-            saw_header = True
-            continue
-
-        # Separator line (either long or column dashes)
-        if set(line.strip()) == {"-"} or line.strip().startswith("----------------"):
-            saw_header = True
-            continue
-
-        # If the CLI prints any preamble before the table, ignore until header seen.
-        if not saw_header:
-            continue
-
-        parts = line.split()
-        if len(parts) < 5:
-            continue
-
-        name = parts[0]
-        ip = parts[1]
 
-        interval_raw = parts[2]
-        enabled_raw = parts[3]
-        endpoint_masked = " ".join(parts[4:])
-
-        interval = 60
-        if interval_raw.endswith("s") and interval_raw[:-1].isdigit():
-            interval = int(interval_raw[:-1])
-        elif interval_raw.isdigit():
-            interval = int(interval_raw)
-
-        enabled = 1 if str(enabled_raw).strip() == "1" else 0
-
-        targets.append({
-            "name": name,
-            "ip": ip,
-            "interval": interval,
-            "enabled": enabled,
-            "endpoint_masked": endpoint_masked or "***",
-            "snapshots": compute_snapshots(DB_PATH, name, enabled, days=3),
-        })
-
-    return targets
-
-def parse_status(status_output: str):
-    """Parse `interheart status` output.
-
-    Current CLI prints:
-      NAME STATUS PING RESP LAT(ms) NEXT_DUE
-      <rows>
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "opened": 0,
+            "closed": 0,
+            "reads": 0,
+            "busy_retries": 0,
+            "busy_wait_ms": 0,
+            "busy_failures": 0,
+            "errors": 0,
+            "stale_served": 0,
+        }
 
-    Older formats had a long separator line; we tolerate both.
-    """
-    state = {}
-    saw_header = False
-    for raw in (status_output or "").splitlines():
-        line = (raw or "").rstrip("\n").rstrip()
-        if not line.strip():
-            continue
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _open(self):
+        con = sqlite3.connect(
+            f"file:{self.path}?mode=ro",
+            uri=True,
+            timeout=0,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA query_only=1;")
+        con.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES};")
+        con.execute("PRAGMA busy_timeout=0;")
+        self._count("opened")
+        return con, self.path.stat().st_ino
+
+    def _checkout(self):
+        ino = self.path.stat().st_ino  # FileNotFoundError when the DB is gone
+        with self._lock:
+            while self._idle:
+                con, con_ino = self._idle.pop()
+                if con_ino == ino:
+                    return con, con_ino
+                # DB file was replaced (restore/re-init): drop the old handle
+                self._stats["closed"] += 1
+                _SCHEMA_CACHE.pop(id(con), None)
+                con.close()
+        return self._open()
+
+    def _checkin(self, entry, healthy: bool):
+        con, _ino = entry
+        if healthy:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(entry)
+                    return
+        self._count("closed")
+        _SCHEMA_CACHE.pop(id(con), None)
+        con.close()
+
+    def read(self, fn):
+        """Run fn(con) on a pooled connection; retry while the DB is busy."""
+        deadline = time.monotonic() + DB_READ_TIMEOUT
+        delay = 0.005
+        self._count("reads")
+        while True:
+            entry = self._checkout()
+            healthy = True
+            try:
+                return fn(entry[0])
+            except sqlite3.OperationalError as e:
+                msg = str(e).lower()
+                if "locked" not in msg and "busy" not in msg:
+                    # SQL-level error (e.g. missing table): connection is fine
+                    self._count("errors")
+                    raise
+                if entry[0].in_transaction:
+                    entry[0].execute("ROLLBACK;")
+                if time.monotonic() + delay > deadline:
+                    self._count("busy_failures")
+                    raise
+                self._count("busy_retries")
+                self._count("busy_wait_ms", int(delay * 1000))
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            except sqlite3.Error:
+                healthy = False
+                self._count("errors")
+                raise
+            finally:
+                self._checkin(entry, healthy)
+
+    def note_stale(self):
+        self._count("stale_served")
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["idle"] = len(self._idle)
+        out["size"] = self.size
+        return out
 
-        if line.strip().startswith("NAME"):
-            saw_header = True
-            continue
 
-        if set(line.strip()) == {"-"} or line.strip().startswith("----------------"):
-            saw_header = True
-            continue
+_READ_POOLS = {}
+_READ_POOLS_LOCK = threading.Lock()
+# id(connection) -> (schema_version, table names); see _has_table()
+_SCHEMA_CACHE = {}
 
-        if not saw_header:
-            continue
 
-        parts = line.split()
-        # Expected columns from CLI `status`:
-        # NAME STATUS PING RESP LAT(ms) NEXT_DUE
-        if len(parts) < 6:
-            continue
+def read_pool(db_path: Path = DB_PATH) -> ReadPool:
+    key = str(db_path)
+    with _READ_POOLS_LOCK:
+        pool = _READ_POOLS.get(key)
+        if pool is None:
+            pool = _READ_POOLS[key] = ReadPool(db_path, DB_POOL_SIZE)
+        return pool
 
-        name = parts[0]
-        status = parts[1]
-        last_ping = parts[2]
-        last_sent = parts[3]
-        lat_ms = parts[4]
-
-        state[name] = {
-            "status": status,
-            "last_ping_epoch": int(last_ping) if str(last_ping).isdigit() else 0,
-            "last_sent_epoch": int(last_sent) if str(last_sent).isdigit() else 0,
-            "last_rtt_ms": int(lat_ms) if str(lat_ms).lstrip("-").isdigit() else -1,
-        }
 
-    return state
-
-def human_ts(epoch: int):
-    if not epoch or epoch <= 0:
-        return "-"
-    try:
-        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch))
-    except Exception:
-        return "-"
-
-def merged_targets():
-    rc_list, list_out = run_cmd(["list"])
-    targets = parse_list_targets(list_out)
-
-    rc_st, st_out = run_cmd(["status"])
-    state = parse_status(st_out)
-
-    merged = []
-    for t in targets:
-        st = state.get(t["name"], {})
-        status = st.get("status", "unknown")
-        # When a target has just been enabled, the DB may still contain last_status='disabled'
-        # until the first run updates it. Treat that as STARTING so the UI does not flip to DISABLED.
-        if int(t.get("enabled") or 0) == 1 and str(status).lower() == "disabled":
-            status = "starting"
-        last_ping_epoch = st.get("last_ping_epoch", 0)
-        last_sent_epoch = st.get("last_sent_epoch", 0)
-
-        merged.append({
-            "name": t["name"],
-            "ip": t["ip"],
-            "interval": t["interval"],
-            "status": status,
-            "enabled": int(t.get("enabled") or 0),
-            "last_ping_human": human_ts(last_ping_epoch),
-            "last_response_human": human_ts(last_sent_epoch),
-            "last_ping_epoch": last_ping_epoch,
-            "last_response_epoch": last_sent_epoch,
-            "last_rtt_ms": int(st.get("last_rtt_ms", -1) or -1),
-            # kept for info modal / masking
-            "endpoint_masked": t.get("endpoint_masked") or "-",
-            "snapshots": t.get("snapshots") or [],
-        })
-        # Default sort: IP ascending
-    def ip_key(ip: str):
-        try:
-            a,b,c,d = [int(x) for x in (ip or "0.0.0.0").split(".")]
-            return (a,b,c,d)
-        except Exception:
-            return (999,999,999,999)
-
-    merged.sort(key=lambda x: ip_key(x.get("ip")))
-    return merged
+def db_read(fn, db_path: Path = DB_PATH):
+    """Convenience wrapper: read_pool(db_path).read(fn)."""
+    return read_pool(db_path).read(fn)
 
 
 # ---- state caching (avoid wiping the UI on transient CLI/DB lock errors) ----
 _LAST_STATE_CACHE = {"updated": 0, "targets": []}
 
 def merged_targets_safe():
-    """Return merged targets, preferring direct SQLite reads.
+    """Return (ok, targets) for the table, read directly from state.db.
 
-    We previously depended on parsing CLI output (list/status). That turned out
-    to be fragile across CLI format changes and could cause the WebUI to show
-    an empty table until a "Run now" happened.
-
-    This function reads from /var/lib/interheart/state.db directly.
     If the DB is temporarily locked (e.g. while a run updates), we serve the
     last known good cached state instead of wiping the UI.
     """
     global _LAST_STATE_CACHE
 
-    # Prefer DB-backed state
     ok, rows = db_read_targets(DB_PATH)
     if ok and rows is not None:
-        # Edge case:
-        # The DB can exist but contain 0 rows in `targets` (e.g. state.db created,
-        # but targets were not imported/populated yet). In that situation the UI
-        # must not wipe the table on first load; we fall back to CLI if CLI has
-        # targets.
-        if len(rows) == 0:
-            try:
-                rc_list, list_out = run_cmd(["list"])
-                if rc_list == 0:
-                    cli_targets = parse_list_targets(list_out)
-                    if cli_targets:
-                        rc_st, st_out = run_cmd(["status"])
-                        state = parse_status(st_out) if rc_st == 0 else {}
-                        merged = []
-                        for t in cli_targets:
-                            st = state.get(t["name"], {})
-                            status = st.get("status", "unknown")
-                            if int(t.get("enabled") or 0) == 1 and str(status).lower() == "disabled":
-                                status = "starting"
-                            last_ping_epoch = st.get("last_ping_epoch", 0)
-                            last_sent_epoch = st.get("last_sent_epoch", 0)
-                            merged.append({
-                                "name": t["name"],
-                                "ip": t["ip"],
-                                "interval": t["interval"],
-                                "status": status,
-                                "enabled": int(t.get("enabled") or 0),
-                                "last_ping_human": human_ts(last_ping_epoch),
-                                "last_response_human": human_ts(last_sent_epoch),
-                                "last_ping_epoch": last_ping_epoch,
-                                "last_response_epoch": last_sent_epoch,
-                                "last_rtt_ms": int(st.get("last_rtt_ms", -1) or -1),
-                                "endpoint_masked": t.get("endpoint_masked") or "-",
-                                "snapshots": t.get("snapshots") or [],
-                            })
-                        _LAST_STATE_CACHE = {"updated": int(time.time()), "targets": merged}
-                        return True, merged
-            except Exception:
-                # If CLI fallback fails, continue with DB rows (empty)
-                pass
-
         _LAST_STATE_CACHE = {"updated": int(time.time()), "targets": rows}
         return True, rows
 
-    # If DB read failed, serve cache if available
+    # If DB read failed, serve cache if available (counted in the pool stats,
+    # see /api/debug-state)
     if _LAST_STATE_CACHE.get("targets"):
+        if DB_PATH.exists():
+            read_pool(DB_PATH).note_stale()
+            _debug_log("state: DB read failed, serving cached targets")
         return False, _LAST_STATE_CACHE.get("targets")
+    return False, []
+
 
-    # Last resort: fall back to CLI parsing for fresh installs
+def _read_target_rows(con, since=None):
+    """/state target dicts (statefile.target_rows) with the cached schema."""
+    return statefile.target_rows(con, since=since, tables=_schema_names(con.cursor()))
+
+
+def parse_state_view(args) -> dict:
+    """Validated /state view arguments (paging, filter, sort, projection).
+
+    Raises ValueError with a message for the client on bad values.
+    """
     try:
-        rc_list, list_out = run_cmd(["list"])
-        rc_st, st_out = run_cmd(["status"])
-        if rc_list != 0 or rc_st != 0:
-            return False, []
-        targets = parse_list_targets(list_out)
-        state = parse_status(st_out)
-        merged = []
-        for t in targets:
-            st = state.get(t["name"], {})
-            status = st.get("status", "unknown")
-            if int(t.get("enabled") or 0) == 1 and str(status).lower() == "disabled":
-                status = "starting"
-            last_ping_epoch = st.get("last_ping_epoch", 0)
-            last_sent_epoch = st.get("last_sent_epoch", 0)
-            merged.append({
-                "name": t["name"],
-                "ip": t["ip"],
-                "interval": t["interval"],
-                "status": status,
-                "enabled": int(t.get("enabled") or 0),
-                "last_ping_human": human_ts(last_ping_epoch),
-                "last_response_human": human_ts(last_sent_epoch),
-                "last_ping_epoch": last_ping_epoch,
-                "last_response_epoch": last_sent_epoch,
-                "last_rtt_ms": int(st.get("last_rtt_ms", -1) or -1),
-                "endpoint_masked": t.get("endpoint_masked") or "-",
-                "snapshots": t.get("snapshots") or [],
-            })
-        _LAST_STATE_CACHE = {"updated": int(time.time()), "targets": merged}
-        return True, merged
-    except Exception:
-        return False, []
+        limit = int(args.get("limit") or STATE_PAGE_SIZE)
+        offset = int(args.get("offset") or 0)
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if not 1 <= limit <= STATE_VIEW_MAX_LIMIT or offset < 0:
+        raise ValueError(f"limit must be 1..{STATE_VIEW_MAX_LIMIT} and offset >= 0")
+    sort = (args.get("sort") or "ip").strip()
+    if sort not in datastore.PAGE_SORT_KEYS:
+        raise ValueError("sort must be one of " + ", ".join(datastore.PAGE_SORT_KEYS))
+    direction = (args.get("dir") or "asc").strip().lower()
+    if direction not in ("asc", "desc"):
+        raise ValueError("dir must be asc or desc")
+    statuses = tuple(s for s in (args.get("status") or "").lower().replace(" ", "").split(",") if s)
+    if any(s not in datastore.UI_STATUSES for s in statuses):
+        raise ValueError("status must be a comma list of " + ", ".join(datastore.UI_STATUSES))
+    fields = None
+    if args.get("fields"):
+        fields = tuple(f for f in args.get("fields").replace(" ", "").split(",") if f)
+        if any(f not in statefile.TARGET_FIELDS for f in fields):
+            raise ValueError("fields must be a comma list of " + ", ".join(statefile.TARGET_FIELDS))
+    return {
+        "limit": limit,
+        "offset": offset,
+        "sort": sort,
+        "dir": direction,
+        "statuses": statuses,
+        "q": (args.get("q") or "").strip()[:200],
+        "fields": fields,
+    }
+
+
+def db_read_state_page(db_path: Path, view: dict):
+    """(total, targets) for one /state view; raises on DB errors."""
+    if not db_path.exists():
+        return 0, []
+
+    def read(con):
+        total, rows = datastore.target_state_page(
+            con,
+            statuses=view["statuses"],
+            q=view["q"],
+            sort=view["sort"],
+            desc=view["dir"] == "desc",
+            limit=view["limit"],
+            offset=view["offset"],
+        )
+        return total, statefile.target_rows(
+            con, tables=_schema_names(con.cursor()), rows=rows, fields=view["fields"]
+        )
+
+    return db_read(read, db_path)
 
 
 def db_read_targets(db_path: Path):
@@ -506,82 +671,78 @@ def db_read_targets(db_path: Path):
 
     Returns (ok, targets). ok=False on transient errors (locked/unavailable).
     """
-    import sqlite3
-    # If the DB is missing (fresh install / not yet run), fall back to CLI.
-    # Returning an empty list here causes the UI to render an empty table
-    # until the first "Run now" creates/populates the DB.
+    # DB missing (fresh install, nothing added yet): not an error, but there
+    # is nothing to read either; callers serve the cache or an empty table.
     if not db_path.exists():
         return False, None
     try:
-        con = sqlite3.connect(str(db_path), timeout=2.0)
-        con.row_factory = sqlite3.Row
-        try:
-            con.execute("PRAGMA busy_timeout=2000;")
-        except Exception:
-            pass
-        cur = con.cursor()
-        cur.execute(
-            """
-            SELECT
-              t.name,
-              t.ip,
-              t.endpoint,
-              t.interval,
-              t.enabled,
-              COALESCE(r.status, 'unknown') AS last_status,
-              COALESCE(r.last_ping, 0) AS last_ping,
-              COALESCE(r.last_sent, 0) AS last_response,
-              COALESCE(r.last_rtt_ms, -1) AS last_latency
-            FROM targets t
-            LEFT JOIN runtime r ON r.name = t.name
-            ORDER BY t.ip ASC;
-            """
-        )
-        rows = cur.fetchall() or []
-
-        out = []
-        for r in rows:
-            enabled = int(r["enabled"] or 0)
-            status = (r["last_status"] or "unknown")
-
-            # UI rules:
-            # - enabled=0 => DISABLED
-            # - enabled=1 + status unknown => STARTING.. until first up/down
-            if enabled != 1:
-                status = "disabled"
-            else:
-                if str(status).lower() in ("unknown", ""):
-                    status = "starting"
-                if str(status).lower() == "disabled":
-                    status = "starting"
-
-            last_ping_epoch = _safe_int(r["last_ping"], 0)
-            last_resp_epoch = _safe_int(r["last_response"], 0)
-            last_rtt_ms = _safe_int(r["last_latency"], -1)
-
-            out.append({
-                "name": r["name"],
-                "ip": r["ip"],
-                "interval": _safe_int(r["interval"], 60),
-                "status": str(status),
-                "enabled": enabled,
-                "last_ping_human": human_ts(last_ping_epoch),
-                "last_response_human": human_ts(last_resp_epoch),
-                "last_ping_epoch": last_ping_epoch,
-                "last_response_epoch": last_resp_epoch,
-                "last_rtt_ms": last_rtt_ms,
-                "endpoint_masked": mask_endpoint(r["endpoint"] or ""),
-                "snapshots": compute_snapshots(db_path, r["name"], enabled, days=3),
-            })
-
-        return True, out
+        return True, db_read(_read_target_rows, db_path)
     except Exception:
         return False, None
-    finally:
+
+
+def db_state_rev(db_path: Path):
+    """Return the current state revision (state_seq.rev), or None.
+
+    None means the DB is missing, not migrated yet, or busy; callers then
+    serve a full /state payload without a version.
+    """
+    if not db_path.exists():
+        return None
+    try:
+        def _read(con):
+            if not _has_table(con.cursor(), "state_seq"):
+                return None
+            return con.execute("SELECT rev FROM state_seq WHERE id=1;").fetchone()
+
+        row = db_read(_read, db_path)
+        return int(row[0]) if row else None
+    except Exception:
+        return None
+
+
+def db_read_state_delta(db_path: Path, since: int):
+    """Return (ok, rev, changed_targets, removed_names) relative to `since`.
+
+    Revision and rows are read in one transaction, so `rev` is never newer
+    than the rows returned; a row changed after `rev` simply shows up again
+    in the next delta. When `since` predates pruned tombstones
+    (state_seq.floor) the delta could miss removals: ok is False with the
+    current `rev`, and the caller falls back to a full payload.
+    """
+    def _read(con):
+        if not _has_table(con.cursor(), "state_seq"):
+            return None
+        con.execute("BEGIN;")
         try:
-            con.close()
-        except Exception:
-            pass
+            row = con.execute("SELECT * FROM state_seq WHERE id=1;").fetchone()
+            if not row:
+                return None
+            rev = int(row["rev"])
+            if "floor" in row.keys() and int(since) < int(row["floor"] or 0):
+                return rev, None, None
+            changed = _read_target_rows(con, since=since) if rev > since else []
+            removed = [
+                r["name"] for r in con.execute(
+                    "SELECT name FROM state_removed WHERE rev > ? ORDER BY name;", (int(since),)
+                ).fetchall()
+            ]
+            return rev, changed, removed
+        finally:
+            if con.in_transaction:
+                con.execute("COMMIT;")
+
+    if not db_path.exists():
+        return False, None, [], []
+    try:
+        res = db_read(_read, db_path)
+    except Exception:
+        return False, None, [], []
+    if res is None:
+        return False, None, [], []
+    if res[1] is None:
+        return False, res[0], [], []
+    return (True,) + res
 
 
 # ---- API: info (DB-backed, uses history samples if present) ----
@@ -592,6 +753,28 @@ def _safe_int(v, default=0):
         return default
 
 
+def _schema_names(cur) -> frozenset:
+    """Table/view names, cached per connection; refreshed when the schema changes."""
+    con = cur.connection
+    ver = con.execute("PRAGMA schema_version;").fetchone()[0]
+    cached = _SCHEMA_CACHE.get(id(con))
+    if cached is None or cached[0] != ver:
+        names = frozenset(
+            r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view');")
+        )
+        cached = _SCHEMA_CACHE[id(con)] = (ver, names)
+    return cached[1]
+
+
+def _has_table(cur, table: str) -> bool:
+    return table in _schema_names(cur)
+
+
+def _history_tables(cur, start, end) -> list:
+    """Weekly history partitions overlapping [start, end], oldest first."""
+    return datastore.history_tables(_schema_names(cur), int(start), int(end))
+
+
 def compute_snapshots(db_path: Path, name: str, enabled_now: int, days: int = 3):
     """Return list of {day, state, label} for the last N days (including today).
 
@@ -602,64 +785,19 @@ def compute_snapshots(db_path: Path, name: str, enabled_now: int, days: int = 3)
       - gray: no samples and disabled
       - unknown: no samples and enabled
 
-    Heuristic, based on history samples.
+    Heuristic, based on history samples. Single-target wrapper around
+    compute_snapshots_batch(); /state uses the batch form directly.
     """
-    import sqlite3
-    import datetime
-
     if not db_path.exists():
         return []
 
     try:
-        con = sqlite3.connect(str(db_path))
-        con.row_factory = sqlite3.Row
-        cur = con.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='history' LIMIT 1;")
-        if not cur.fetchone():
-            return []
-
-        today = datetime.date.fromtimestamp(int(time.time()))
-        out = []
-        for di in range(days-1, -1, -1):
-            day = today - datetime.timedelta(days=di)
-            start = int(datetime.datetime.combine(day, datetime.time.min).timestamp())
-            end = int(datetime.datetime.combine(day, datetime.time.max).timestamp())
-            cur.execute(
-                "SELECT ts, status FROM history WHERE name=? AND ts>=? AND ts<=? ORDER BY ts ASC;",
-                (name, start, end),
-            )
-            rows = cur.fetchall()
-            if not rows:
-                if enabled_now != 1:
-                    out.append({"day": day.isoformat(), "state": "gray", "label": f"{day.strftime('%a')} • disabled"})
-                else:
-                    out.append({"day": day.isoformat(), "state": "unknown", "label": f"{day.strftime('%a')} • no data"})
-                continue
-
-            statuses = [r['status'] for r in rows]
-            has_up = any(s == 'up' for s in statuses)
-            has_down = any(s == 'down' for s in statuses)
-
-            if has_down and not has_up:
-                out.append({"day": day.isoformat(), "state": "red", "label": f"{day.strftime('%a')} • down"})
-                continue
-
-            # find any down streak >=60s
-            streak_start = None
-            worst = 0
-            for r in rows:
-                if r['status'] == 'down':
-                    if streak_start is None:
-                        streak_start = r['ts']
-                    worst = max(worst, int(r['ts']) - int(streak_start))
-                else:
-                    streak_start = None
-            if worst >= 60:
-                out.append({"day": day.isoformat(), "state": "yellow", "label": f"{day.strftime('%a')} • degraded"})
-            else:
-                out.append({"day": day.isoformat(), "state": "green", "label": f"{day.strftime('%a')} • ok"})
-
-        return out
+        return db_read(
+            lambda con: compute_snapshots_batch(
+                con, [(name, enabled_now)], days=days, names=[name], tables=_schema_names(con.cursor())
+            ).get(name, []),
+            db_path,
+        )
     except Exception:
         return []
 
@@ -670,6 +808,13 @@ def _midnight_ts_local(ts: float) -> int:
     return int(dt0.timestamp())
 
 
+_SERIES_STATE = {
+    datastore.STATUS_UP: "up",
+    datastore.STATUS_HB_FAILED: "hb",
+    datastore.STATUS_DOWN: "down",
+}
+
+
 def compute_uptime_stats(db_path: Path, name: str, days: int):
     """
     Uptime aligned to local midnight.
@@ -684,8 +829,6 @@ def compute_uptime_stats(db_path: Path, name: str, days: int):
       - "hb"  (yellow, heartbeat failed)
       - "down" (red, not responding)
     """
-    import sqlite3
-
     if not db_path.exists():
         return None
 
@@ -696,65 +839,91 @@ def compute_uptime_stats(db_path: Path, name: str, days: int):
     if now - start < 3600:
         return None
 
-    try:
-        con = sqlite3.connect(str(db_path))
-        con.row_factory = sqlite3.Row
+    def _read(con):
         cur = con.cursor()
 
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='history' LIMIT 1;")
-        if not cur.fetchone():
+        if not _has_table(cur, "target_ids"):
             return None
-
-        cur.execute(
-            """
-            SELECT
-              SUM(CASE WHEN status='up' THEN 1 ELSE 0 END) AS ok_cnt,
-              SUM(CASE WHEN status='down' AND rtt_ms >= 0 THEN 1 ELSE 0 END) AS hb_cnt,
-              SUM(CASE WHEN status='down' AND (rtt_ms < 0 OR rtt_ms IS NULL) THEN 1 ELSE 0 END) AS down_cnt,
-              AVG(CASE WHEN rtt_ms >= 0 THEN rtt_ms ELSE NULL END) AS avg_rtt
-            FROM history
-            WHERE name=? AND ts>=? AND ts<? AND status IN ('up','down');
-            """,
-            (name, int(start), int(now)),
-        )
-        row = cur.fetchone()
-        ok_cnt = _safe_int(row["ok_cnt"], 0)
-        hb_cnt = _safe_int(row["hb_cnt"], 0)
-        down_cnt = _safe_int(row["down_cnt"], 0)
+        row = cur.execute("SELECT id FROM target_ids WHERE name=?;", (name,)).fetchone()
+        if row is None:
+            return None
+        target_id = row[0]
+
+        # Finished days come from the history_daily rollup; only today's raw
+        # rows are aggregated. Without the rollup (DB not migrated yet) the
+        # whole window is read from history as before.
+        raw_start = start
+        ok_cnt = hb_cnt = down_cnt = rtt_sum = rtt_cnt = 0
+        if _has_table(cur, "history_daily") and start < start_midnight:
+            cur.execute(
+                """
+                SELECT
+                  COALESCE(SUM(ok_cnt), 0) AS ok_cnt,
+                  COALESCE(SUM(hb_cnt), 0) AS hb_cnt,
+                  COALESCE(SUM(down_cnt), 0) AS down_cnt,
+                  COALESCE(SUM(rtt_sum), 0) AS rtt_sum,
+                  COALESCE(SUM(rtt_cnt), 0) AS rtt_cnt
+                FROM history_daily
+                WHERE name=? AND day>=? AND day<?;
+                """,
+                (
+                    name,
+                    datetime.date.fromtimestamp(start).isoformat(),
+                    datetime.date.fromtimestamp(start_midnight).isoformat(),
+                ),
+            )
+            row = cur.fetchone()
+            ok_cnt = _safe_int(row["ok_cnt"], 0)
+            hb_cnt = _safe_int(row["hb_cnt"], 0)
+            down_cnt = _safe_int(row["down_cnt"], 0)
+            rtt_sum = _safe_int(row["rtt_sum"], 0)
+            rtt_cnt = _safe_int(row["rtt_cnt"], 0)
+            raw_start = start_midnight
+
+        for table in _history_tables(cur, raw_start, now):
+            cur.execute(
+                f"""
+                SELECT
+                  SUM(status = {datastore.STATUS_UP}) AS ok_cnt,
+                  SUM(status = {datastore.STATUS_HB_FAILED}) AS hb_cnt,
+                  SUM(status = {datastore.STATUS_DOWN}) AS down_cnt,
+                  SUM(CASE WHEN rtt_ms >= 0 THEN rtt_ms ELSE 0 END) AS rtt_sum,
+                  SUM(CASE WHEN rtt_ms >= 0 THEN 1 ELSE 0 END) AS rtt_cnt
+                FROM {table}
+                WHERE target_id=? AND ts>=? AND ts<? AND status <> {datastore.STATUS_DISABLED};
+                """,
+                (target_id, int(raw_start), int(now)),
+            )
+            row = cur.fetchone()
+            ok_cnt += _safe_int(row["ok_cnt"], 0)
+            hb_cnt += _safe_int(row["hb_cnt"], 0)
+            down_cnt += _safe_int(row["down_cnt"], 0)
+            rtt_sum += _safe_int(row["rtt_sum"], 0)
+            rtt_cnt += _safe_int(row["rtt_cnt"], 0)
         samples = ok_cnt + hb_cnt + down_cnt
         if samples <= 0:
             return None
 
         pct = round((ok_cnt / samples) * 100.0, 2)
-        avg_rtt = row["avg_rtt"]
-        avg_rtt_ms = int(round(avg_rtt)) if avg_rtt is not None else None
-
-        cur.execute(
-            """
-            SELECT ts, status, rtt_ms
-            FROM history
-            WHERE name=? AND ts>=? AND ts<? AND status IN ('up','down')
-            ORDER BY ts DESC
-            LIMIT 200;
-            """,
-            (name, int(start), int(now)),
-        )
-        rows = cur.fetchall() or []
-        series = []
-        for r in reversed(rows):
-            st = (r["status"] or "").lower()
-            rtt = r["rtt_ms"]
-            if st == "up":
-                series.append("up")
-            else:
-                try:
-                    rttn = float(rtt)
-                except Exception:
-                    rttn = None
-                if rttn is not None and rttn >= 0:
-                    series.append("hb")
-                else:
-                    series.append("down")
+        avg_rtt_ms = int(round(rtt_sum / rtt_cnt)) if rtt_cnt > 0 else None
+
+        # newest 200 samples, walking the partitions newest first
+        rows = []
+        for table in reversed(_history_tables(cur, start, now)):
+            cur.execute(
+                f"""
+                SELECT status
+                FROM {table}
+                WHERE target_id=? AND ts>=? AND ts<? AND status <> {datastore.STATUS_DISABLED}
+                ORDER BY ts DESC
+                LIMIT ?;
+                """,
+                (target_id, int(start), int(now), 200 - len(rows)),
+            )
+            rows.extend(cur.fetchall())
+            if len(rows) >= 200:
+                break
+        series = [_SERIES_STATE.get(r["status"], "down") for r in reversed(rows)]
 
         return {
             "samples": samples,
@@ -762,13 +931,499 @@ def compute_uptime_stats(db_path: Path, name: str, days: int):
             "avg_rtt_ms": avg_rtt_ms,
             "series": series,
         }
+
+    try:
+        return db_read(_read, db_path)
     except Exception:
         return None
-    finally:
-        try:
-            con.close()
-        except Exception:
-            pass
+
+# ---- Live events (SSE) ----
+def read_new_lines(path: Path, offset: int, partial: str = ""):
+    """Read complete lines appended to `path` since byte `offset`.
+
+    Returns (lines, new_offset, partial). A trailing line without newline is
+    carried in `partial` until it is completed. If the file shrank (it is
+    truncated at the start of every run/scan) reading restarts at 0.
+    """
+    try:
+        size = path.stat().st_size
+    except Exception:
+        return [], 0, ""
+    if size < offset:
+        offset, partial = 0, ""
+    if size == offset:
+        return [], offset, partial
+    with open(str(path), "rb") as f:
+        f.seek(offset)
+        chunk = f.read(size - offset)
+    text = partial + chunk.decode("utf-8", errors="replace")
+    parts = text.split("\n")
+    return parts[:-1], offset + len(chunk), parts[-1]
+
+
+def read_lines_from(path: Path, offset: int, max_bytes: int = 256 * 1024):
+    """Return (lines, cursor) for complete lines from byte `offset` onwards.
+
+    At most `max_bytes` are read per call; `cursor` always points just past
+    the last complete line returned, so clients resume exactly there. A
+    cursor beyond the end of file (output was truncated by a new run/scan)
+    restarts from 0.
+    """
+    try:
+        size = path.stat().st_size
+    except Exception:
+        return [], 0
+    if offset < 0 or offset > size:
+        offset = 0
+    if offset == size:
+        return [], offset
+    with open(str(path), "rb") as f:
+        f.seek(offset)
+        chunk = f.read(min(size - offset, max_bytes))
+    end = chunk.rfind(b"\n")
+    if end < 0:
+        return [], offset
+    chunk = chunk[:end + 1]
+    return chunk.decode("utf-8", errors="replace").splitlines(), offset + len(chunk)
+
+
+def read_tail_lines(path: Path, lines: int, block: int = 64 * 1024):
+    """Return (last `lines` complete lines, cursor) reading backwards from the end.
+
+    `cursor` is the byte offset just past the last complete line, usable as
+    `offset` for the next incremental read.
+    """
+    try:
+        size = path.stat().st_size
+    except Exception:
+        return [], 0
+    data = b""
+    pos = size
+    with open(str(path), "rb") as f:
+        while pos > 0 and data.count(b"\n") <= lines:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    cut = len(data) - (data.rfind(b"\n") + 1)
+    if cut:
+        data = data[:-cut]
+    return data.decode("utf-8", errors="replace").splitlines()[-lines:], size - cut
+
+
+def run_aborted(row) -> bool:
+    """The runner exited before writing its counters (closed by the CLI)."""
+    return row is not None and row["ended"] is not None and row["total"] is None
+
+
+def run_summary(row) -> dict:
+    """Counters of a finished runs row (None while it is still running or
+    when it was aborted)."""
+    if row is None or row["ended"] is None or run_aborted(row):
+        return None
+    out = {k: _safe_int(row[k], 0) for k in datastore.RUN_COUNTERS}
+    out["duration_ms"] = _safe_int(row["duration_ms"], 0)
+    return out
+
+
+def run_progress(meta: dict) -> dict:
+    """Progress of the run started by /api/run-now, from its runs row.
+
+    The CLI registers the run under its pid (`run_pid` in run_meta) before
+    probing; `done` counts its per-target events, `summary` is set once the
+    final counters are written.
+    """
+    out = {"run_id": None, "done": 0, "summary": None, "last_line": ""}
+    pid = int(meta.get("run_pid") or 0)
+    started = int(meta.get("started") or 0)
+    if not pid or not started or not DB_PATH.exists():
+        return out
+
+    def _read(con):
+        if not _has_table(con.cursor(), "runs"):
+            return None, 0, None
+        # run_meta's start time is taken after Popen: allow a second of skew
+        row, done = datastore.run_progress(con, pid, started - 1)
+        last = None
+        if row is not None:
+            last = con.execute(
+                "SELECT target, message FROM events WHERE run_id=? ORDER BY id DESC LIMIT 1;", (row["id"],)
+            ).fetchone()
+        return row, done, last
+
+    try:
+        row, done, last = db_read(_read)
+    except Exception:
+        return out
+    if row is None:
+        return out
+    out.update({"run_id": row["id"], "done": done, "summary": run_summary(row)})
+    if last is not None:
+        out["last_line"] = f"run: {last['target'] or '-'} {last['message']}"
+    return out
+
+
+def run_row_json(row) -> dict:
+    return {
+        "id": row["id"],
+        "started": _safe_int(row["started"], 0),
+        "started_human": human_ts(_safe_int(row["started"], 0)),
+        "ended": _safe_int(row["ended"], 0),
+        "trigger": row["trigger"],
+        "aborted": run_aborted(row),
+        "summary": run_summary(row),
+    }
+
+
+class EventHub:
+    """Single producer for /api/events.
+
+    The watcher thread only runs while at least one client is subscribed.
+    Each tick costs one state_seq read plus two stat() calls; payloads are
+    serialized once and shared by every subscriber queue. A subscriber that
+    cannot keep up (full queue) is dropped and reconnects via EventSource.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = set()
+        self._thread = None
+        self._rev = None
+        self._day = None
+        self._run = {"started": None, "offset": 0, "partial": "", "running": None}
+        self._scan = {"started": None, "offset": 0, "partial": "", "running": None, "sig": None}
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subs) >= EVENTS_MAX_CLIENTS:
+                return None
+            q = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+            self._subs.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._rev = None
+                self._thread = threading.Thread(target=self._loop, name="interheart-events", daemon=True)
+                self._thread.start()
+            return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subs.discard(q)
+
+    def client_count(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+    def publish(self, event: str, data: dict):
+        payload = APP.json.dumps(data)
+        with self._lock:
+            subs = list(self._subs)
+        for q in subs:
+            try:
+                q.put_nowait((event, payload))
+            except queue.Full:
+                self._drop(q)
+
+    def _drop(self, q):
+        # Unsubscribed first, so this thread is the last producer for `q`.
+        # Discard the backlog to make room for the end-of-stream sentinel;
+        # the client reconnects and resyncs from a full /state.
+        self.unsubscribe(q)
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+        q.put_nowait(None)
+
+    def _loop(self):
+        while True:
+            time.sleep(EVENTS_TICK_SECONDS)
+            with self._lock:
+                if not self._subs:
+                    self._thread = None
+                    return
+            try:
+                self._tick_state()
+                self._tick_run()
+                self._tick_scan()
+            except Exception as e:
+                _debug_log(f"events: tick failed: {e}")
+
+    def _tick_state(self):
+        day = datetime.date.today().isoformat()
+        rev = db_state_rev(DB_PATH)
+        if rev is None:
+            return
+        if self._rev is None:
+            self._rev, self._day = rev, day
+            return
+        if day != self._day:
+            # Snapshot grid shifts at midnight: clients fetch a full /state.
+            self._rev, self._day = rev, day
+            self.publish("state", {"reload": True, "rev": rev, "day": day})
+            return
+        if rev == self._rev:
+            return
+        ok, cur_rev, changed, removed = db_read_state_delta(DB_PATH, self._rev)
+        if not ok:
+            if cur_rev is not None:
+                # tombstones we would need are gone: clients reload in full
+                self._rev = cur_rev
+                self.publish("state", {"reload": True, "rev": cur_rev, "day": day})
+            return
+        self.publish("state", {
+            "ok": True,
+            "updated": int(time.time()),
+            "since": self._rev,
+            "rev": cur_rev,
+            "day": day,
+            "delta": True,
+            "targets": changed,
+            "removed": removed,
+        })
+        self._rev = cur_rev
+
+    def _tick_run(self):
+        st = self._run
+        meta = load_run_meta()
+        started = int(meta.get("started") or 0)
+        if started != st["started"]:
+            st.update({"started": started, "offset": 0, "partial": "", "running": None})
+        if not started:
+            return
+        lines, st["offset"], st["partial"] = read_new_lines(RUN_OUT_FILE, st["offset"], st["partial"])
+        running = pid_is_running(int(meta.get("pid") or 0))
+        if not running and st["partial"]:
+            lines.append(st["partial"])
+            st["partial"] = ""
+        if not lines and running == st["running"]:
+            return
+        progress = run_progress(meta)
+        st["running"] = running
+        self.publish("run", {
+            "running": running,
+            "finished": not running,
+            "started": started,
+            "lines": lines,
+            "offset": st["offset"] - len(st["partial"].encode("utf-8")),
+            "done": progress["done"],
+            "summary": progress["summary"],
+        })
+
+    def _tick_scan(self):
+        st = self._scan
+        meta = load_scan_meta()
+        started = int(meta.get("started") or 0)
+        if started != st["started"]:
+            st.update({"started": started, "offset": 0, "partial": "", "running": None, "sig": None})
+        if not started:
+            return
+        lines, st["offset"], st["partial"] = read_new_lines(SCAN_OUT_FILE, st["offset"], st["partial"])
+        running = pid_is_running(int(meta.get("pid") or 0))
+        sig = (len(meta.get("found") or []), meta.get("current_ip"), meta.get("finished"), meta.get("error"))
+        if not lines and running == st["running"] and sig == st["sig"]:
+            return
+        st["running"], st["sig"] = running, sig
+        self.publish("scan", {
+            "running": running,
+            "finished": bool(not running and meta.get("finished")),
+            "started": started,
+            "lines": lines,
+            "offset": st["offset"] - len(st["partial"].encode("utf-8")),
+            "meta": meta,
+        })
+
+
+EVENTS = EventHub()
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Compact, unsorted JSON for API responses, via orjson when installed.
+
+    Encoding time of each request's responses is added up in the WSGI
+    environ (`interheart.json_s`) for RequestMetrics. Calls with extra
+    arguments use the stdlib encoder.
+    """
+
+    sort_keys = False
+    ensure_ascii = False
+    compact = True
+
+    _ORJSON_OPTS = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if orjson is not None else 0
+    )
+
+    def dumps_bytes(self, obj) -> bytes:
+        t0 = time.perf_counter()
+        data = None
+        if orjson is not None:
+            try:
+                data = orjson.dumps(obj, default=self.default, option=self._ORJSON_OPTS)
+            except TypeError:
+                data = None  # e.g. ints beyond 64 bit: let the stdlib encoder try
+        if data is None:
+            data = json.dumps(
+                obj, default=self.default, ensure_ascii=False, separators=(",", ":")
+            ).encode("utf-8")
+        if has_request_context():
+            env = request.environ
+            env["interheart.json_s"] = env.get("interheart.json_s", 0.0) + time.perf_counter() - t0
+        return data
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+APP.json = JSONProvider(APP)
+# `tojson` in templates (the seeded target table) takes the same path
+APP.jinja_env.policies["json.dumps_kwargs"] = {}
+
+
+def accepted_encoding(accept):
+    """Best response encoding the client accepts: br (if brotli is
+    installed), gzip or None. `accept` is request.accept_encodings."""
+    gz = accept.quality("gzip")
+    if brotli is not None:
+        br = accept.quality("br")
+        if br > 0 and br >= gz:
+            return "br"
+    return "gzip" if gz > 0 else None
+
+
+ETAG_ENCODING_SUFFIX = {"gzip": "gz", "br": "br"}
+
+
+def encoded_etag(etag: str, encoding) -> str:
+    """ETag of the `encoding`-encoded body: a strong validator must differ
+    between the identity, gzip and br representations of one resource."""
+    if not encoding or not etag.startswith('"'):
+        return etag
+    return f'{etag[:-1]}-{ETAG_ENCODING_SUFFIX[encoding]}"'
+
+
+def not_modified(etag: str):
+    """304 response when If-None-Match names `etag` in any encoding (the
+    one the client holds is echoed back), else None."""
+    inm = request.if_none_match
+    if not inm:
+        return None
+    for encoding in (None, "gzip", "br"):
+        tag = encoded_etag(etag, encoding)
+        if inm.contains(tag.strip('"')):
+            return Response(status=304, headers={"ETag": tag, "Cache-Control": "no-cache"})
+    return None
+
+
+def compress_response(resp):
+    """Encode a buffered text/JSON response body of at least
+    COMPRESS_MIN_BYTES with the client's preferred encoding.
+
+    Files (send_file), streams and already encoded bodies are left alone;
+    so is a body that would not get smaller. A strong ETag gets the
+    encoding appended (encoded_etag).
+    """
+    if (
+        resp.direct_passthrough
+        or resp.is_streamed
+        or not 200 <= resp.status_code < 300
+        or resp.status_code == 204
+        or "Content-Encoding" in resp.headers
+        or resp.mimetype not in COMPRESS_MIMETYPES
+    ):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = accepted_encoding(request.accept_encodings)
+    if encoding is None:
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    if encoding == "br":
+        body = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, GZIP_LEVEL, mtime=0)
+    if len(body) >= len(data):
+        return resp
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    if "ETag" in resp.headers:
+        resp.headers["ETag"] = encoded_etag(resp.headers["ETag"], encoding)
+    return resp
+
+
+class RequestMetrics:
+    """Per-route WebUI request metrics for /metrics (in memory): latency
+    histograms, response bytes before/after compression, JSON encode time.
+
+    Measured from before_request to after_request, so streamed responses
+    (/api/events, exports) count their set-up time only and no body bytes.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}  # (method, route) -> [per-bucket counts..., +Inf, sum, count]
+        self._bodies = {}  # (method, route) -> [raw bytes, sent bytes, json seconds]
+
+    def observe(self, method: str, route: str, seconds: float, raw: int = 0, sent: int = 0, json_s: float = 0.0):
+        i = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            h = self._routes.get((method, route))
+            if h is None:
+                h = self._routes[(method, route)] = [0] * (len(self.BUCKETS) + 1) + [0.0, 0]
+            h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+            b = self._bodies.get((method, route))
+            if b is None:
+                b = self._bodies[(method, route)] = [0, 0, 0.0]
+            b[0] += raw
+            b[1] += sent
+            b[2] += json_s
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: list(v) for k, v in sorted(self._routes.items())}
+
+    def bodies(self) -> dict:
+        with self._lock:
+            return {k: list(v) for k, v in sorted(self._bodies.items())}
+
+
+REQUEST_METRICS = RequestMetrics()
+
+
+@APP.before_request
+def _metrics_start():
+    request.environ["interheart.t0"] = time.perf_counter()
+
+
+@APP.after_request
+def _metrics_observe(resp):
+    # content_length is None for streams (not counted)
+    raw = resp.content_length or 0
+    resp = compress_response(resp)
+    t0 = request.environ.get("interheart.t0")
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "(unmatched)"
+        REQUEST_METRICS.observe(
+            request.method,
+            route,
+            time.perf_counter() - t0,
+            raw=raw,
+            sent=resp.content_length or 0,
+            json_s=request.environ.get("interheart.json_s", 0.0),
+        )
+    return resp
+
 
 # ---- Routes ----
 @APP.get("/")
@@ -778,10 +1433,24 @@ def index():
     if not tpl.exists():
         return f"Missing templates/index.html (looked for {tpl})", 500
 
-    ok, targets = merged_targets_safe()
+    # first page only (same order as /state views); the script pages from
+    # there when there are more targets than STATE_PAGE_SIZE
+    ok = False
+    if DB_PATH.exists():
+        try:
+            total, targets = db_read_state_page(DB_PATH, parse_state_view({}))
+            ok = True
+        except Exception:
+            pass
+    if not ok:
+        ok, targets = merged_targets_safe()
+        total = len(targets)
+        targets = targets[:STATE_PAGE_SIZE]
     return render_template(
         "index.html",
         targets=targets,
+        targets_total=total,
+        page_size=STATE_PAGE_SIZE,
         bind_host=BIND_HOST,
         bind_port=BIND_PORT,
         ui_version=UI_VERSION,
@@ -791,8 +1460,106 @@ def index():
         state_ok=ok,
     )
 
+def serve_state_snapshot(rev: int, day: str):
+    """/state response from the snapshot file if it holds `rev` of `day`.
+
+    The file is opened once and its header checked on that handle, so a
+    concurrent rewrite cannot mix revisions; the body is handed to the WSGI
+    file wrapper (sendfile under gunicorn) without being parsed. Returns
+    None when the file is missing or stale.
+    """
+    try:
+        f = open(STATE_SNAPSHOT_FILE, "rb")
+    except OSError:
+        return None
+    encoding = None
+    try:
+        hdr = statefile.read_header(f)
+        if hdr != (statefile.FORMAT, rev, day):
+            f.close()
+            return None
+        if request.accept_encodings.quality("gzip") > 0:
+            try:
+                gz = open(STATE_SNAPSHOT_FILE.with_name(STATE_SNAPSHOT_FILE.name + ".gz"), "rb")
+            except OSError:
+                gz = None
+            if gz is not None:
+                # same mtime = written together (statefile.write)
+                if os.fstat(gz.fileno()).st_mtime_ns == os.fstat(f.fileno()).st_mtime_ns:
+                    f.close()
+                    f, encoding = gz, "gzip"
+                else:
+                    gz.close()
+        resp = send_file(f, mimetype="application/json", conditional=False, etag=False)
+    except Exception:
+        f.close()
+        return None
+    resp.headers["ETag"] = encoded_etag(f'"{rev}-{day}"', encoding)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    return resp
+
+
+def refresh_state_snapshot(rev: int, day: str, targets: list) -> None:
+    """Rewrite the snapshot after a DB read (e.g. a WebUI edit bumped rev)."""
+    try:
+        statefile.write(STATE_SNAPSHOT_FILE, rev, day, targets)
+    except Exception as e:
+        _debug_log(f"state: snapshot not written: {e}")
+
+
 @APP.get("/state")
 def state():
+    """Target table state.
+
+    When the DB carries a state revision the response has `rev` + `day` and
+    an ETag. Clients can then poll with If-None-Match (304 when unchanged)
+    or `?since=<rev>&day=<day>` to get only changed targets plus `removed`
+    names. A new local day forces a full payload (snapshot grid shifts).
+
+    Full payloads come from the runner's snapshot file while it is current
+    (serve_state_snapshot); the DB is read only when it is not, and the
+    file is then rewritten for the next clients.
+
+    Any of limit/offset/sort/dir/status/q/fields asks for a view instead
+    (state_view): one page of the filtered, sorted targets plus `total`.
+    """
+    day = datetime.date.today().isoformat()
+    rev = db_state_rev(DB_PATH)
+    if any(k in request.args for k in STATE_VIEW_ARGS):
+        return state_view(rev, day)
+    if rev is not None:
+        etag = f'"{rev}-{day}"'
+        resp = not_modified(etag)
+        if resp is not None:
+            return resp
+
+        since_raw = (request.args.get("since") or "").strip()
+        if since_raw.isdigit() and request.args.get("day") == day and int(since_raw) <= rev:
+            since = int(since_raw)
+            if since == rev:
+                return Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+            ok, cur_rev, changed, removed = db_read_state_delta(DB_PATH, since)
+            if ok:
+                resp = jsonify({
+                    "ok": True,
+                    "updated": int(time.time()),
+                    "rev": cur_rev,
+                    "day": day,
+                    "delta": True,
+                    "targets": changed,
+                    "removed": removed,
+                })
+                resp.headers["ETag"] = f'"{cur_rev}-{day}"'
+                resp.headers["Cache-Control"] = "no-cache"
+                return resp
+
+        resp = serve_state_snapshot(rev, day)
+        if resp is not None:
+            return resp
+
     ok, targets = merged_targets_safe()
     # Detect the common "rows flash then disappear" symptom:
     # - server-rendered table has rows
@@ -800,14 +1567,100 @@ def state():
     if targets is not None and len(targets) == 0:
         db_exists = DB_PATH.exists()
         db_size = DB_PATH.stat().st_size if db_exists else 0
-        # Try a lightweight CLI check (non-fatal)
-        cli_rc, cli_out = run_cmd(["list"])
-        cli_cnt = len(parse_list_targets(cli_out)) if cli_rc == 0 else -1
         _debug_log(
-            f"/state returned 0 targets (ok={ok}) | db_exists={db_exists} db_size={db_size} | cli_list_rc={cli_rc} cli_targets={cli_cnt} | cwd={os.getcwd()} cli={CLI}",
+            f"/state returned 0 targets (ok={ok}) | db_exists={db_exists} db_size={db_size} | cwd={os.getcwd()}",
             force=False,
         )
-    return jsonify({"ok": ok, "updated": int(time.time()), "targets": targets})
+    payload = {"ok": ok, "updated": int(time.time()), "targets": targets}
+    if rev is not None and ok:
+        payload["rev"] = rev
+        payload["day"] = day
+        refresh_state_snapshot(rev, day, targets)
+    resp = jsonify(payload)
+    if rev is not None and ok:
+        resp.headers["ETag"] = f'"{rev}-{day}"'
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def state_view(rev, day):
+    """/state?limit=&offset=&sort=&dir=&status=&q=&fields= (see state).
+
+    status: comma list of up/down/starting/disabled; q: IPv4 address or CIDR,
+    else a substring of name/IP/status; fields: comma list of target keys
+    (name is always included, snapshots only when listed or no fields given).
+    The ETag covers rev, day and the query, so polls of an unchanged view
+    get a 304.
+    """
+    try:
+        view = parse_state_view(request.args)
+    except ValueError as e:
+        return die_json(str(e), 400)
+    etag = None
+    if rev is not None:
+        etag = f'"{rev}-{day}-{zlib.crc32(request.query_string):08x}"'
+        resp = not_modified(etag)
+        if resp is not None:
+            return resp
+    try:
+        total, targets = db_read_state_page(DB_PATH, view)
+    except Exception as e:
+        _debug_log(f"state: view read failed: {e}")
+        return die_json("State is not available right now, try again", 503)
+    payload = {
+        "ok": True,
+        "updated": int(time.time()),
+        "total": total,
+        "offset": view["offset"],
+        "limit": view["limit"],
+        "sort": view["sort"],
+        "dir": view["dir"],
+        "targets": targets,
+    }
+    if rev is not None:
+        payload["rev"] = rev
+        payload["day"] = day
+    resp = jsonify(payload)
+    if etag:
+        resp.headers["ETag"] = etag
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@APP.get("/api/events")
+def api_events():
+    """Server-Sent Events: `state` deltas, `run` progress and `scan` progress.
+
+    Payloads mirror /state (delta form, with `since`), /api/run-output and
+    /api/scan-output. Polling endpoints stay as the fallback when the stream
+    is unavailable (503 when EVENTS_MAX_CLIENTS is reached).
+    """
+    q = EVENTS.subscribe()
+    if q is None:
+        return die_json("Too many event clients", 503)
+
+    def gen():
+        try:
+            hello = {"rev": db_state_rev(DB_PATH), "day": datetime.date.today().isoformat()}
+            yield f"retry: 3000\nevent: hello\ndata: {json.dumps(hello)}\n\n"
+            while True:
+                try:
+                    item = q.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is None:
+                    return
+                event, payload = item
+                yield f"event: {event}\ndata: {payload}\n\n"
+        finally:
+            EVENTS.unsubscribe(q)
+
+    return Response(
+        gen(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @APP.get("/api/debug-state")
@@ -822,37 +1675,216 @@ def api_debug_state():
     db_size = DB_PATH.stat().st_size if db_exists else 0
     cache_cnt = len((_LAST_STATE_CACHE.get("targets") or []))
 
-    cli_list_rc, cli_list_out = run_cmd(["list"])
-    cli_targets = parse_list_targets(cli_list_out) if cli_list_rc == 0 else []
-    cli_cnt = len(cli_targets)
-
-    cli_status_rc, cli_status_out = run_cmd(["status"])
-    status_map = parse_status(cli_status_out) if cli_status_rc == 0 else {}
+    # Same data through the datastore's own connection (bypasses the pool)
+    ds_cnt, ds_version, ds_error = -1, -1, ""
+    if db_exists:
+        try:
+            con = datastore.connect(DB_PATH)
+            try:
+                ds_cnt = len(datastore.list_targets(con))
+                ds_version = int(con.execute("PRAGMA user_version;").fetchone()[0])
+            finally:
+                con.close()
+        except Exception as e:
+            ds_error = str(e)
 
     diag = {
         "ok": ok,
         "targets_count": len(targets or []),
         "db": {"path": str(DB_PATH), "exists": db_exists, "size": db_size},
-        "cli": {
-            "path": str(CLI),
-            "list_rc": cli_list_rc,
-            "list_count": cli_cnt,
-            "status_rc": cli_status_rc,
-            "status_count": len(status_map),
+        "datastore": {
+            "path": datastore.__file__,
+            "targets_count": ds_cnt,
+            "user_version": ds_version,
+            "schema_version": datastore.SCHEMA_VERSION,
+            "error": ds_error,
         },
+        "cli": {"path": str(CLI)},
         "cache": {"count": cache_cnt, "updated": int(_LAST_STATE_CACHE.get("updated") or 0)},
+        "db_pool": read_pool(DB_PATH).stats(),
         "env": {"cwd": os.getcwd(), "uid": os.getuid() if hasattr(os, "getuid") else None},
         "updated": int(time.time()),
     }
 
     _debug_log(
-        f"/api/debug-state: ok={ok} targets={len(targets or [])} db_exists={db_exists} db_size={db_size} cli_list_rc={cli_list_rc} cli_targets={cli_cnt} cache={cache_cnt}",
+        f"/api/debug-state: ok={ok} targets={len(targets or [])} db_exists={db_exists} db_size={db_size} datastore_targets={ds_cnt} cache={cache_cnt}",
         force=True,
     )
     return jsonify({"ok": True, "diag": diag, "targets": targets})
 
+# ---- Metrics (Prometheus text format) ----
+def _prom_labels(**labels) -> str:
+    if not labels:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, esc)) + "}"
+
+
+def _prom_num(v) -> str:
+    return repr(round(v, 6)) if isinstance(v, float) else str(v)
+
+
+class _PromWriter:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value, **labels):
+        self.lines.append(f"{name}{_prom_labels(**labels)} {_prom_num(value)}")
+
+    def histogram(self, name: str, bounds, counts, total, count, **labels):
+        """bounds: bucket upper bounds; counts: per bucket (non-cumulative) + the +Inf bucket."""
+        cum = 0
+        for le, c in zip([_prom_num(b) for b in bounds] + ["+Inf"], counts):
+            cum += c
+            self.sample(f"{name}_bucket", cum, **labels, le=le)
+        self.sample(f"{name}_sum", total, **labels)
+        self.sample(f"{name}_count", count, **labels)
+
+
+def _read_metrics(con):
+    cur = con.cursor()
+    if not _has_table(cur, "metrics"):
+        return {}, [], [], 0
+    counters = {r["key"]: int(r["value"]) for r in datastore.metric_rows(con)}
+    hists = [dict(r) for r in datastore.probe_hist_rows(con)]
+    if not _has_table(cur, "receiver_hist"):
+        return counters, hists, [], 0
+    return counters, hists, [dict(r) for r in datastore.receiver_hist_rows(con)], datastore.outbox_size(con)
+
+
+@APP.get("/metrics")
+def metrics():
+    """Runner and WebUI metrics for Prometheus.
+
+    Runner values are counters the runner folds into state.db with each run
+    (tables `metrics` and `probe_hist`); WebUI values are kept in memory
+    since the process started.
+    """
+    counters, hists, receivers, outbox = {}, [], [], 0
+    if DB_PATH.exists():
+        try:
+            counters, hists, receivers, outbox = db_read(_read_metrics)
+        except Exception:
+            pass
+    w = _PromWriter()
+
+    run_bounds = [b / 1000 for b in datastore.RUN_BUCKETS_MS]
+    w.family("interheart_runs_total", "counter", "Completed run-now batches.")
+    w.sample("interheart_runs_total", counters.get("runs", 0))
+    w.family("interheart_run_overruns_total", "counter", "Runs that hit their deadline (targets deferred) or outlasted it.")
+    w.sample("interheart_run_overruns_total", counters.get("run_overruns", 0))
+    w.family("interheart_run_duration_seconds", "histogram", "Run-now wall-clock duration.")
+    w.histogram(
+        "interheart_run_duration_seconds",
+        run_bounds,
+        [counters.get(f"run_duration_b{i}", 0) for i in range(len(run_bounds) + 1)],
+        counters.get("run_duration_ms_sum", 0) / 1000,
+        counters.get("runs", 0),
+    )
+    last_ms = counters.get("last_run_duration_ms", 0)
+    w.family("interheart_last_run_duration_seconds", "gauge", "Duration of the most recent run.")
+    w.sample("interheart_last_run_duration_seconds", last_ms / 1000)
+    w.family("interheart_last_run_timestamp_seconds", "gauge", "Start time of the most recent run.")
+    w.sample("interheart_last_run_timestamp_seconds", counters.get("last_run_ts", 0))
+    w.family("interheart_last_run_probes_per_second", "gauge", "Probes completed per second in the most recent run.")
+    w.sample(
+        "interheart_last_run_probes_per_second",
+        round(counters.get("last_run_probes", 0) / (last_ms / 1000), 3) if last_ms > 0 else 0.0,
+    )
+    w.family("interheart_probes_total", "counter", "Completed probes (run-now and test).")
+    w.sample("interheart_probes_total", counters.get("probes", 0))
+
+    probe_bounds = [b / 1000 for b in datastore.PROBE_BUCKETS_MS]
+    for kind, name, help_text in (
+        ("rtt", "interheart_ping_rtt_seconds", "Ping round-trip time per target."),
+        ("http", "interheart_heartbeat_duration_seconds", "Heartbeat HTTP request time per target."),
+    ):
+        w.family(name, "histogram", help_text)
+        for h in hists:
+            if h["kind"] == kind:
+                w.histogram(
+                    name,
+                    probe_bounds,
+                    [h[f"b{i}"] for i in range(len(probe_bounds) + 1)],
+                    h["sum_ms"] / 1000,
+                    h["count"],
+                    target=h["name"],
+                )
+    w.family("interheart_heartbeat_responses_total", "counter", "Heartbeat responses by HTTP status (000 = no response).")
+    for key in sorted(counters):
+        if key.startswith("http_code:"):
+            w.sample("interheart_heartbeat_responses_total", counters[key], code=key.split(":", 1)[1])
+    w.family("interheart_receiver_send_duration_seconds", "histogram", "Heartbeat request time per receiver (answered requests).")
+    for r in receivers:
+        w.histogram(
+            "interheart_receiver_send_duration_seconds",
+            probe_bounds,
+            [r[f"b{i}"] for i in range(len(probe_bounds) + 1)],
+            r["sum_ms"] / 1000,
+            r["count"],
+            receiver=r["receiver"],
+        )
+    w.family("interheart_receiver_errors_total", "counter", "Heartbeat requests a receiver did not answer (connect error/timeout).")
+    for r in receivers:
+        w.sample("interheart_receiver_errors_total", r["errors"], receiver=r["receiver"])
+    w.family("interheart_receiver_queued_total", "counter", "Heartbeats put in the outbox for a later retry.")
+    for r in receivers:
+        w.sample("interheart_receiver_queued_total", r["queued"], receiver=r["receiver"])
+    w.family("interheart_heartbeat_outbox", "gauge", "Undelivered heartbeats waiting for a retry.")
+    w.sample("interheart_heartbeat_outbox", outbox)
+    w.family("interheart_db_batch_failures_total", "counter", "Runner write batches that hit SQLite errors (e.g. lock timeouts).")
+    w.sample("interheart_db_batch_failures_total", counters.get("db_batch_failures", 0))
+
+    pool = read_pool(DB_PATH).stats()
+    for key, name, kind, help_text in (
+        ("reads", "interheart_webui_db_reads_total", "counter", "WebUI reads through the connection pool."),
+        ("busy_retries", "interheart_webui_db_busy_retries_total", "counter", "WebUI reads retried because SQLite was busy/locked."),
+        ("busy_failures", "interheart_webui_db_busy_failures_total", "counter", "WebUI reads that gave up on a busy/locked DB."),
+        ("stale_served", "interheart_webui_db_stale_served_total", "counter", "Target tables served from cache after a failed read."),
+        ("errors", "interheart_webui_db_errors_total", "counter", "WebUI read errors other than busy/locked."),
+    ):
+        w.family(name, kind, help_text)
+        w.sample(name, pool.get(key, 0))
+    w.family("interheart_webui_db_busy_wait_seconds_total", "counter", "Time WebUI reads spent backing off on a busy DB.")
+    w.sample("interheart_webui_db_busy_wait_seconds_total", pool.get("busy_wait_ms", 0) / 1000)
+
+    w.family("interheart_webui_request_duration_seconds", "histogram", "WebUI request latency per route.")
+    for (method, route), h in REQUEST_METRICS.snapshot().items():
+        w.histogram(
+            "interheart_webui_request_duration_seconds",
+            RequestMetrics.BUCKETS,
+            h[:-2],
+            h[-2],
+            h[-1],
+            method=method,
+            route=route,
+        )
+
+    bodies = REQUEST_METRICS.bodies()
+    for idx, name, help_text in (
+        (0, "interheart_webui_response_bytes_total", "WebUI response body bytes per route before compression."),
+        (1, "interheart_webui_response_sent_bytes_total", "WebUI response body bytes per route as sent (after compression)."),
+        (2, "interheart_webui_json_encode_seconds_total", "Time spent encoding JSON responses per route."),
+    ):
+        w.family(name, "counter", help_text)
+        for (method, route), b in bodies.items():
+            w.sample(name, round(b[idx], 6) if idx == 2 else b[idx], method=method, route=route)
+
+    return Response("\n".join(w.lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @APP.get("/logs")
 def logs():
+    """Journal tail from the JournalReader ring, filtered server-side.
+
+    lines: max entries; level: all|info|warn|error; q: substring;
+    after: `cursor` of the previous response -> only newer entries
+    (`reset` = cursor expired, the result is a fresh tail).
+    """
     try:
         lines = int(request.args.get("lines", str(LOG_LINES_DEFAULT)))
     except Exception:
@@ -861,136 +1893,234 @@ def logs():
     updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(time.time())))
 
     try:
-        text = journalctl_lines(lines)
-        src = "journalctl -t interheart -o short-iso"
-        actual = len(text.splitlines()) if text else 0
-        return jsonify({"ok": True, "source": src, "lines": actual, "updated": updated, "text": text})
+        res = JOURNAL.read(
+            after=(request.args.get("after") or "").strip(),
+            limit=lines,
+            level=request.args.get("level") or "all",
+            q=request.args.get("q") or "",
+        )
     except Exception as e:
-        return jsonify({"ok": False, "source": "journalctl (error)", "lines": 1, "updated": updated, "text": f"(journalctl error: {str(e)})"})
+        res = {"entries": [], "cursor": "", "reset": True, "error": str(e)}
+    if res["error"] and not res["entries"] and not res["cursor"]:
+        return jsonify({"ok": False, "source": "journalctl (error)", "lines": 0, "updated": updated,
+                        "entries": [], "cursor": "", "reset": True, "error": res["error"]})
+    return jsonify({
+        "ok": True,
+        "source": "journal -t interheart",
+        "lines": len(res["entries"]),
+        "updated": updated,
+        "entries": [{"text": t, "level": lv} for t, lv in res["entries"]],
+        "cursor": res["cursor"],
+        "reset": res["reset"],
+    })
 
 
-def filter_log_text(text: str, q: str = "", level: str = "all") -> list[str]:
+def journal_export(limit: int, since: int = 0, until: int = 0, level: str = "all", q: str = ""):
+    """Yield matching (text, level) entries straight from journalctl, oldest first.
+
+    The newest `limit` entries (within since/until, epoch seconds) are read
+    with one `journalctl -o json` and filtered as they are parsed, so exports
+    are not bound by the JournalReader ring and never held in memory.
+    """
+    cmd = ["journalctl", "-t", "interheart", "-o", "json", "--no-pager", "-n", str(limit)]
+    if since:
+        cmd.append(f"--since=@{since}")
+    if until:
+        cmd.append(f"--until=@{until}")
     q = (q or "").strip().lower()
     level = (level or "all").strip().lower()
-    lines = (text or "").splitlines()
-
-    def level_ok(line: str) -> bool:
-        ll = line.lower()
-        if level == "all":
-            return True
-        if level == "error":
-            return ("error" in ll) or ("fail" in ll)
-        if level == "warn":
-            return ("warn" in ll) or ("warning" in ll)
-        if level == "info":
-            return not (("error" in ll) or ("fail" in ll) or ("warn" in ll) or ("warning" in ll))
-        return True
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for line in proc.stdout:
+            parsed = _journal_entry(line)
+            if not parsed:
+                continue
+            _cursor, text, lv = parsed
+            if level in ("error", "warn", "info") and lv != level:
+                continue
+            if q and q not in text.lower():
+                continue
+            yield text, lv
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def _csv_stream(entries):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(["line"])
+    for text, _lv in entries:
+        w.writerow([text])
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
 
-    out = []
+def _pdf_export(lines, stamp: str, title: str = "interheart \u2013 logs") -> io.BytesIO:
+    """Text-only PDF (Letter, Helvetica 8 pt) drawn with reportlab.
+
+    reportlab's canvas keeps the document until save(), so PDF exports are
+    buffered and capped at LOG_EXPORT_MAX_PDF_LINES.
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    bio = io.BytesIO()
+    c = canvas.Canvas(bio, pagesize=letter)
+    width, height = letter
+
+    def draw_header_footer():
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(40, height - 38, title)
+        c.setFont("Helvetica", 8)
+        c.drawRightString(width - 40, height - 38, stamp)
+        c.setFont("Helvetica", 8)
+        c.setFillColorRGB(0.6, 0.6, 0.6)
+        c.drawString(40, 24, "Powered by 5echo.io")
+        c.drawRightString(width - 40, 24, f"Page {c.getPageNumber()}")
+        c.setFillColorRGB(0, 0, 0)
+
+    draw_header_footer()
+    y = height - 60
+    c.setFont("Helvetica", 8)
     for l in lines:
-        if not level_ok(l):
-            continue
-        if q and q not in l.lower():
-            continue
-        out.append(l)
-    return out
+        if y < 40:
+            c.showPage()
+            draw_header_footer()
+            y = height - 60
+            c.setFont("Helvetica", 8)
+        c.drawString(40, y, l if len(l) <= 160 else l[:157] + "...")
+        y -= 12
+    c.save()
+    bio.seek(0)
+    return bio
 
 
 @APP.get("/api/logs-export")
 def api_logs_export():
+    """Log export (csv | xlsx | pdf).
+
+    lines: newest N entries (up to LOG_EXPORT_MAX_LINES, or
+    LOG_EXPORT_MAX_PDF_LINES for PDF); hours, or since/until (epoch
+    seconds): time range; level/q as for /logs. CSV is streamed while
+    journalctl is read; XLSX is spooled to a temporary file and PDF built
+    in memory before they are sent.
+    """
     fmt = (request.args.get("fmt") or "csv").strip().lower()
     try:
-        lines_n = int(request.args.get("lines", str(LOG_LINES_DEFAULT)))
-    except Exception:
-        lines_n = LOG_LINES_DEFAULT
-    lines_n = max(50, min(5000, lines_n))
+        lines_n = int(request.args.get("lines") or LOG_EXPORT_MAX_LINES)
+        hours = int(request.args.get("hours") or 0)
+        since = int(request.args.get("since") or 0)
+        until = int(request.args.get("until") or 0)
+    except ValueError:
+        return die_json("lines, hours, since and until must be integers", 400)
+    lines_n = max(1, min(LOG_EXPORT_MAX_LINES, lines_n))
+    if hours > 0:
+        since = int(time.time()) - min(hours, LOG_EXPORT_MAX_HOURS) * 3600
     q = (request.args.get("q") or "").strip()
     level = (request.args.get("level") or "all").strip().lower()
+    if fmt not in ("csv", "xlsx", "pdf"):
+        return die_json("Unknown format", 400)
+    if not shutil.which("journalctl"):
+        return die_json("journalctl not available", 500)
+    if fmt == "pdf":
+        lines_n = min(lines_n, LOG_EXPORT_MAX_PDF_LINES)
 
-    text = journalctl_lines(lines_n)
-    lines = filter_log_text(text, q=q, level=level)
-
+    entries = journal_export(lines_n, since, until, level, q)
     ts = time.strftime("%Y%m%d-%H%M%S", time.localtime(int(time.time())))
     base = f"interheart-logs-{ts}"
 
     if fmt == "csv":
-        csv_text = "line\n" + "\n".join([json.dumps(l)[1:-1] for l in lines])
-        return Response(csv_text, mimetype="text/csv", headers={"Content-Disposition": f"attachment; filename={base}.csv"})
+        return Response(_csv_stream(entries), mimetype="text/csv",
+                        headers={"Content-Disposition": f"attachment; filename={base}.csv"})
 
     if fmt == "xlsx":
+        # write-only workbook: rows go to a temp file as they are appended;
+        # the zip container is only complete after save(), so the finished
+        # file is sent from disk (not streamed while journalctl is read)
         try:
             from openpyxl import Workbook
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Logs"
+            from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("Logs")
             ws.append(["line"])
-            for l in lines:
-                ws.append([l])
-            bio = BytesIO()
-            wb.save(bio)
-            bio.seek(0)
-            return send_file(bio, as_attachment=True, download_name=f"{base}.xlsx", mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            for text, _lv in entries:
+                ws.append([ILLEGAL_CHARACTERS_RE.sub("", text)])
+            tmp = tempfile.TemporaryFile()
+            wb.save(tmp)
+            tmp.seek(0)
+            return send_file(tmp, as_attachment=True, download_name=f"{base}.xlsx", mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
         except Exception as e:
             return die_json(f"XLSX export failed: {e}", 500)
+        finally:
+            entries.close()
 
-    if fmt == "pdf":
-        try:
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.pagesizes import letter
-            bio = BytesIO()
-            c = canvas.Canvas(bio, pagesize=letter)
-            width, height = letter
-            def draw_header_footer():
-                # Header
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(40, height - 38, "interheart – logs")
-                c.setFont("Helvetica", 8)
-                c.drawRightString(width - 40, height - 38, ts)
-                # Footer (branding)
-                c.setFont("Helvetica", 8)
-                c.setFillColorRGB(0.6, 0.6, 0.6)
-                c.drawString(40, 24, "Powered by 5echo.io")
-                c.drawRightString(width - 40, 24, f"Page {c.getPageNumber()}")
-                c.setFillColorRGB(0, 0, 0)
+    try:
+        bio = _pdf_export((t for t, _lv in entries), ts)
+        return send_file(bio, as_attachment=True, download_name=f"{base}.pdf", mimetype="application/pdf")
+    except Exception as e:
+        return die_json(f"PDF export failed: {e}", 500)
+    finally:
+        entries.close()
 
-            draw_header_footer()
-            y = height - 60
-            c.setFont("Helvetica", 8)
-            for l in lines:
-                if y < 40:
-                    c.showPage()
-                    draw_header_footer()
-                    y = height - 60
-                    c.setFont("Helvetica", 8)
-                # trim to fit
-                s = l
-                if len(s) > 160:
-                    s = s[:157] + "..."
-                c.drawString(40, y, s)
-                y -= 12
-            c.save()
-            bio.seek(0)
-            return send_file(bio, as_attachment=True, download_name=f"{base}.pdf", mimetype="application/pdf")
-        except Exception as e:
-            return die_json(f"PDF export failed: {e}", 500)
+# ---- API: targets ----
+# Mutations go through datastore.py in-process: one short write transaction
+# per action (the CLI runs the same code), then the scheduler is nudged.
+def ds_write(fn, *args):
+    """Run `fn(con, *args)` on a short-lived read/write connection."""
+    con = datastore.open_db(DB_PATH)
+    try:
+        return fn(con, *args)
+    finally:
+        con.close()
+
+
+def ds_action(fn, *args, message: str = "OK"):
+    """JSON result of a single datastore write, in the CLI's OK:/ERROR: form."""
+    try:
+        ds_write(fn, *args)
+    except DataError as e:
+        return jsonify({"ok": False, "message": f"ERROR: {e}"})
+    except sqlite3.Error as e:
+        return jsonify({"ok": False, "message": f"ERROR: Database error: {e}"})
+    datastore.notify_scheduler(STATE_DIR)
+    return jsonify({"ok": True, "message": message})
+
+
+def ds_batch(fn, names, *args):
+    """Per-name results of a datastore batch write ({name: "ok" | reason})."""
+    results = ds_write(fn, names, *args)
+    if any(v == "ok" for v in results.values()):
+        datastore.notify_scheduler(STATE_DIR)
+    return results
+
+
+def _single_batch(fn, name, *args, verb: str):
+    try:
+        res = ds_batch(fn, [name], *args).get(name, "failed")
+    except sqlite3.Error as e:
+        return jsonify({"ok": False, "message": f"ERROR: Database error: {e}"})
+    if res != "ok":
+        msg = "Invalid name" if res == "invalid name" else f"Not found: {name}"
+        return jsonify({"ok": False, "message": f"ERROR: {msg}"})
+    return jsonify({"ok": True, "message": f"OK: {verb} {name}"})
 
-    return die_json("Unknown format", 400)
 
-# ---- API: targets ----
 @APP.post("/api/add")
 def api_add():
     name = request.form.get("name", "").strip()
     ip = request.form.get("ip", "").strip()
     endpoint = request.form.get("endpoint", "").strip()
     interval = request.form.get("interval", "60").strip()
-    rc, out = run_cmd(["add", name, ip, endpoint, interval])
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed")})
+    return ds_action(datastore.add_target, name, ip, endpoint, interval, message=f"OK: Added {name}")
 
 @APP.post("/api/remove")
 def api_remove():
     name = request.form.get("name", "").strip()
-    rc, out = run_cmd(["remove", name])
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed")})
+    return _single_batch(datastore.remove_targets, name, verb="Removed")
 
 @APP.post("/api/test")
 def api_test():
@@ -1001,14 +2131,12 @@ def api_test():
 @APP.post("/api/enable")
 def api_enable():
     name = request.form.get("name", "").strip()
-    rc, out = run_cmd(["enable", name])
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed")})
+    return _single_batch(datastore.set_enabled, name, True, verb="Enabled")
 
 @APP.post("/api/disable")
 def api_disable():
     name = request.form.get("name", "").strip()
-    rc, out = run_cmd(["disable", name])
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed")})
+    return _single_batch(datastore.set_enabled, name, False, verb="Disabled")
 
 
 def bulk_from_json() -> list[str]:
@@ -1022,63 +2150,76 @@ def bulk_from_json() -> list[str]:
         return []
 
 
-@APP.post("/api/bulk-enable")
-def api_bulk_enable():
+BATCH_TEST_RE = re.compile(r"^(?:(ok|error):\s+([^:\s]+)(?::\s*(.*))?|([a-zA-Z0-9._-]+):\s+(OK|WARN|FAIL):\s*(.*))$")
+
+
+def run_batch_test(names: list[str]):
+    """Run `interheart test --names -` (names on stdin): one CLI process,
+    probes run concurrently. Returns (ok_count, {name: "ok" | reason})."""
+    rc, out = run_cmd(["test", "--names", "-"], input_text="\n".join(names) + "\n")
+    results = {}
+    for line in (out or "").splitlines():
+        m = BATCH_TEST_RE.match(line.strip())
+        if not m:
+            continue
+        if m.group(2):
+            results[m.group(2)] = "ok" if m.group(1) == "ok" else (m.group(3) or "failed")
+        else:
+            results[m.group(4)] = "ok" if m.group(5) == "OK" else f"{m.group(5).lower()}: {m.group(6)}"
+    for n in names:
+        if n not in results:
+            results[n] = out if rc != 0 and out else "no result"
+    return sum(1 for v in results.values() if v == "ok"), results
+
+
+def _bulk_response(fn, verb: str, *args):
     names = bulk_from_json()
     if not names:
         return jsonify({"ok": False, "message": "No targets selected"})
-    ok = 0
-    for n in names:
-        rc, _ = run_cmd(["enable", n])
-        if rc == 0:
-            ok += 1
-    return jsonify({"ok": ok == len(names), "message": f"Enabled {ok}/{len(names)}"})
+    try:
+        results = ds_batch(fn, names, *args)
+    except sqlite3.Error as e:
+        return jsonify({"ok": False, "message": f"{verb} 0/{len(names)}: {e}"})
+    ok = sum(1 for v in results.values() if v == "ok")
+    return jsonify({"ok": ok == len(results), "message": f"{verb} {ok}/{len(results)}", "results": results})
+
+
+@APP.post("/api/bulk-enable")
+def api_bulk_enable():
+    return _bulk_response(datastore.set_enabled, "Enabled", True)
 
 
 @APP.post("/api/bulk-disable")
 def api_bulk_disable():
-    names = bulk_from_json()
-    if not names:
-        return jsonify({"ok": False, "message": "No targets selected"})
-    ok = 0
-    for n in names:
-        rc, _ = run_cmd(["disable", n])
-        if rc == 0:
-            ok += 1
-    return jsonify({"ok": ok == len(names), "message": f"Disabled {ok}/{len(names)}"})
+    return _bulk_response(datastore.set_enabled, "Disabled", False)
 
 
 @APP.post("/api/bulk-test")
 def api_bulk_test():
+    """Probe the selected targets concurrently (one CLI run, shared pool).
+
+    ok only when every target passed; 404 when a name was not found, 502
+    when a probe failed (per-name reasons in `results`).
+    """
     names = bulk_from_json()
     if not names:
         return jsonify({"ok": False, "message": "No targets selected"})
-    ok = 0
-    for n in names:
-        rc, _ = run_cmd(["test", n])
-        if rc == 0:
-            ok += 1
-    return jsonify({"ok": True, "message": f"Tested {len(names)} targets"})
+    ok, results = run_batch_test(names)
+    missing = sum(1 for v in results.values() if v == "not found")
+    message = f"Tested {len(names)} targets ({ok} OK" + (f", {missing} not found)" if missing else ")")
+    code = 200 if ok == len(results) else (404 if missing else 502)
+    return jsonify({"ok": code == 200, "message": message, "results": results}), code
 
 
 @APP.post("/api/bulk-remove")
 def api_bulk_remove():
-    names = bulk_from_json()
-    if not names:
-        return jsonify({"ok": False, "message": "No targets selected"})
-    ok = 0
-    for n in names:
-        rc, _ = run_cmd(["remove", n])
-        if rc == 0:
-            ok += 1
-    return jsonify({"ok": ok == len(names), "message": f"Removed {ok}/{len(names)}"})
+    return _bulk_response(datastore.remove_targets, "Removed")
 
 @APP.post("/api/set-target-interval")
 def api_set_target_interval():
     name = request.form.get("name", "").strip()
     sec = request.form.get("seconds", "").strip()
-    rc, out = run_cmd(["set-target-interval", name, sec])
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed")})
+    return ds_action(datastore.set_interval, name, sec, message=f"OK: Interval set for {name} -> {sec}s")
 
 @APP.post("/api/edit")
 def api_edit():
@@ -1088,21 +2229,23 @@ def api_edit():
     endpoint = request.form.get("endpoint", "").strip()
     interval = request.form.get("interval", "").strip()
     enabled = request.form.get("enabled", "1").strip()
-    rc, out = run_cmd(["edit", old_name, new_name, ip, endpoint, interval, enabled])
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed")})
+    return ds_action(datastore.edit_target, old_name, new_name, ip, endpoint, interval, enabled,
+                     message=f"OK: Updated {old_name} -> {new_name}")
 
 @APP.get("/api/get")
 def api_get():
     name = (request.args.get("name") or "").strip()
     if not name:
         return die_json("Missing name", 400)
-    rc, out = run_cmd(["get", name])
-    # best effort: mask endpoint in a separate field too
-    masked = "-"
-    m = re.search(r"(https?://\S+)", out or "")
-    if m:
-        masked = mask_endpoint(m.group(1))
-    return jsonify({"ok": rc == 0, "message": out or ("OK" if rc == 0 else "Failed"), "endpoint_masked": masked})
+    try:
+        row = db_read(lambda con: datastore.get_target(con, name)) if DB_PATH.exists() else None
+    except Exception as e:
+        return jsonify({"ok": False, "message": f"ERROR: {e}", "endpoint_masked": "-"})
+    if not row:
+        return jsonify({"ok": False, "message": f"ERROR: Not found: {name}", "endpoint_masked": "-"})
+    # message keeps the CLI `get` format: name|ip|endpoint|interval|enabled
+    out = "|".join(str(row[k]) for k in ("name", "ip", "endpoint", "interval", "enabled"))
+    return jsonify({"ok": True, "message": out, "endpoint_masked": mask_endpoint(row["endpoint"] or "")})
 
 
 @APP.get("/api/info")
@@ -1111,8 +2254,6 @@ def api_info():
 
     This is DB-backed (SQLite) to avoid depending on CLI output format.
     """
-    import sqlite3
-
     name = (request.args.get("name") or "").strip()
     if not name:
         return die_json("Missing name", 400)
@@ -1121,52 +2262,30 @@ def api_info():
         return die_json("Database not found", 404)
 
     try:
-        con = sqlite3.connect(str(DB_PATH), timeout=2.0)
-        con.row_factory = sqlite3.Row
-        try:
-            con.execute("PRAGMA busy_timeout=2000;")
-        except Exception:
-            pass
-
-        cur = con.cursor()
-        cur.execute(
-            """
-            SELECT
-              t.name,
-              t.ip,
-              t.endpoint,
-              t.interval,
-              t.enabled,
-              COALESCE(r.status, 'unknown') AS last_status,
-              COALESCE(r.last_ping, 0) AS last_ping,
-              COALESCE(r.last_sent, 0) AS last_response,
-              COALESCE(r.last_rtt_ms, -1) AS last_latency
-            FROM targets t
-            LEFT JOIN runtime r ON r.name = t.name
-            WHERE t.name = ?
-            LIMIT 1;
-            """,
-            (name,),
-        )
-        row = cur.fetchone()
+        rows = db_read(lambda con: datastore.target_state_rows(con, name=name))
+        row = rows[0] if rows else None
         if not row:
             return die_json("Target not found", 404)
 
         enabled = int(row["enabled"] or 0)
-        status = (row["last_status"] or "unknown")
-
-        if enabled != 1:
-            status = "disabled"
-        else:
-            if str(status).lower() in ("unknown", ""):
-                status = "starting"
-            if str(status).lower() == "disabled":
-                status = "starting"
+        status = datastore.ui_status(enabled, row["last_status"])
 
         last_ping_epoch = _safe_int(row["last_ping"], 0)
         last_resp_epoch = _safe_int(row["last_response"], 0)
         last_rtt_ms = _safe_int(row["last_latency"], -1)
 
+        # last ping check (webui/icmp.py), µs in the DB; None before the first
+        def _us_to_ms(v):
+            return None if v is None else round(int(v) / 1000, 3)
+
+        ping = {
+            "loss_pct": row["loss_pct"],
+            "rtt_min_ms": _us_to_ms(row["rtt_min_us"]),
+            "rtt_avg_ms": _us_to_ms(row["rtt_avg_us"]),
+            "rtt_max_ms": _us_to_ms(row["rtt_max_us"]),
+            "jitter_ms": _us_to_ms(row["rtt_mdev_us"]),
+        }
+
         uptime = {
             "24h": compute_uptime_stats(DB_PATH, name, 1),
             "7d": compute_uptime_stats(DB_PATH, name, 7),
@@ -1189,16 +2308,12 @@ def api_info():
                 "last_ping_human": human_ts(last_ping_epoch),
                 "last_response_human": human_ts(last_resp_epoch),
                 "last_rtt_ms": last_rtt_ms,
+                "ping": ping,
             },
             "uptime": uptime,
         })
     except Exception as e:
         return die_json(f"Failed to read info: {e}", 500)
-    finally:
-        try:
-            con.close()
-        except Exception:
-            pass
 
 
 # ---- API: name suggestion (reverse DNS best-effort) ----
@@ -1226,22 +2341,24 @@ def api_run_now():
     meta = load_run_meta()
     existing_pid = int(meta.get("pid") or 0)
     if existing_pid and pid_is_running(existing_pid):
-        return jsonify({"ok": True, "message": "Already running", "pid": existing_pid})
+        return jsonify({"ok": True, "message": "Already running", "pid": existing_pid, "started": int(meta.get("started") or 0)})
 
-    cmd = [CLI, "run-now", "--force"]
+    cmd = [CLI, "run-now", "--force", "--trigger", "manual"]
     try:
         # truncate output file
         RUN_OUT_FILE.write_text("", encoding="utf-8")
         with open(str(RUN_OUT_FILE), "w", encoding="utf-8") as out_f:
             p = subprocess.Popen(cmd, stdout=out_f, stderr=subprocess.STDOUT, text=True)
 
+        started = int(time.time())
         save_run_meta({
             "pid": p.pid,
-            "started": int(time.time()),
+            "run_pid": p.pid,
+            "started": started,
             "finished": 0,
             "rc": None
         })
-        return jsonify({"ok": True, "message": "Started", "pid": p.pid})
+        return jsonify({"ok": True, "message": "Started", "pid": p.pid, "started": started})
     except Exception as e:
         save_run_meta({"pid": 0, "started": 0, "finished": int(time.time()), "rc": 1})
         return jsonify({"ok": False, "message": f"Failed to start run-now: {str(e)}"})
@@ -1288,48 +2405,129 @@ def api_run_status():
 
 @APP.get("/api/run-output")
 def api_run_output():
-    # tail last N lines so UI can display progress while running
-    try:
-        lines = int(request.args.get("lines", "120"))
-    except Exception:
-        lines = 120
-    lines = max(20, min(800, lines))
+    """Run output + progress.
 
+    With `?offset=<cursor>` only complete lines after that byte offset are
+    returned, plus the next `offset`; `done`/`summary`/`last_line` come from
+    the run's row in the runs table (see run_progress). Without an offset
+    the last `lines` lines are returned (read backwards from the end of the
+    file).
+    """
+    meta = load_run_meta()
     try:
-        raw = RUN_OUT_FILE.read_text(encoding="utf-8", errors="replace") if RUN_OUT_FILE.exists() else ""
-        arr = raw.splitlines()
-        tail = "\n".join(arr[-lines:]) if arr else ""
-        summary = parse_run_summary(raw)
-
-        # Progress: count distinct targets completed based on "run:" lines
-        done_names = []
-        for ln in arr:
-            if ln.startswith("run:"):
-                parts = ln.split()
-                if len(parts) >= 2:
-                    done_names.append(parts[1])
-        done = len(set(done_names))
-        last_line = arr[-1] if arr else ""
-
-        return jsonify({"ok": True, "text": tail, "summary": summary, "done": done, "last_line": last_line})
+        progress = run_progress(meta)
+        offset_raw = (request.args.get("offset") or "").strip()
+        if offset_raw.isdigit():
+            arr, cursor = read_lines_from(RUN_OUT_FILE, int(offset_raw))
+        else:
+            try:
+                lines = int(request.args.get("lines", "120"))
+            except Exception:
+                lines = 120
+            lines = max(20, min(800, lines))
+            arr, cursor = read_tail_lines(RUN_OUT_FILE, lines)
+        return jsonify({
+            "ok": True,
+            "text": "\n".join(arr),
+            "offset": cursor,
+            "summary": progress["summary"],
+            "done": progress["done"],
+            "last_line": progress["last_line"],
+        })
     except Exception as e:
         return jsonify({"ok": False, "text": f"(error reading output: {str(e)})", "summary": None, "done": 0, "last_line": ""})
 
 @APP.get("/api/run-result")
-
 def api_run_result():
+    """Outcome of the last /api/run-now: ok once its runs row has the final
+    counters and the CLI exited cleanly; otherwise the output tail explains."""
     meta = load_run_meta()
+    progress = run_progress(meta)
+    summary = progress["summary"]
+    ok = summary is not None and meta.get("rc") in (None, 0)
+    message = "OK"
+    if not ok:
+        try:
+            message = "\n".join(read_tail_lines(RUN_OUT_FILE, 5)[0]).strip() or "Failed"
+        except Exception:
+            message = "Failed"
+    return jsonify({"ok": ok, "message": message, "summary": summary, "run_id": progress["run_id"], "meta": meta})
+
+
+# ---- API: run history and events (runs/events tables) ----
+@APP.get("/api/runs")
+def api_runs():
+    """Past runs, newest first. limit (<= 200); before: run id to page
+    back from; trigger: timer | manual | test."""
+    limit = max(1, min(200, _safe_int(request.args.get("limit"), 50)))
+    before = request.args.get("before", "").strip()
+    trigger = (request.args.get("trigger") or "").strip() or None
+    if before and not before.isdigit():
+        return die_json("before must be a run id", 400)
+    if not DB_PATH.exists():
+        return jsonify({"ok": True, "runs": []})
     try:
-        out = RUN_OUT_FILE.read_text(encoding="utf-8", errors="replace").strip() if RUN_OUT_FILE.exists() else ""
-    except Exception:
-        out = ""
+        rows = db_read(lambda con: datastore.run_rows(con, limit, int(before) if before else None, trigger))
+    except Exception as e:
+        return die_json(f"Failed to read runs: {e}", 500)
+    return jsonify({"ok": True, "runs": [run_row_json(r) for r in rows]})
 
-    summary = parse_run_summary(out)
-    ok = True
-    if "Unknown command" in out:
-        ok = False
 
-    return jsonify({"ok": ok, "message": out or ("OK" if ok else "Failed"), "summary": summary, "meta": meta})
+@APP.get("/api/run-events")
+def api_run_events():
+    """Probe results and runner messages, newest first, by indexed queries.
+
+    target, level (info|warn|error), run (id), q: words in the message
+    (full-text, prefix match), hours or since/until (epoch s), limit
+    (<= 1000), before: event id to page back from (`next` of the previous
+    page, null on the last one).
+    """
+    args = request.args
+    try:
+        since = int(args.get("since") or 0)
+        until = int(args.get("until") or 0)
+        hours = int(args.get("hours") or 0)
+        run_id = int(args.get("run") or 0)
+        before = int(args.get("before") or 0)
+        limit = max(1, min(1000, int(args.get("limit") or 200)))
+    except ValueError:
+        return die_json("since, until, hours, run, before and limit must be integers", 400)
+    level = (args.get("level") or "").strip().lower()
+    if level in ("", "all"):
+        level = None
+    elif level not in datastore.EVENT_LEVELS:
+        return die_json("level must be all, info, warn or error", 400)
+    if hours > 0:
+        since = int(time.time()) - hours * 3600
+    if not DB_PATH.exists():
+        return jsonify({"ok": True, "events": [], "next": None})
+    try:
+        rows = db_read(lambda con: datastore.event_rows(
+            con,
+            target=(args.get("target") or "").strip() or None,
+            level=level,
+            since=since or None,
+            until=until or None,
+            q=(args.get("q") or "").strip() or None,
+            run_id=run_id or None,
+            limit=limit,
+            before=before or None,
+        ))
+    except Exception as e:
+        return die_json(f"Failed to read events: {e}", 500)
+    return jsonify({
+        "ok": True,
+        "events": [{
+            "id": r["id"],
+            "run_id": r["run_id"],
+            "ts": r["ts"],
+            "time": human_ts(r["ts"]),
+            "target": r["target"],
+            "level": r["level"],
+            "message": r["message"],
+        } for r in rows],
+        "next": rows[-1]["id"] if len(rows) == limit else None,
+    })
 
 
 # ---- API: network scan ----
@@ -1394,6 +2592,373 @@ def _get_local_cidrs() -> list[str]:
         seen.add(c)
         uniq.append(c)
     return uniq
+
+
+def _scan_networks(opts: dict):
+    """Resolve the scan scope to de-duplicated IPv4 networks.
+
+    Returns (networks, skipped) where `skipped` lists (cidr, reason) for
+    entries that are invalid, not IPv4 or larger than /SCAN_MIN_PREFIX.
+    """
+    cidrs = list(_get_local_cidrs())
+    scope = str(opts.get("scope") or "local")
+    if "custom" in scope:
+        cidrs.extend(c.strip() for c in str(opts.get("custom") or "").split(",") if c.strip())
+    nets, skipped = [], []
+    for c in cidrs:
+        try:
+            net = ipaddress.ip_network(c, strict=False)
+        except ValueError:
+            skipped.append((c, "invalid CIDR"))
+            continue
+        if net.version != 4:
+            skipped.append((c, "not IPv4"))
+            continue
+        if net.prefixlen < SCAN_MIN_PREFIX:
+            skipped.append((c, f"larger than /{SCAN_MIN_PREFIX}"))
+            continue
+        if any(net.subnet_of(n) for n in nets):
+            continue
+        nets = [n for n in nets if not n.subnet_of(net)] + [net]
+    return nets, skipped
+
+
+class IcmpSweeper:
+    """Rate-limited ICMP echo sweep over one socket.
+
+    Uses a raw socket when running as root, otherwise an unprivileged ICMP
+    datagram socket (net.ipv4.ping_group_range). A receiver thread collects
+    echo replies while the caller sends; `on_reply(ip)` fires once per host.
+    """
+
+    def __init__(self, on_reply):
+        self.on_reply = on_reply
+        self.ident = os.getpid() & 0xFFFF
+        self.replied = set()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.sock, self.raw = icmp.open_socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.setblocking(False)
+        self._rx = threading.Thread(target=self._recv_loop, name="scan-icmp-rx", daemon=True)
+        self._rx.start()
+
+    def _recv_loop(self):
+        import select
+        while not self._stop.is_set():
+            r, _, _ = select.select([self.sock], [], [], 0.2)
+            if not r:
+                continue
+            while True:
+                try:
+                    data, addr = self.sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    return
+                reply = icmp.parse_reply(data, self.raw)
+                if not reply:
+                    continue
+                # Raw sockets see every echo reply on the host: match our id.
+                # Datagram sockets get only their own (kernel rewrites the id).
+                if self.raw and reply[0] != self.ident:
+                    continue
+                ip = addr[0]
+                with self._lock:
+                    if ip in self.replied:
+                        continue
+                    self.replied.add(ip)
+                self.on_reply(ip)
+
+    def send(self, ip: str, seq: int):
+        pkt = icmp.echo_request(self.ident, seq, b"interheart-scan!")
+        for _ in range(50):
+            try:
+                self.sock.sendto(pkt, (ip, 0))
+                return
+            except (BlockingIOError, InterruptedError):
+                time.sleep(0.002)
+            except OSError as e:
+                # ENOBUFS under bursts: back off briefly; anything else
+                # (unreachable network, EPERM by firewall) skips the host.
+                if e.errno == errno.ENOBUFS:
+                    time.sleep(0.005)
+                    continue
+                return
+
+    def has_replied(self, ip: str) -> bool:
+        with self._lock:
+            return ip in self.replied
+
+    def close(self):
+        self._stop.set()
+        self._rx.join(timeout=1.0)
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+def _ping_once(ip: str) -> bool:
+    try:
+        p = subprocess.run(["ping", "-c", "1", "-W", "1", "-n", "-q", ip],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+        return p.returncode == 0
+    except Exception:
+        return False
+
+
+def _harvest_neighbors(nets: list) -> dict:
+    """Return {ip: mac} from the kernel neighbour table for hosts in `nets`.
+
+    The sweep itself triggers ARP on directly attached subnets, so hosts that
+    drop ICMP still show up here with a resolved MAC.
+    """
+    out = {}
+    try:
+        data = json.loads(subprocess.check_output(["ip", "-j", "-4", "neigh", "show"], text=True) or "[]")
+    except Exception:
+        return out
+    for n in data:
+        ip, mac = n.get("dst"), n.get("lladdr")
+        states = n.get("state") or []
+        if not ip or not mac or any(st in ("FAILED", "INCOMPLETE") for st in states):
+            continue
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            continue
+        if any(addr in net for net in nets):
+            out[ip] = mac.lower()
+    return out
+
+
+def _load_mac_vendors() -> dict:
+    """OUI prefix (6 hex digits) -> vendor, from nmap/ieee-data when installed."""
+    vendors = {}
+    for path in SCAN_MAC_PREFIX_FILES:
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    m = re.match(r"^([0-9A-Fa-f]{6})\s+(?:\(base 16\)\s+)?(.+)$", line.strip())
+                    if m:
+                        vendors.setdefault(m.group(1).upper(), m.group(2).strip())
+        except Exception:
+            continue
+        if vendors:
+            break
+    return vendors
+
+
+def _reverse_dns_many(ips: list) -> dict:
+    """Parallel PTR lookups with an overall deadline; misses are omitted."""
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    def _one(ip):
+        try:
+            return socket.gethostbyaddr(ip)[0]
+        except Exception:
+            return ""
+
+    if not ips:
+        return {}
+    pool = ThreadPoolExecutor(max_workers=min(SCAN_DNS_WORKERS, len(ips)))
+    futs = {pool.submit(_one, ip): ip for ip in ips}
+    done, _ = wait(futs, timeout=SCAN_DNS_TIMEOUT)
+    pool.shutdown(wait=False, cancel_futures=True)
+    return {futs[f]: f.result() for f in done if f.result()}
+
+
+def _scan_worker():
+    """Network discovery, run as a separate process by scan_worker.py.
+
+    Sweeps every network from the scan scope with ICMP echo (rate/attempts
+    from SCAN_PROFILES), then harvests the neighbour table, resolves PTR
+    names and MAC vendors. Found hosts are streamed into scan_meta.json
+    (`found`) and scan_last_output.txt while the sweep runs.
+    """
+    me = os.getpid()
+    # api_scan_start records our pid right after spawning us; wait for it so
+    # our first meta write is not overwritten.
+    for _ in range(60):
+        if int(load_scan_meta().get("pid") or 0) == me:
+            break
+        time.sleep(0.05)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    opts = load_scan_meta().get("opts") or {}
+    profile = SCAN_PROFILES.get(str(opts.get("speed") or "normal"), SCAN_PROFILES["normal"])
+    t0 = time.monotonic()
+
+    lock = threading.Lock()
+    found = {}        # ip -> device dict (insertion order = discovery order)
+    pending = []      # output lines not yet flushed
+    state = {"current_ip": "", "sent": 0, "total": 0, "dirty": True}
+    out_f = open(str(SCAN_OUT_FILE), "w", encoding="utf-8")
+
+    def emit(line: str):
+        with lock:
+            pending.append(line)
+            state["dirty"] = True
+
+    def add_host(ip: str, source: str, mac: str = ""):
+        with lock:
+            if ip in found:
+                if mac and not found[ip].get("mac"):
+                    found[ip]["mac"] = mac
+                return
+            found[ip] = {"ip": ip, "host": "", "source": source, "mac": mac}
+            pending.append(f"found: {ip} ({source})")
+            state["dirty"] = True
+
+    def flush(final: bool = False, rc=None, error: str = ""):
+        with lock:
+            if not state["dirty"] and not final:
+                return
+            lines = list(pending)
+            pending.clear()
+            state["dirty"] = False
+            devices = [dict(d) for d in found.values()]
+            progress = {"sent": state["sent"], "total": state["total"]}
+            current_ip = state["current_ip"]
+        if lines:
+            out_f.write("\n".join(lines) + "\n")
+            out_f.flush()
+        meta = load_scan_meta()
+        if int(meta.get("pid") or 0) not in (0, me):
+            return  # superseded by a forced restart
+        meta.update({
+            "cidrs": [str(n) for n in nets],
+            "found": devices,
+            "current_ip": current_ip,
+            "progress": progress,
+        })
+        if final:
+            meta.update({"finished": int(time.time()), "rc": rc})
+            if error and not meta.get("error"):
+                meta["error"] = error
+        save_scan_meta(meta)
+
+    nets = []
+    try:
+        nets, skipped = _scan_networks(opts)
+        skipped_msg = ", ".join(f"{c} ({why})" for c, why in skipped)
+        for c, why in skipped:
+            emit(f"info: skipped {c}: {why}")
+        state["total"] = sum(max(0, n.num_addresses - 2) if n.prefixlen < 31 else n.num_addresses for n in nets)
+        if not nets:
+            emit("info: no networks to scan")
+            err = "No networks to scan" + (f"; skipped {skipped_msg}" if skipped_msg else "")
+            flush(final=True, rc=1, error=err)
+            return
+        emit(f"info: {len(nets)} network(s), {state['total']} addresses, speed={opts.get('speed') or 'normal'}")
+        flush()
+
+        try:
+            sweeper = IcmpSweeper(lambda ip: add_host(ip, "icmp"))
+        except OSError as e:
+            sweeper = None
+            emit(f"info: ICMP socket unavailable ({e}); using ping")
+
+        last_flush = time.monotonic()
+        for net in nets:
+            if stop.is_set():
+                break
+            emit(f"scan: {net}")
+            hosts = [str(h) for h in (net.hosts() if net.prefixlen < 31 else net)]
+            if sweeper is None:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=profile["workers"]) as pool:
+                    for ip, ok in zip(hosts, pool.map(_ping_once, hosts)):
+                        with lock:
+                            state["sent"] += 1
+                            state["current_ip"] = ip
+                        if ok:
+                            add_host(ip, "icmp")
+                        if stop.is_set():
+                            break
+                        if time.monotonic() - last_flush >= 0.5:
+                            flush()
+                            last_flush = time.monotonic()
+                continue
+
+            todo = hosts
+            for attempt in range(profile["attempts"]):
+                t_start = time.monotonic()
+                for i, ip in enumerate(todo):
+                    if stop.is_set():
+                        break
+                    ahead = t_start + i / profile["rate"] - time.monotonic()
+                    if ahead > 0.002:
+                        time.sleep(ahead)
+                    sweeper.send(ip, i)
+                    if attempt == 0:
+                        with lock:
+                            state["sent"] += 1
+                    if i % 256 == 0:
+                        with lock:
+                            state["current_ip"] = ip
+                            state["dirty"] = True
+                        if time.monotonic() - last_flush >= 0.5:
+                            flush()
+                            last_flush = time.monotonic()
+                # grace period for late replies before the next attempt/network
+                deadline = time.monotonic() + profile["wait"]
+                while time.monotonic() < deadline and not stop.is_set():
+                    time.sleep(0.1)
+                todo = [ip for ip in todo if not sweeper.has_replied(ip)]
+                if not todo:
+                    break
+            flush()
+            last_flush = time.monotonic()
+
+        if sweeper is not None:
+            sweeper.close()
+
+        if stop.is_set():
+            emit("info: cancelled")
+            flush(final=True, rc=1, error="Cancelled")
+            return
+
+        neigh = _harvest_neighbors(nets)
+        for ip, mac in neigh.items():
+            add_host(ip, "arp", mac)
+
+        with lock:
+            ips = list(found.keys())
+        names = _reverse_dns_many(ips)
+        vendors = _load_mac_vendors()
+        with lock:
+            for ip, dev in found.items():
+                if names.get(ip):
+                    dev["host"] = names[ip].split(".")[0]
+                mac = dev.get("mac") or ""
+                if mac and vendors:
+                    v = vendors.get(mac.replace(":", "")[:6].upper())
+                    if v:
+                        dev["vendor"] = v
+            state["current_ip"] = ""
+        emit(f"done: found={len(ips)} elapsed={time.monotonic() - t0:.1f}s")
+        flush(final=True, rc=0, error=f"Skipped {skipped_msg}" if skipped_msg else "")
+    except Exception as e:
+        emit(f"error: {e}")
+        flush(final=True, rc=1, error=str(e))
+    finally:
+        try:
+            out_f.close()
+        except Exception:
+            pass
+
+
+def _discover_worker():
+    """Entry point for discovery_worker.py; same engine as the network scan."""
+    _scan_worker()
+
+
+@APP.post("/api/scan-start")
 def api_scan_start():
     ensure_state_dir()
     meta = load_scan_meta()
@@ -1427,12 +2992,13 @@ def api_scan_start():
 
     try:
         p = subprocess.Popen(
-            ["python3", str(BASE_DIR / "scan_worker.py")],
+            [sys.executable or "python3", str(BASE_DIR / "scan_worker.py")],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
         m = load_scan_meta()
-        m.update({"pid": int(p.pid or 0), "started": int(time.time()), "finished": 0, "rc": None, "error": "", "opts": opts})
+        m.update({"pid": int(p.pid or 0), "started": int(time.time()), "finished": 0, "rc": None, "error": "", "opts": opts,
+                  "cidrs": [], "found": [], "current_ip": "", "progress": {}})
         save_scan_meta(m)
         return jsonify({"ok": True, "message": "Started", "pid": int(p.pid or 0)})
     except Exception as e:
@@ -1472,7 +3038,6 @@ def api_scan_cancel():
     if not pid or not pid_is_running(pid):
         return jsonify({"ok": True, "message": "Not running"})
     try:
-        import signal
         os.kill(pid, signal.SIGTERM)
         meta["error"] = "Cancelled"
         meta["rc"] = 1
@@ -1483,17 +3048,20 @@ def api_scan_cancel():
 
 @APP.get("/api/scan-output")
 def api_scan_output():
+    """Scan output; `?offset=<cursor>` returns only new lines (see api_run_output)."""
     try:
-        lines = int(request.args.get("lines", "200"))
-    except Exception:
-        lines = 200
-    lines = max(50, min(1200, lines))
-    try:
-        raw = SCAN_OUT_FILE.read_text(encoding="utf-8", errors="replace") if SCAN_OUT_FILE.exists() else ""
-        arr = raw.splitlines()
-        tail = "\n".join(arr[-lines:]) if arr else ""
+        offset_raw = (request.args.get("offset") or "").strip()
+        if offset_raw.isdigit():
+            arr, cursor = read_lines_from(SCAN_OUT_FILE, int(offset_raw))
+        else:
+            try:
+                lines = int(request.args.get("lines", "200"))
+            except Exception:
+                lines = 200
+            lines = max(50, min(1200, lines))
+            arr, cursor = read_tail_lines(SCAN_OUT_FILE, lines)
         meta = load_scan_meta()
-        return jsonify({"ok": True, "text": tail, "meta": meta})
+        return jsonify({"ok": True, "text": "\n".join(arr), "offset": cursor, "meta": meta})
     except Exception as e:
         return jsonify({"ok": False, "text": f"(error reading scan output: {str(e)})", "meta": {}})
 
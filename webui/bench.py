@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""interheart WebUI/datastore benchmark.
+
+Builds a synthetic state.db per target count and drives the Flask app
+through its test client:
+
+    python3 bench.py [--sizes 100,1000,10000] [--days 1] [--requests 50]
+                     [--intervals 60:5,300:3,900:2] [--seed 1] [--workdir DIR]
+                     [--json OUT] [--compare BASE.json] [--threshold 20] [--min-ms 1]
+
+Per endpoint it reports p50/p95/p99 latency, SQLite statements per request
+and peak Python allocation per request (tracemalloc), plus peak RSS per
+target count. Every size runs in its own process so RSS and caches do not
+leak between sizes.
+
+The synthetic data is deterministic for a given seed/size/days/interval
+mix and schema version, and is cached in --workdir, so two commits measure
+the same rows. `--json` saves the results; `--compare` prints the change
+against a saved run and exits 1 when p95 latency regressed by more than
+--threshold percent (and --min-ms, to ignore sub-millisecond jitter) or an
+endpoint issues more queries.
+
+History generation takes roughly 15 s per million samples (10k targets x
+1 day with the default interval mix is ~8M samples); it only happens once
+per day and parameter set.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BASE_DIR))
+
+import datastore  # noqa: E402
+
+# Flap profiles: (share, p(up -> failing) per sample, mean failure length in
+# samples, share of failures that are heartbeat-only (ping ok)).
+PROFILES = (
+    (0.70, 0.0005, 2, 0.3),  # stable
+    (0.20, 0.02, 3, 0.5),    # flapping
+    (0.05, 0.005, 30, 0.9),  # receiver outages
+    (0.05, 1.0, 10 ** 9, 0.0),  # dead host
+)
+
+
+# ---- Synthetic state.db ----
+def _parse_intervals(spec: str) -> list:
+    out = []
+    for part in spec.split(","):
+        iv, _, weight = part.partition(":")
+        out.append((int(iv), float(weight or 1)))
+    return out
+
+
+def _pick(rng, weighted):
+    r = rng.random() * sum(w for _v, w in weighted)
+    for v, w in weighted:
+        r -= w
+        if r <= 0:
+            return v
+    return weighted[-1][0]
+
+
+def build_db(db_path: Path, targets: int, days: int, intervals: list, seed: int, now: int) -> int:
+    """Create db_path with `targets` targets and `days` of history; returns sample count."""
+    rng = random.Random(seed)
+    if db_path.exists():
+        db_path.unlink()
+    datastore.init_db(db_path)
+    con = datastore.connect(db_path)
+    con.execute("PRAGMA synchronous=OFF;")
+    start = now - days * 86400
+    samples = 0
+    with datastore.transaction(con):
+        for i in range(targets):
+            con.execute(
+                "INSERT INTO targets(name, ip, endpoint, interval, enabled, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (
+                    f"host-{i:05d}",
+                    f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+                    f"https://hb.example.net/ping/{rng.getrandbits(64):016x}",
+                    _pick(rng, intervals),
+                    0 if rng.random() < 0.02 else 1,
+                    start,
+                    start,
+                ),
+            )
+        for ts in range(start, now + datastore.PARTITION_SECONDS, datastore.PARTITION_SECONDS):
+            datastore._ensure_partition(con, ts)
+        datastore._rebuild_history_view(con)
+
+        ids = dict(con.execute("SELECT name, id FROM target_ids;").fetchall())
+        pending = {}
+        for name, interval, enabled in con.execute("SELECT name, interval, enabled FROM targets;").fetchall():
+            profile = _pick(rng, [(p, p[0]) for p in PROFILES])
+            _share, p_fail, mean_len, hb_share = profile
+            tid = ids[name]
+            state, left = datastore.STATUS_UP, 0
+            ts = start + rng.randrange(interval)
+            last = None
+            while ts < now:
+                if left > 0:
+                    left -= 1
+                    if left == 0:
+                        state = datastore.STATUS_UP
+                elif rng.random() < p_fail:
+                    state = datastore.STATUS_HB_FAILED if rng.random() < hb_share else datastore.STATUS_DOWN
+                    left = max(1, int(rng.expovariate(1 / mean_len))) if mean_len < 10 ** 9 else 10 ** 9
+                rtt = -1 if state == datastore.STATUS_DOWN else int(rng.gammavariate(2.0, 8.0))
+                http = 200 if state == datastore.STATUS_UP else (503 if state == datastore.STATUS_HB_FAILED else 0)
+                table = datastore.partition_table(ts)
+                rows = pending.setdefault(table, [])
+                rows.append((tid, ts, state, rtt, http))
+                if len(rows) >= 50000:
+                    _flush(con, table, rows)
+                last = (state, ts, rtt)
+                samples += 1
+                ts += interval
+            if enabled and last:
+                status = "up" if last[0] == datastore.STATUS_UP else "down"
+                con.execute(
+                    "INSERT OR REPLACE INTO runtime(name, status, next_due, last_ping, last_sent, last_rtt_ms) "
+                    "VALUES (?, ?, ?, ?, ?, ?);",
+                    (name, status, last[1] + interval, last[1], last[1] if last[2] >= 0 else 0, last[2]),
+                )
+            elif not enabled:
+                con.execute("INSERT OR REPLACE INTO runtime(name, status) VALUES (?, 'disabled');", (name,))
+        for table, rows in pending.items():
+            _flush(con, table, rows)
+    # history_daily for finished days: same SQL as the v1 backfill, which
+    # reads through the `history` view
+    con.executescript(datastore.MIGRATIONS[0][1])
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    con.close()
+    return samples
+
+
+def _flush(con, table: str, rows: list) -> None:
+    rows.sort()
+    con.executemany(
+        f"INSERT OR REPLACE INTO {table}(target_id, ts, status, rtt_ms, curl_http) VALUES (?, ?, ?, ?, ?);", rows
+    )
+    rows.clear()
+
+
+def write_run_output(state_dir: Path, targets: int, now: int) -> None:
+    """run_last_output.txt / run_meta.json as left by a finished run-now."""
+    rng = random.Random(targets)
+    lines = []
+    for i in range(targets):
+        if rng.random() < 0.05:
+            lines.append(f"run: host-{i:05d} ping_ok=0")
+        else:
+            lines.append(f"run: host-{i:05d} ping_ok=1 curl_http=200 rtt_ms={rng.randrange(1, 80)}")
+    lines.append(
+        f"total={targets} due={targets} skipped=0 ping_ok={targets} ping_fail=0 sent={targets} "
+        f"curl_fail=0 disabled=0 force=1 deferred=0 duration_ms=4200"
+    )
+    (state_dir / "run_last_output.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    (state_dir / "run_meta.json").write_text(
+        json.dumps({"pid": 0, "started": now - 5, "finished": now, "rc": 0}), encoding="utf-8"
+    )
+
+
+def prepare(workdir: Path, targets: int, args) -> Path:
+    key = f"t{targets}-d{args.days}-s{args.seed}-v{datastore.SCHEMA_VERSION}-i{args.intervals.replace(':', 'x').replace(',', '_')}"
+    state_dir = workdir / key
+    db = state_dir / "state.db"
+    day = datetime.date.today().isoformat()
+    stamp = state_dir / "built"
+    # rebuilt daily: the snapshot grid and uptime windows are relative to today
+    if not (db.exists() and stamp.exists() and stamp.read_text() == day):
+        state_dir.mkdir(parents=True, exist_ok=True)
+        t0 = time.time()
+        n = build_db(db, targets, args.days, _parse_intervals(args.intervals), args.seed, int(time.time()))
+        stamp.write_text(day)
+        print(f"  built {db} ({n} samples, {time.time() - t0:.1f}s)", file=sys.stderr)
+    write_run_output(state_dir, targets, int(time.time()))
+    return state_dir
+
+
+# ---- Measurement (runs in a child process per size) ----
+_QUERIES = [0]
+
+
+def _count_queries(_sql):
+    _QUERIES[0] += 1
+
+
+def _instrument_sqlite():
+    import sqlite3
+
+    connect = sqlite3.connect
+
+    def traced(*a, **kw):
+        con = connect(*a, **kw)
+        con.set_trace_callback(_count_queries)
+        return con
+
+    sqlite3.connect = traced
+
+
+def _pct(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def measure(state_dir: Path, requests: int) -> dict:
+    os.environ["INTERHEART_STATE_DIR"] = str(state_dir)
+    os.environ.setdefault("INTERHEART_WEBUI_DEBUG", "0")
+    _instrument_sqlite()
+    import app
+
+    client = app.APP.test_client()
+    con = datastore.connect(state_dir / "state.db")
+    names = [r[0] for r in con.execute("SELECT name FROM targets ORDER BY name;")]
+    # a few targets change after the client's last poll (/state delta)
+    rev0 = con.execute("SELECT rev FROM state_seq WHERE id = 1;").fetchone()[0]
+    with datastore.transaction(con):
+        for n in names[:: max(1, len(names) // 10)]:
+            con.execute("UPDATE runtime SET last_ping = last_ping + 1 WHERE name = ?;", (n,))
+    con.close()
+    day = datetime.date.today().isoformat()
+    endpoints = {
+        "/": lambda i: "/",
+        "/state": lambda i: "/state",
+        "/state?since": lambda i: f"/state?since={rev0}&day={day}",
+        "/api/info": lambda i: f"/api/info?name={names[i * 7919 % len(names)]}",
+        "/api/run-output": lambda i: "/api/run-output",
+        "/api/run-output?offset": lambda i: "/api/run-output?offset=0",
+    }
+    results = {}
+    for label, url in endpoints.items():
+        for i in range(3):  # warm the pool, statement and page caches
+            client.get(url(i))
+        times, queries, size = [], 0, 0
+        for i in range(requests):
+            q0 = _QUERIES[0]
+            t0 = time.perf_counter()
+            resp = client.get(url(i))
+            times.append((time.perf_counter() - t0) * 1000)
+            queries += _QUERIES[0] - q0
+            size = len(resp.get_data())
+            if resp.status_code != 200:
+                raise SystemExit(f"{label}: HTTP {resp.status_code}")
+        # body size as a browser gets it (app.compress_response)
+        wire = len(client.get(url(0), headers={"Accept-Encoding": "gzip, br"}).get_data())
+        tracemalloc.start()
+        peak = 0
+        for i in range(3):
+            tracemalloc.reset_peak()
+            client.get(url(i))
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        results[label] = {
+            "p50_ms": round(_pct(times, 50), 3),
+            "p95_ms": round(_pct(times, 95), 3),
+            "p99_ms": round(_pct(times, 99), 3),
+            "mean_ms": round(statistics.fmean(times), 3),
+            "queries": round(queries / requests, 1),
+            "peak_kb": peak // 1024,
+            "bytes": size,
+            "wire_bytes": wire,
+        }
+    return {"endpoints": results, "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+# ---- Reporting ----
+def _meta(args) -> dict:
+    import sqlite3
+
+    try:
+        commit = subprocess.run(
+            ["git", "-C", str(BASE_DIR), "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit or "unknown",
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "days": args.days,
+        "seed": args.seed,
+        "intervals": args.intervals,
+        "requests": args.requests,
+    }
+
+
+def print_table(results: dict) -> None:
+    print(f"{'TARGETS':>8}  {'ENDPOINT':<24}{'P50_MS':>9}{'P95_MS':>9}{'P99_MS':>9}{'QUERIES':>9}{'PEAK_KB':>9}{'BYTES':>10}{'WIRE':>10}")
+    for size, res in results.items():
+        for label, r in res["endpoints"].items():
+            print(f"{size:>8}  {label:<24}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+                  f"{r['queries']:>9}{r['peak_kb']:>9}{r['bytes']:>10}{r.get('wire_bytes', '-'):>10}")
+        print(f"{size:>8}  {'(peak RSS)':<24}{res['rss_kb'] // 1024:>8} MB")
+
+
+def compare(base: dict, cur: dict, threshold: float, min_ms: float) -> int:
+    print(f"\nvs {base['meta']['commit']} ({base['meta']['date']}):")
+    regressions = 0
+    for size, res in cur["results"].items():
+        old = base["results"].get(size)
+        if not old:
+            continue
+        for label, r in res["endpoints"].items():
+            o = old["endpoints"].get(label)
+            if not o:
+                continue
+            d95 = (r["p95_ms"] - o["p95_ms"]) / o["p95_ms"] * 100 if o["p95_ms"] else 0.0
+            flag = ""
+            if (d95 > threshold and r["p95_ms"] - o["p95_ms"] > min_ms) or r["queries"] > o["queries"]:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{size:>8}  {label:<24} p95 {o['p95_ms']:.2f} -> {r['p95_ms']:.2f} ms ({d95:+.0f}%)"
+                  f"  queries {o['queries']} -> {r['queries']}{flag}")
+    return 1 if regressions else 0
+
+
+def main(argv) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark the interheart WebUI against a synthetic state.db")
+    ap.add_argument("--sizes", default="100,1000,10000", help="comma-separated target counts")
+    ap.add_argument("--days", type=int, default=1, help="days of history (1-90)")
+    ap.add_argument("--intervals", default="60:5,300:3,900:2", help="interval:weight mix")
+    ap.add_argument("--requests", type=int, default=50, help="timed requests per endpoint")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workdir", default="/tmp/interheart-bench", help="synthetic DB cache")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--compare", help="previous --json output to compare against")
+    ap.add_argument("--threshold", type=float, default=20.0, help="allowed p95 regression in percent")
+    ap.add_argument("--min-ms", type=float, default=1.0, help="ignore p95 regressions smaller than this")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.worker:
+        json.dump(measure(Path(args.worker), args.requests), sys.stdout)
+        return 0
+    if not 1 <= args.days <= 90:
+        ap.error("--days must be 1-90")
+
+    workdir = Path(args.workdir)
+    results = {}
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        print(f"{size} targets", file=sys.stderr)
+        state_dir = prepare(workdir, size, args)
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", str(state_dir), "--requests", str(args.requests)],
+            capture_output=True, text=True,
+        )
+        if out.returncode != 0:
+            print(out.stderr, file=sys.stderr)
+            return 1
+        results[str(size)] = json.loads(out.stdout)
+
+    doc = {"meta": _meta(args), "results": results}
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(doc, indent=2) + "\n", encoding="utf-8")
+    if args.compare:
+        return compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), doc, args.threshold, args.min_ms)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
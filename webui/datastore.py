@@ -0,0 +1,1390 @@
+#!/usr/bin/env python3
+"""interheart data access: schema, validation and target reads/writes.
+
+Shared by the WebUI (imported, one short transaction per action) and the
+`interheart` CLI, which runs this file for target management commands:
+
+    python3 datastore.py [--db PATH] <command> [args...]
+
+Standard library only, so the CLI does not need the WebUI virtualenv.
+The runner's probe results (runtime/history/history_daily) are still written
+by `interheart run-now` through its batched sqlite3 session; `retention`
+(called by the runner about once an hour) maintains the history partitions.
+"""
+import bisect
+import ipaddress
+import os
+import re
+import signal
+import sqlite3
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+STATE_DIR = Path(os.environ.get("INTERHEART_STATE_DIR", "/var/lib/interheart"))
+DB_PATH = STATE_DIR / "state.db"
+SCHED_PID_FILE_NAME = "scheduler.pid"
+
+INTERVAL_MIN = 10
+INTERVAL_MAX = 86400
+BUSY_TIMEOUT_MS = 5000
+
+# interheart.sh keeps a copy of this number (DB_SCHEMA_VERSION) to skip the
+# Python start-up when the DB is already current.
+SCHEMA_VERSION = 11
+
+# History retention (see `retention`): raw samples live in one table per
+# week (history_w<ts // PARTITION_SECONDS>) behind the `history` view, so
+# expiring old samples drops whole tables instead of deleting rows.
+# interheart.sh routes its inserts with the same PARTITION_SECONDS.
+PARTITION_SECONDS = 7 * 86400
+
+# history.status codes (v5); the `history` view decodes them back to
+# 'up' / 'down' / 'disabled'. interheart.sh writes the same numbers.
+STATUS_DISABLED = 0
+STATUS_UP = 1
+STATUS_HB_FAILED = 2  # ping ok, heartbeat (endpoint) failed
+STATUS_DOWN = 3       # no ping reply
+
+# Runner metrics (v6, served by the WebUI at /metrics). Histogram bucket
+# upper bounds in ms; interheart.sh keeps copies (METRIC_*_BUCKETS_MS) and
+# writes the bucket index, the last bucket being +Inf.
+PROBE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+RUN_BUCKETS_MS = (500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+def _env_int(name: str, default: int) -> int:
+    v = os.environ.get(name, "").strip()
+    return int(v) if v.isdigit() else default
+
+
+HISTORY_DAYS = _env_int("INTERHEART_HISTORY_DAYS", 90)
+DB_MAX_MB = _env_int("INTERHEART_DB_MAX_MB", 0)  # 0 = no size cap
+# Removed/renamed target names are reported in /state deltas for this long
+STATE_TOMBSTONE_SEC = _env_int("INTERHEART_TOMBSTONE_SEC", 86400)
+
+# Scheduling phase (v7): each enabled target is probed at phase + k * interval
+# (epoch seconds), with phases spread evenly across the interval inside each
+# interval group, so equal intervals do not probe in lockstep. A target that
+# is added, enabled or given a new interval starts within
+# min(interval, FIRST_SPREAD_SEC) instead of immediately.
+FIRST_SPREAD_SEC = _env_int("INTERHEART_FIRST_SPREAD_SEC", 300)
+
+# Heartbeat outbox (v9): undelivered heartbeats are retried with exponential
+# backoff (15 s, 30 s, ... capped here) until they expire.
+OUTBOX_MAX_BACKOFF_SEC = 300
+
+
+class DataError(Exception):
+    """Validation or lookup failure; the message is shown to the user."""
+
+
+# ---- Validation ----
+_NAME_RE = re.compile(r"^[a-zA-Z0-9._-]+$")
+_IP_RE = re.compile(r"^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$")
+
+
+def validate_name(name: str) -> bool:
+    # allow: letters, numbers, dash, underscore, dot
+    return bool(name) and bool(_NAME_RE.match(name))
+
+
+def validate_ip(ip: str) -> bool:
+    m = _IP_RE.match(ip or "")
+    return bool(m) and all(0 <= int(o) <= 255 for o in m.groups())
+
+
+def validate_interval(value) -> bool:
+    s = str(value)
+    return s.isdigit() and INTERVAL_MIN <= int(s) <= INTERVAL_MAX
+
+
+def validate_endpoint(url: str) -> bool:
+    return bool(url) and (url.startswith("http://") or url.startswith("https://"))
+
+
+def mask_endpoint(url: str) -> str:
+    """Keep scheme + host, hide path/query: https://host/path?x=1 -> https://host/***"""
+    if not url:
+        return "-"
+    m = re.match(r"^([a-zA-Z]+)://([^/]*)", url)
+    if m and m.group(1) and m.group(2):
+        return f"{m.group(1)}://{m.group(2)}/***"
+    return "***"
+
+
+# ---- Schema ----
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (
+  name TEXT PRIMARY KEY,
+  ip TEXT NOT NULL,
+  endpoint TEXT NOT NULL,
+  interval INTEGER NOT NULL DEFAULT 60,
+  enabled INTEGER NOT NULL DEFAULT 1,
+  created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
+  updated_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+);
+
+CREATE TABLE IF NOT EXISTS runtime (
+  name TEXT PRIMARY KEY,
+  status TEXT NOT NULL DEFAULT 'unknown',
+  next_due INTEGER NOT NULL DEFAULT 0,
+  last_ping INTEGER NOT NULL DEFAULT 0,
+  last_sent INTEGER NOT NULL DEFAULT 0,
+  last_rtt_ms INTEGER NOT NULL DEFAULT -1
+);
+
+CREATE TABLE IF NOT EXISTS history (
+  ts INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  status TEXT NOT NULL,   -- 'up' | 'down' | 'disabled'
+  rtt_ms INTEGER NOT NULL DEFAULT -1,
+  curl_http INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_history_name_ts ON history(name, ts);
+
+CREATE INDEX IF NOT EXISTS idx_targets_enabled ON targets(enabled);
+CREATE INDEX IF NOT EXISTS idx_runtime_next_due ON runtime(next_due);
+"""
+
+# ---- History partitions ----
+_PART_RE = re.compile(r"^history_w(\d+)$")
+
+
+def partition_table(ts) -> str:
+    return f"history_w{int(ts) // PARTITION_SECONDS}"
+
+
+def history_tables(names, start, end) -> list:
+    """Partitions among `names` holding samples with start <= ts <= end, oldest first.
+
+    `names` is the set of table names in the DB.
+    """
+    parts = []
+    for n in names:
+        m = _PART_RE.match(n)
+        if m:
+            parts.append((int(m.group(1)), n))
+    return [n for k, n in sorted(parts) if k * PARTITION_SECONDS <= end and (k + 1) * PARTITION_SECONDS > start]
+
+
+def _partitions(con) -> list:
+    rows = con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'history_w%';")
+    return sorted((int(m.group(1)), m.group(0)) for m in (_PART_RE.match(r[0]) for r in rows) if m)
+
+
+# Partition layout (v5): integer target id and status code, clustered on
+# (target_id, ts) so a per-target time range is one contiguous b-tree read.
+# A second sample for the same target and second replaces the first.
+# v8 adds the ping statistics (NULL for samples taken before v8).
+_PARTITION_DDL = (
+    """CREATE TABLE {t} (
+  target_id INTEGER NOT NULL,             -- target_ids.id
+  ts INTEGER NOT NULL,
+  status INTEGER NOT NULL,                -- STATUS_* code
+  rtt_ms INTEGER NOT NULL DEFAULT -1,
+  curl_http INTEGER NOT NULL DEFAULT 0,
+  rtt_us INTEGER,                         -- mean echo RTT
+  jitter_us INTEGER,                      -- RTT mean deviation
+  loss_pct INTEGER,
+  PRIMARY KEY (target_id, ts)
+) WITHOUT ROWID;""",
+)
+_VIEW_ARM = (
+    "SELECT h.ts, i.name, CASE h.status WHEN 1 THEN 'up' WHEN 0 THEN 'disabled' ELSE 'down' END AS status, "
+    "h.rtt_ms, h.curl_http, h.rtt_us, h.jitter_us, h.loss_pct FROM {t} h JOIN target_ids i ON i.id = h.target_id"
+)
+# v5 layout, only used by the v5 migration
+_PARTITION_DDL_V5 = (
+    """CREATE TABLE {t} (
+  target_id INTEGER NOT NULL,
+  ts INTEGER NOT NULL,
+  status INTEGER NOT NULL,
+  rtt_ms INTEGER NOT NULL DEFAULT -1,
+  curl_http INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (target_id, ts)
+) WITHOUT ROWID;""",
+)
+_VIEW_ARM_V5 = (
+    "SELECT h.ts, i.name, CASE h.status WHEN 1 THEN 'up' WHEN 0 THEN 'disabled' ELSE 'down' END AS status, "
+    "h.rtt_ms, h.curl_http FROM {t} h JOIN target_ids i ON i.id = h.target_id"
+)
+# v4 layout, only used by the v4 migration
+_PARTITION_DDL_V4 = (
+    """CREATE TABLE {t} (
+  ts INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  status TEXT NOT NULL,   -- 'up' | 'down' | 'disabled'
+  rtt_ms INTEGER NOT NULL DEFAULT -1,
+  curl_http INTEGER NOT NULL DEFAULT 0
+);""",
+    "CREATE INDEX idx_{t}_name_ts ON {t}(name, ts);",
+)
+_VIEW_ARM_V4 = "SELECT ts, name, status, rtt_ms, curl_http FROM {t}"
+
+
+def _ensure_partition(con, ts, ddl=_PARTITION_DDL) -> bool:
+    """Create the partition for `ts`; returns True if it did not exist."""
+    table = partition_table(ts)
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (table,)).fetchone():
+        return False
+    for stmt in ddl:
+        con.execute(stmt.format(t=table))
+    return True
+
+
+def _rebuild_history_view(con, arm=_VIEW_ARM) -> None:
+    """`history` = UNION ALL of the partitions (ad-hoc queries, debugging).
+
+    The WebUI queries the partitions directly (history_tables) so lookups
+    keep using each partition's primary key.
+    """
+    con.execute("DROP VIEW IF EXISTS history;")
+    arms = [arm.format(t=t) for _k, t in _partitions(con)]
+    con.execute(f"CREATE VIEW history AS {' UNION ALL '.join(arms)};")
+
+
+def _migrate_v4(con) -> None:
+    # v4: split history into weekly partitions behind a `history` view
+    now = int(time.time())
+    keys = [r[0] for r in con.execute("SELECT DISTINCT ts / ? FROM history;", (PARTITION_SECONDS,))]
+    for k in keys:
+        _ensure_partition(con, k * PARTITION_SECONDS, _PARTITION_DDL_V4)
+        con.execute(
+            f"INSERT INTO {partition_table(k * PARTITION_SECONDS)}(ts, name, status, rtt_ms, curl_http) "
+            "SELECT ts, name, status, rtt_ms, curl_http FROM history WHERE ts >= ? AND ts < ? ORDER BY name, ts;",
+            (k * PARTITION_SECONDS, (k + 1) * PARTITION_SECONDS),
+        )
+    _ensure_partition(con, now, _PARTITION_DDL_V4)
+    _ensure_partition(con, now + PARTITION_SECONDS, _PARTITION_DDL_V4)
+    con.execute("DROP TABLE history;")
+    _rebuild_history_view(con, _VIEW_ARM_V4)
+
+
+def _migrate_v5(con) -> None:
+    # v5: integer target ids + status codes, partitions clustered on
+    # (target_id, ts). Ids are never reused, so a name keeps its history
+    # across remove/add (as it did when history was keyed by name).
+    con.execute("CREATE TABLE target_ids (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);")
+    con.execute("INSERT INTO target_ids(name) SELECT name FROM targets ORDER BY name;")
+    parts = _partitions(con)
+    for _k, t in parts:
+        con.execute(f"INSERT OR IGNORE INTO target_ids(name) SELECT DISTINCT name FROM {t};")
+    con.execute("DROP VIEW IF EXISTS history;")
+    for _k, t in parts:
+        for stmt in _PARTITION_DDL_V5:
+            con.execute(stmt.format(t=f"{t}_v5"))
+        con.execute(
+            f"""INSERT OR REPLACE INTO {t}_v5(target_id, ts, status, rtt_ms, curl_http)
+            SELECT i.id, h.ts,
+                   CASE WHEN h.status = 'up' THEN 1
+                        WHEN h.status = 'down' AND h.rtt_ms >= 0 THEN 2
+                        WHEN h.status = 'down' THEN 3 ELSE 0 END,
+                   h.rtt_ms, h.curl_http
+            FROM {t} h JOIN target_ids i ON i.name = h.name
+            ORDER BY i.id, h.ts;"""
+        )
+        con.execute(f"DROP TABLE {t};")
+        con.execute(f"ALTER TABLE {t}_v5 RENAME TO {t};")
+    con.execute(
+        "CREATE TRIGGER trg_target_ids_ins AFTER INSERT ON targets BEGIN "
+        "INSERT OR IGNORE INTO target_ids(name) VALUES (NEW.name); END;"
+    )
+    con.execute(
+        "CREATE TRIGGER trg_target_ids_upd AFTER UPDATE OF name ON targets BEGIN "
+        "INSERT OR IGNORE INTO target_ids(name) VALUES (NEW.name); END;"
+    )
+    _rebuild_history_view(con, _VIEW_ARM_V5)
+
+
+# ---- Scheduling phase ----
+def next_slot(now: int, interval: int, phase: int) -> int:
+    """First time on the target's phase grid at least interval/2 after `now`
+    (same as next_slot in interheart.sh): a probe right after a rebalance
+    moved the phase is not repeated a second later."""
+    t = now + (interval + 1) // 2
+    return t + (phase - t) % interval
+
+
+def first_due(now: int, interval: int, phase: int) -> int:
+    """First probe of a newly added/enabled/re-timed target: within min(interval, FIRST_SPREAD_SEC)."""
+    return now + phase % max(1, min(interval, FIRST_SPREAD_SEC))
+
+
+def rebalance_phases(con) -> dict:
+    """Spread enabled targets evenly over their interval; returns {name: phase}.
+
+    Within an interval group targets are ordered by a hash of their name, so
+    adding or removing one target only shifts its neighbours a little. Only
+    changed sched_phase rows are written.
+    """
+    groups = {}
+    for name, interval in con.execute("SELECT name, interval FROM targets WHERE enabled=1;"):
+        groups.setdefault(int(interval), []).append(name)
+    phases = {}
+    for interval, names in groups.items():
+        names.sort(key=lambda n: (zlib.crc32(n.encode()), n))
+        for i, n in enumerate(names):
+            phases[n] = i * interval // len(names)
+    old = dict(con.execute("SELECT name, phase FROM sched_phase;").fetchall())
+    con.executemany("DELETE FROM sched_phase WHERE name=?;", [(n,) for n in old if n not in phases])
+    con.executemany(
+        "INSERT OR REPLACE INTO sched_phase(name, phase) VALUES (?, ?);",
+        [(n, ph) for n, ph in phases.items() if old.get(n) != ph],
+    )
+    return phases
+
+
+def _schedule_first(con, names, phases, now: int) -> None:
+    """Set runtime.next_due of (enabled) `names` to their first_due."""
+    if not names:
+        return
+    marks = ",".join("?" * len(names))
+    rows = con.execute(f"SELECT name, interval FROM targets WHERE enabled=1 AND name IN ({marks});", list(names))
+    con.executemany(
+        "UPDATE runtime SET next_due=? WHERE name=?;",
+        [(first_due(now, int(iv), phases.get(n, 0)), n) for n, iv in rows.fetchall()],
+    )
+
+
+def _migrate_v7(con) -> None:
+    # v7: per-target scheduling phase (see rebalance_phases). Existing
+    # next_due values converge onto the phase grid after one probe.
+    con.execute("CREATE TABLE sched_phase (name TEXT PRIMARY KEY, phase INTEGER NOT NULL) WITHOUT ROWID;")
+    rebalance_phases(con)
+
+
+def _migrate_v8(con) -> None:
+    # v8: multi-echo ping statistics (webui/icmp.py). runtime keeps the last
+    # check's loss and min/avg/max/mdev RTT in microseconds, history the mean
+    # RTT, its deviation (jitter) and loss per sample.
+    for col in ("loss_pct", "rtt_min_us", "rtt_avg_us", "rtt_max_us", "rtt_mdev_us"):
+        con.execute(f"ALTER TABLE runtime ADD COLUMN {col} INTEGER;")
+    for _k, t in _partitions(con):
+        for col in ("rtt_us", "jitter_us", "loss_pct"):
+            con.execute(f"ALTER TABLE {t} ADD COLUMN {col} INTEGER;")
+    _rebuild_history_view(con)
+
+
+_RUNS_DDL = (
+    """CREATE TABLE runs (
+  id INTEGER PRIMARY KEY,
+  started INTEGER NOT NULL,
+  ended INTEGER,
+  duration_ms INTEGER,
+  trigger TEXT NOT NULL,
+  pid INTEGER,
+  total INTEGER, due INTEGER, skipped INTEGER, disabled INTEGER,
+  ping_ok INTEGER, ping_fail INTEGER, sent INTEGER, curl_fail INTEGER, deferred INTEGER
+);""",
+    "CREATE INDEX idx_runs_started ON runs(started);",
+    "CREATE INDEX idx_runs_pid ON runs(pid);",
+    """CREATE TABLE events (
+  id INTEGER PRIMARY KEY,
+  run_id INTEGER,
+  ts INTEGER NOT NULL,
+  target TEXT,
+  level TEXT NOT NULL,
+  message TEXT NOT NULL
+);""",
+    "CREATE INDEX idx_events_ts ON events(ts);",
+    "CREATE INDEX idx_events_target_ts ON events(target, ts);",
+    "CREATE INDEX idx_events_run ON events(run_id);",
+)
+
+_EVENTS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE events_fts USING fts5(message, content='events', content_rowid='id');",
+    """CREATE TRIGGER events_fts_ai AFTER INSERT ON events BEGIN
+  INSERT INTO events_fts(rowid, message) VALUES (new.id, new.message);
+END;""",
+    """CREATE TRIGGER events_fts_ad AFTER DELETE ON events BEGIN
+  INSERT INTO events_fts(events_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;""",
+)
+
+
+def _migrate_v10(con) -> None:
+    # v10: structured run records. `runs` has one row per runner invocation
+    # (trigger: timer | manual | test; ended and the counters stay NULL while
+    # it runs), `events` one row per probe result or runner message (level
+    # info | warn | error). The message text is indexed by events_fts (FTS5,
+    # external content) where SQLite has FTS5; event_rows() falls back to
+    # LIKE without it.
+    for stmt in _RUNS_DDL:
+        con.execute(stmt)
+    try:
+        con.execute("SAVEPOINT fts;")
+        for stmt in _EVENTS_FTS_DDL:
+            con.execute(stmt)
+        con.execute("RELEASE fts;")
+    except sqlite3.OperationalError as e:
+        con.execute("ROLLBACK TO fts;")
+        con.execute("RELEASE fts;")
+        print(f"WARN: events search without FTS5: {e}", file=sys.stderr)
+
+
+def _ip_num_sql(col: str = "ip") -> str:
+    # a.b.c.d -> a<<24 | b<<16 | c<<8 | d in SQL: CAST takes the leading
+    # integer of the text, substr/instr step past each dot
+    parts = [col]
+    for _ in range(3):
+        prev = parts[-1]
+        parts.append(f"substr({prev}, instr({prev}, '.') + 1)")
+    return " + ".join(f"(CAST({p} AS INTEGER) << {24 - 8 * i})" for i, p in enumerate(parts))
+
+
+def _migrate_v11(con) -> None:
+    # v11: numeric IP for ordering and CIDR search (target_state_page).
+    # A virtual generated column, so every writer of targets.ip (including
+    # plain sqlite3) keeps it right without code of its own.
+    con.execute(f"ALTER TABLE targets ADD COLUMN ip_num INTEGER GENERATED ALWAYS AS ({_ip_num_sql()}) VIRTUAL;")
+    con.execute("CREATE INDEX idx_targets_ip_num ON targets(ip_num);")
+    con.execute("CREATE INDEX idx_targets_name_nocase ON targets(name COLLATE NOCASE);")
+    con.execute("CREATE INDEX idx_targets_interval ON targets(interval);")
+
+
+# (version, script). Each step runs once, in order, inside its own
+# transaction, and bumps PRAGMA user_version. A callable step gets the
+# connection (for DDL that depends on the data).
+MIGRATIONS = [
+    # v1: per target/day rollup of history (uptime windows + snapshot grid),
+    # backfilled once from the raw rows already in history.
+    (1, """
+CREATE TABLE IF NOT EXISTS history_daily (
+  name TEXT NOT NULL,
+  day TEXT NOT NULL,                       -- local date, YYYY-MM-DD
+  ok_cnt INTEGER NOT NULL DEFAULT 0,       -- status='up'
+  hb_cnt INTEGER NOT NULL DEFAULT 0,       -- status='down' with rtt (heartbeat failed)
+  down_cnt INTEGER NOT NULL DEFAULT 0,     -- status='down' without rtt (no ping)
+  rtt_sum INTEGER NOT NULL DEFAULT 0,
+  rtt_cnt INTEGER NOT NULL DEFAULT 0,
+  rtt_min INTEGER,
+  rtt_max INTEGER,
+  worst_down_s INTEGER NOT NULL DEFAULT 0, -- longest down streak that day
+  streak_start INTEGER NOT NULL DEFAULT 0, -- ts of the open down streak (0 = none)
+  last_ts INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (name, day)
+) WITHOUT ROWID;
+
+DELETE FROM history_daily;
+INSERT INTO history_daily(name, day, ok_cnt, hb_cnt, down_cnt, rtt_sum, rtt_cnt,
+                          rtt_min, rtt_max, worst_down_s, streak_start, last_ts)
+WITH h AS (
+  SELECT name, ts, status, rtt_ms, date(ts, 'unixepoch', 'localtime') AS day
+  FROM history
+), g AS (
+  SELECT name, day, ts, status,
+         SUM(status <> 'down') OVER (PARTITION BY name, day ORDER BY ts ROWS UNBOUNDED PRECEDING) AS grp
+  FROM h
+), s AS (
+  SELECT name, day, grp,
+         MIN(CASE WHEN status = 'down' THEN ts END) AS dmin,
+         MAX(CASE WHEN status = 'down' THEN ts END) AS dmax,
+         MAX(ts) AS gmax
+  FROM g GROUP BY name, day, grp
+), st AS (
+  SELECT name, day,
+         MAX(COALESCE(dmax - dmin, 0)) AS worst,
+         MAX(CASE WHEN grp = maxgrp AND dmax = gmax THEN dmin ELSE 0 END) AS open_start
+  FROM (SELECT s.*, MAX(grp) OVER (PARTITION BY name, day) AS maxgrp FROM s)
+  GROUP BY name, day
+), a AS (
+  SELECT name, day,
+         SUM(status = 'up') AS ok_cnt,
+         SUM(status = 'down' AND rtt_ms >= 0) AS hb_cnt,
+         SUM(status = 'down' AND rtt_ms < 0) AS down_cnt,
+         SUM(CASE WHEN status IN ('up','down') AND rtt_ms >= 0 THEN rtt_ms ELSE 0 END) AS rtt_sum,
+         SUM(status IN ('up','down') AND rtt_ms >= 0) AS rtt_cnt,
+         MIN(CASE WHEN status IN ('up','down') AND rtt_ms >= 0 THEN rtt_ms END) AS rtt_min,
+         MAX(CASE WHEN status IN ('up','down') AND rtt_ms >= 0 THEN rtt_ms END) AS rtt_max,
+         MAX(ts) AS last_ts
+  FROM h GROUP BY name, day
+)
+SELECT a.name, a.day, a.ok_cnt, a.hb_cnt, a.down_cnt, a.rtt_sum, a.rtt_cnt,
+       a.rtt_min, a.rtt_max, st.worst, st.open_start, a.last_ts
+FROM a JOIN st ON st.name = a.name AND st.day = a.day;
+"""),
+    # v2: state revision counter for WebUI /state deltas. Every targets or
+    # runtime write bumps state_seq.rev and stamps the row's name in
+    # state_rev; removed/renamed names are kept in state_removed.
+    (2, """
+CREATE TABLE IF NOT EXISTS state_seq (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  rev INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO state_seq(id, rev) VALUES (1, 0);
+
+CREATE TABLE IF NOT EXISTS state_rev (
+  name TEXT PRIMARY KEY,
+  rev INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_state_rev_rev ON state_rev(rev);
+
+CREATE TABLE IF NOT EXISTS state_removed (
+  name TEXT PRIMARY KEY,
+  rev INTEGER NOT NULL
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO state_rev(name, rev) SELECT name, 0 FROM targets;
+
+CREATE TRIGGER IF NOT EXISTS trg_targets_rev_ins AFTER INSERT ON targets BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  INSERT INTO state_rev(name, rev) SELECT NEW.name, rev FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+  DELETE FROM state_removed WHERE name = NEW.name;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_targets_rev_upd AFTER UPDATE ON targets BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  INSERT INTO state_rev(name, rev) SELECT NEW.name, rev FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+  DELETE FROM state_removed WHERE name = NEW.name;
+  DELETE FROM state_rev WHERE name = OLD.name AND OLD.name <> NEW.name;
+  INSERT INTO state_removed(name, rev) SELECT OLD.name, rev FROM state_seq WHERE id = 1 AND OLD.name <> NEW.name
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_targets_rev_del AFTER DELETE ON targets BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  DELETE FROM state_rev WHERE name = OLD.name;
+  INSERT INTO state_removed(name, rev) SELECT OLD.name, rev FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_runtime_rev_ins AFTER INSERT ON runtime BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  INSERT INTO state_rev(name, rev) SELECT NEW.name, rev FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_runtime_rev_upd AFTER UPDATE ON runtime BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  INSERT INTO state_rev(name, rev) SELECT NEW.name, rev FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+END;
+"""),
+    # v3: tombstones carry their removal time so the runner can prune them;
+    # state_seq.floor is the newest pruned rev (older `since` => full /state).
+    (3, """
+ALTER TABLE state_removed ADD COLUMN ts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE state_seq ADD COLUMN floor INTEGER NOT NULL DEFAULT 0;
+UPDATE state_removed SET ts = CAST(strftime('%s','now') AS INTEGER);
+
+DROP TRIGGER IF EXISTS trg_targets_rev_upd;
+CREATE TRIGGER trg_targets_rev_upd AFTER UPDATE ON targets BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  INSERT INTO state_rev(name, rev) SELECT NEW.name, rev FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev;
+  DELETE FROM state_removed WHERE name = NEW.name;
+  DELETE FROM state_rev WHERE name = OLD.name AND OLD.name <> NEW.name;
+  INSERT INTO state_removed(name, rev, ts)
+    SELECT OLD.name, rev, CAST(strftime('%s','now') AS INTEGER) FROM state_seq WHERE id = 1 AND OLD.name <> NEW.name
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev, ts = excluded.ts;
+END;
+
+DROP TRIGGER IF EXISTS trg_targets_rev_del;
+CREATE TRIGGER trg_targets_rev_del AFTER DELETE ON targets BEGIN
+  UPDATE state_seq SET rev = rev + 1 WHERE id = 1;
+  DELETE FROM state_rev WHERE name = OLD.name;
+  INSERT INTO state_removed(name, rev, ts)
+    SELECT OLD.name, rev, CAST(strftime('%s','now') AS INTEGER) FROM state_seq WHERE id = 1
+    ON CONFLICT(name) DO UPDATE SET rev = excluded.rev, ts = excluded.ts;
+END;
+"""),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    # v6: runner counters for /metrics. `metrics` holds run-level counters
+    # and the run duration histogram (run_duration_b<i>); probe_hist one
+    # per-target histogram per kind ('rtt' = ping RTT, 'http' = heartbeat
+    # request time) with non-cumulative buckets b0..b10 (b10 = +Inf).
+    (6, """
+CREATE TABLE metrics (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE probe_hist (
+  name TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  b0 INTEGER NOT NULL DEFAULT 0, b1 INTEGER NOT NULL DEFAULT 0, b2 INTEGER NOT NULL DEFAULT 0,
+  b3 INTEGER NOT NULL DEFAULT 0, b4 INTEGER NOT NULL DEFAULT 0, b5 INTEGER NOT NULL DEFAULT 0,
+  b6 INTEGER NOT NULL DEFAULT 0, b7 INTEGER NOT NULL DEFAULT 0, b8 INTEGER NOT NULL DEFAULT 0,
+  b9 INTEGER NOT NULL DEFAULT 0, b10 INTEGER NOT NULL DEFAULT 0,
+  sum_ms INTEGER NOT NULL DEFAULT 0,
+  count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (name, kind)
+) WITHOUT ROWID;
+"""),
+    (7, _migrate_v7),
+    (8, _migrate_v8),
+    # v9: heartbeat dispatcher (heartbeat.py). hb_outbox keeps the latest
+    # undelivered heartbeat per target until it is delivered, superseded or
+    # expires (one interval after it was due); receiver_hist the send time
+    # histogram per receiver (scheme://host[:port], buckets as probe_hist).
+    (9, """
+CREATE TABLE hb_outbox (
+  name TEXT PRIMARY KEY,
+  url TEXT NOT NULL,
+  ts INTEGER NOT NULL,                     -- when the heartbeat was due
+  expires INTEGER NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_try INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE receiver_hist (
+  receiver TEXT PRIMARY KEY,
+  b0 INTEGER NOT NULL DEFAULT 0, b1 INTEGER NOT NULL DEFAULT 0, b2 INTEGER NOT NULL DEFAULT 0,
+  b3 INTEGER NOT NULL DEFAULT 0, b4 INTEGER NOT NULL DEFAULT 0, b5 INTEGER NOT NULL DEFAULT 0,
+  b6 INTEGER NOT NULL DEFAULT 0, b7 INTEGER NOT NULL DEFAULT 0, b8 INTEGER NOT NULL DEFAULT 0,
+  b9 INTEGER NOT NULL DEFAULT 0, b10 INTEGER NOT NULL DEFAULT 0,
+  sum_ms INTEGER NOT NULL DEFAULT 0,
+  count INTEGER NOT NULL DEFAULT 0,
+  errors INTEGER NOT NULL DEFAULT 0,       -- no response (connect error/timeout)
+  queued INTEGER NOT NULL DEFAULT 0        -- heartbeats put in the outbox
+) WITHOUT ROWID;
+"""),
+    (10, _migrate_v10),
+    (11, _migrate_v11),
+]
+assert MIGRATIONS[-1][0] == SCHEMA_VERSION
+
+
+def connect(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    """Read/write connection; transactions are explicit (see `transaction`)."""
+    con = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+    return con
+
+
+@contextmanager
+def transaction(con: sqlite3.Connection):
+    """BEGIN IMMEDIATE ... COMMIT; rolled back on any exception."""
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        yield con
+    except BaseException:
+        con.execute("ROLLBACK;")
+        raise
+    con.execute("COMMIT;")
+
+
+def migrate(con: sqlite3.Connection) -> int:
+    """Apply pending migrations; returns the resulting user_version."""
+    v = int(con.execute("PRAGMA user_version;").fetchone()[0])
+    for version, script in MIGRATIONS:
+        if version <= v:
+            continue
+        try:
+            if callable(script):
+                con.execute("BEGIN IMMEDIATE;")
+                script(con)
+                con.execute(f"PRAGMA user_version={version};")
+                con.execute("COMMIT;")
+            else:
+                con.executescript(f"BEGIN IMMEDIATE;\n{script}\nPRAGMA user_version={version};\nCOMMIT;")
+        except sqlite3.Error as e:
+            if con.in_transaction:
+                con.execute("ROLLBACK;")
+            raise DataError(f"DB migration to v{version} failed: {e}")
+        v = version
+    return v
+
+
+def init_db(db_path: Path = DB_PATH) -> None:
+    """Create state.db (WAL) with the base tables, then migrate it."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    con = connect(db_path)
+    try:
+        # must precede the first table; older DBs are switched by `retention`
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.executescript(SCHEMA)
+        migrate(con)
+    finally:
+        con.close()
+
+
+def open_db(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    """Connection to an existing, current DB (created/migrated on demand)."""
+    if not db_path.exists():
+        init_db(db_path)
+    con = connect(db_path)
+    if int(con.execute("PRAGMA user_version;").fetchone()[0]) < SCHEMA_VERSION:
+        migrate(con)
+    return con
+
+
+def notify_scheduler(state_dir: Path = STATE_DIR) -> None:
+    """Ask a running `interheart daemon` to reload targets (no-op without one)."""
+    try:
+        pid = int((state_dir / SCHED_PID_FILE_NAME).read_text().strip())
+        cmdline = Path(f"/proc/{pid}/cmdline").read_bytes().replace(b"\0", b" ").decode(errors="replace")
+    except (OSError, ValueError):
+        return
+    # guard against a stale pid file pointing at an unrelated process
+    if "interheart" in cmdline and "daemon" in cmdline:
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except OSError:
+            pass
+
+
+def _used_bytes(con) -> int:
+    page_size = con.execute("PRAGMA page_size;").fetchone()[0]
+    pages = con.execute("PRAGMA page_count;").fetchone()[0] - con.execute("PRAGMA freelist_count;").fetchone()[0]
+    return pages * page_size
+
+
+def retention(con, now=None, days=None, max_mb=None) -> dict:
+    """Expire history and /state tombstones; returns a summary dict.
+
+    - makes sure this week's and next week's partitions exist (the runner
+      inserts into them directly)
+    - drops partitions that end before now - `days`, then, with `max_mb`
+      set, the oldest remaining ones (never the current week) while the
+      DB holds more than max_mb of live pages
+    - trims history_daily, runs and events to `days` and drops tombstones older than
+      STATE_TOMBSTONE_SEC (clients holding an older rev get a full /state)
+    - hands the freed pages back to the filesystem (incremental vacuum)
+    """
+    now = int(now if now is not None else time.time())
+    days = HISTORY_DAYS if days is None else int(days)
+    max_mb = DB_MAX_MB if max_mb is None else int(max_mb)
+    cutoff = now - days * 86400
+    current = now // PARTITION_SECONDS
+    dropped = []
+    with transaction(con):
+        changed = _ensure_partition(con, now)
+        changed = _ensure_partition(con, now + PARTITION_SECONDS) or changed
+        parts = _partitions(con)
+        for k, table in parts:
+            if (k + 1) * PARTITION_SECONDS <= cutoff:
+                con.execute(f"DROP TABLE {table};")
+                dropped.append(table)
+        if max_mb > 0:
+            for k, table in parts:
+                if table in dropped:
+                    continue
+                if k >= current or _used_bytes(con) <= max_mb * 1024 * 1024:
+                    break
+                con.execute(f"DROP TABLE {table};")
+                dropped.append(table)
+                # the rollups of dropped weeks go with them
+                cutoff = max(cutoff, (k + 1) * PARTITION_SECONDS)
+        if changed or dropped:
+            _rebuild_history_view(con)
+        con.execute("DELETE FROM history_daily WHERE day < date(?, 'unixepoch', 'localtime');", (cutoff,))
+        con.execute("DELETE FROM events WHERE ts < ?;", (cutoff,))
+        con.execute("DELETE FROM runs WHERE started < ?;", (cutoff,))
+        con.execute(
+            "UPDATE state_seq SET floor = MAX(floor, COALESCE((SELECT MAX(rev) FROM state_removed WHERE ts < ?), 0)) "
+            "WHERE id = 1;",
+            (now - STATE_TOMBSTONE_SEC,),
+        )
+        con.execute("DELETE FROM state_removed WHERE ts < ?;", (now - STATE_TOMBSTONE_SEC,))
+
+    freed = con.execute("PRAGMA freelist_count;").fetchone()[0]
+    if con.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+        # one-off switch for DBs created before auto_vacuum=INCREMENTAL;
+        # VACUUM needs a moment without writers, so retry next time if busy
+        try:
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            con.execute("VACUUM;")
+        except sqlite3.OperationalError as e:
+            print(f"WARN: retention: auto_vacuum switch postponed: {e}", file=sys.stderr)
+    else:
+        # executescript steps the pragma to completion (execute() frees one page)
+        con.executescript("PRAGMA incremental_vacuum;")
+    return {
+        "dropped": dropped,
+        "partitions": len(_partitions(con)),
+        "freed_pages": freed,
+        "db_bytes": _used_bytes(con),
+    }
+
+
+# ---- Reads ----
+def get_target(con, name: str):
+    """targets row for `name` or None."""
+    return con.execute(
+        "SELECT name, ip, endpoint, interval, enabled FROM targets WHERE name=? LIMIT 1;", (name,)
+    ).fetchone()
+
+
+def list_targets(con):
+    return con.execute(
+        "SELECT name, ip, interval, enabled, endpoint FROM targets ORDER BY name COLLATE NOCASE;"
+    ).fetchall()
+
+
+def status_rows(con):
+    return con.execute(
+        """
+        SELECT t.name,
+               CASE WHEN t.enabled=0 THEN 'disabled' ELSE COALESCE(r.status,'unknown') END AS status,
+               COALESCE(r.next_due,0) AS next_due,
+               COALESCE(r.last_ping,0) AS last_ping,
+               COALESCE(r.last_sent,0) AS last_sent,
+               COALESCE(r.last_rtt_ms,-1) AS last_rtt_ms
+        FROM targets t
+        LEFT JOIN runtime r ON r.name=t.name
+        ORDER BY t.name COLLATE NOCASE;
+        """
+    ).fetchall()
+
+
+def target_state_rows(con, since=None, name=None):
+    """targets joined with runtime, as used by the WebUI table and info modal.
+
+    since: only targets whose state_rev is newer (see /state deltas).
+    name: a single target.
+    """
+    where, params = [], []
+    if since is not None:
+        where.append("t.name IN (SELECT name FROM state_rev WHERE rev > ?)")
+        params.append(int(since))
+    if name is not None:
+        where.append("t.name = ?")
+        params.append(name)
+    return con.execute(
+        f"""
+        SELECT
+          t.name,
+          t.ip,
+          t.endpoint,
+          t.interval,
+          t.enabled,
+          COALESCE(r.status, 'unknown') AS last_status,
+          COALESCE(r.last_ping, 0) AS last_ping,
+          COALESCE(r.last_sent, 0) AS last_response,
+          COALESCE(r.last_rtt_ms, -1) AS last_latency,
+          r.loss_pct,
+          r.rtt_min_us,
+          r.rtt_avg_us,
+          r.rtt_max_us,
+          r.rtt_mdev_us
+        FROM targets t
+        LEFT JOIN runtime r ON r.name = t.name
+        {("WHERE " + " AND ".join(where)) if where else ""}
+        ORDER BY t.ip_num, t.name;
+        """,
+        params,
+    ).fetchall()
+
+
+# UI status of a target: disabled (enabled=0), starting (enabled, no up/down
+# result yet) or its runtime status. ui_status applies it to a row,
+# _UI_STATUS_SQL inside target_state_page queries.
+UI_STATUSES = ("up", "down", "starting", "disabled")
+_STARTING_STATUSES = ("unknown", "", "disabled")
+_UI_STATUS_SQL = (
+    "CASE WHEN t.enabled <> 1 THEN 'disabled' "
+    f"WHEN lower(COALESCE(r.status, 'unknown')) IN ({', '.join(repr(s) for s in _STARTING_STATUSES)}) "
+    "THEN 'starting' ELSE r.status END"
+)
+
+
+def ui_status(enabled, status) -> str:
+    """UI status for a target's enabled flag and runtime status (see above)."""
+    if int(enabled or 0) != 1:
+        return "disabled"
+    status = str(status or "unknown")
+    return "starting" if status.lower() in _STARTING_STATUSES else status
+PAGE_SORT_KEYS = {
+    "name": "t.name COLLATE NOCASE",
+    "ip": "t.ip_num",
+    "status": _UI_STATUS_SQL,
+    "interval": "t.interval",
+    "last_ping": "COALESCE(r.last_ping, 0)",
+    "last_resp": "COALESCE(r.last_sent, 0)",
+}
+
+
+def parse_ip_range(q: str):
+    """(first, last) numeric addresses for an IPv4 CIDR or address, else None."""
+    try:
+        net = ipaddress.IPv4Network(q.strip(), strict=False)
+    except ValueError:
+        return None
+    return int(net.network_address), int(net.broadcast_address)
+
+
+def target_state_page(con, statuses=(), q: str = "", sort: str = "ip", desc: bool = False,
+                      limit=None, offset: int = 0):
+    """(total, rows): one sorted page of target_state_rows, filtered in SQL.
+
+    statuses: UI statuses to keep (UI_STATUSES); q: an IPv4 address or CIDR
+    (ip_num range, indexed) or else a substring of name, IP or status;
+    sort: a PAGE_SORT_KEYS key, ties broken by name. total counts every
+    match, not just the page.
+    """
+    where, params = [], []
+    if statuses:
+        where.append(f"{_UI_STATUS_SQL} IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    q = (q or "").strip()
+    if q:
+        rng = parse_ip_range(q) if re.match(r"^[\d.]+(/\d{1,2})?$", q) and q.count(".") == 3 else None
+        if rng:
+            where.append("t.ip_num BETWEEN ? AND ?")
+            params.extend(rng)
+        else:
+            like = "%" + re.sub(r"([%_\\])", r"\\\1", q) + "%"
+            where.append(f"(t.name LIKE ? ESCAPE '\\' OR t.ip LIKE ? ESCAPE '\\' OR {_UI_STATUS_SQL} LIKE ?)")
+            params.extend([like, like, like])
+    order = PAGE_SORT_KEYS[sort] + (" DESC" if desc else "")
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    total = con.execute(
+        f"SELECT count(*) FROM targets t LEFT JOIN runtime r ON r.name = t.name {where_sql};", params
+    ).fetchone()[0]
+    page = ""
+    if limit is not None:
+        page = "LIMIT ? OFFSET ?"
+        params = params + [int(limit), int(offset)]
+    rows = con.execute(
+        f"""
+        SELECT
+          t.name,
+          t.ip,
+          t.endpoint,
+          t.interval,
+          t.enabled,
+          COALESCE(r.status, 'unknown') AS last_status,
+          COALESCE(r.last_ping, 0) AS last_ping,
+          COALESCE(r.last_sent, 0) AS last_response,
+          COALESCE(r.last_rtt_ms, -1) AS last_latency,
+          r.loss_pct,
+          r.rtt_min_us,
+          r.rtt_avg_us,
+          r.rtt_max_us,
+          r.rtt_mdev_us
+        FROM targets t
+        LEFT JOIN runtime r ON r.name = t.name
+        {where_sql}
+        ORDER BY {order}, t.name {"DESC" if desc else ""}
+        {page};
+        """,
+        params,
+    ).fetchall()
+    return int(total), rows
+
+
+def metric_rows(con):
+    """(key, value) runner counters; see migration v6."""
+    return con.execute("SELECT key, value FROM metrics ORDER BY key;").fetchall()
+
+
+def probe_hist_rows(con):
+    """Per-target probe histograms of current targets, by name and kind."""
+    return con.execute(
+        "SELECT * FROM probe_hist WHERE name IN (SELECT name FROM targets) ORDER BY name, kind;"
+    ).fetchall()
+
+
+def receiver_hist_rows(con):
+    """Per-receiver heartbeat send time histograms; see migration v9."""
+    return con.execute("SELECT * FROM receiver_hist ORDER BY receiver;").fetchall()
+
+
+def outbox_size(con) -> int:
+    return int(con.execute("SELECT count(*) FROM hb_outbox;").fetchone()[0])
+
+
+# ---- Runs and events (migration v10) ----
+RUN_COUNTERS = ("total", "due", "skipped", "disabled", "ping_ok", "ping_fail", "sent", "curl_fail", "deferred")
+EVENT_LEVELS = ("info", "warn", "error")
+
+
+def run_rows(con, limit: int = 50, before=None, trigger=None) -> list:
+    """Newest runs first; `before` (a run id) pages back."""
+    where, params = [], []
+    if before is not None:
+        where.append("id < ?")
+        params.append(int(before))
+    if trigger:
+        where.append("trigger = ?")
+        params.append(trigger)
+    sql = "SELECT * FROM runs" + (f" WHERE {' AND '.join(where)}" if where else "")
+    return con.execute(sql + " ORDER BY id DESC LIMIT ?;", params + [int(limit)]).fetchall()
+
+
+def run_progress(con, pid: int, started: int):
+    """(runs row, events so far) of the run started by `pid` at or after
+    `started` (epoch s), or (None, 0) before it has registered."""
+    row = con.execute(
+        "SELECT * FROM runs WHERE pid=? AND started>=? ORDER BY id DESC LIMIT 1;", (int(pid), int(started))
+    ).fetchone()
+    if row is None:
+        return None, 0
+    done = con.execute(
+        "SELECT count(*) FROM events WHERE run_id=? AND target IS NOT NULL;", (row["id"],)
+    ).fetchone()[0]
+    return row, int(done)
+
+
+def _fts_query(q: str) -> str:
+    # every word as a quoted prefix term: user input never reaches the FTS5
+    # query syntax
+    return " ".join('"{}"*'.format(w.replace('"', '""')) for w in q.split())
+
+
+def event_rows(con, target=None, level=None, since=None, until=None, q=None, run_id=None,
+               limit: int = 200, before=None) -> list:
+    """Newest matching events first; `before` (an event id) pages back.
+
+    `q` matches words (prefixes) of the message through events_fts, or a
+    substring when this DB has no FTS5 index.
+    """
+    where, params = [], []
+    for clause, value in (
+        ("e.target = ?", target),
+        ("e.level = ?", level),
+        ("e.ts >= ?", since),
+        ("e.ts < ?", until),
+        ("e.run_id = ?", run_id),
+        ("e.id < ?", before),
+    ):
+        if value is not None and value != "":
+            where.append(clause)
+            params.append(value)
+    src = "events e"
+    if q and q.strip():
+        fts = con.execute("SELECT 1 FROM sqlite_master WHERE name='events_fts';").fetchone()
+        if fts:
+            src += " JOIN events_fts f ON f.rowid = e.id"
+            where.append("events_fts MATCH ?")
+            params.append(_fts_query(q))
+        else:
+            where.append("e.message LIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r"([%_\\])", r"\\\1", q.strip()) + "%")
+    sql = f"SELECT e.* FROM {src}" + (f" WHERE {' AND '.join(where)}" if where else "")
+    return con.execute(sql + " ORDER BY e.id DESC LIMIT ?;", params + [int(limit)]).fetchall()
+
+
+# ---- Heartbeat outbox (heartbeat.py) ----
+def outbox_retry_delay(attempts: int) -> int:
+    return min(OUTBOX_MAX_BACKOFF_SEC, 15 * 2 ** max(0, attempts - 1))
+
+
+def outbox_due(con, now: int, limit: int = 500) -> list:
+    """Drop expired heartbeats; (name, url, ts, expires, attempts) due for a retry, oldest first."""
+    with transaction(con):
+        con.execute("DELETE FROM hb_outbox WHERE expires <= ?;", (now,))
+    return con.execute(
+        "SELECT name, url, ts, expires, attempts FROM hb_outbox WHERE next_try <= ? ORDER BY ts LIMIT ?;",
+        (now, limit),
+    ).fetchall()
+
+
+def outbox_commit(con, now: int, settled, failed, receivers) -> None:
+    """Record one dispatcher run in one transaction.
+
+    settled: names whose heartbeat (new or retried) got an answer other
+    than a 5xx, which supersedes anything queued for them; failed: (name, url, ts,
+    expires, attempts) to (re)queue; receivers: {receiver: {"ms": [..],
+    "errors": n, "queued": n}}.
+    """
+    with transaction(con):
+        con.executemany("DELETE FROM hb_outbox WHERE name=?;", [(n,) for n in settled])
+        con.executemany(
+            "INSERT INTO hb_outbox(name, url, ts, expires, attempts, next_try) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET url=excluded.url, ts=excluded.ts, expires=excluded.expires, "
+            "attempts=excluded.attempts, next_try=excluded.next_try;",
+            [(n, u, ts, exp, att, now + outbox_retry_delay(att)) for n, u, ts, exp, att in failed],
+        )
+        for receiver, st in receivers.items():
+            buckets = [0] * (len(PROBE_BUCKETS_MS) + 1)
+            for ms in st["ms"]:
+                buckets[bisect.bisect_left(PROBE_BUCKETS_MS, ms)] += 1
+            con.execute(
+                "INSERT INTO receiver_hist(receiver) VALUES (?) ON CONFLICT(receiver) DO NOTHING;", (receiver,)
+            )
+            sets = ", ".join(f"b{i}=b{i}+{c}" for i, c in enumerate(buckets) if c)
+            con.execute(
+                f"UPDATE receiver_hist SET {sets + ', ' if sets else ''}sum_ms=sum_ms+?, count=count+?, "
+                "errors=errors+?, queued=queued+? WHERE receiver=?;",
+                (sum(st["ms"]), len(st["ms"]), st["errors"], st["queued"], receiver),
+            )
+
+
+# ---- Writes ----
+# Single-target writes raise DataError; batch writes return per-name results
+# ({name: "ok" | reason}) and commit every valid name in one transaction.
+def add_target(con, name: str, ip: str, endpoint: str, interval) -> None:
+    if not validate_name(name):
+        raise DataError("Invalid name (allowed: a-zA-Z0-9._-)")
+    if not validate_ip(ip):
+        raise DataError("Invalid IP")
+    if not validate_endpoint(endpoint):
+        raise DataError("Endpoint must start with http:// or https://")
+    if not validate_interval(interval):
+        raise DataError(f"Interval must be {INTERVAL_MIN}-{INTERVAL_MAX} seconds")
+    now = int(time.time())
+    with transaction(con):
+        if get_target(con, name):
+            raise DataError(f"Target already exists: {name}")
+        con.execute(
+            "INSERT INTO targets(name,ip,endpoint,interval,enabled,created_at,updated_at) VALUES(?,?,?,?,1,?,?);",
+            (name, ip, endpoint, int(interval), now, now),
+        )
+        # create runtime baseline
+        con.execute(
+            "INSERT OR REPLACE INTO runtime(name,status,next_due,last_ping,last_sent,last_rtt_ms) "
+            "VALUES(?,'unknown',0,0,0,-1);",
+            (name,),
+        )
+        _schedule_first(con, [name], rebalance_phases(con), now)
+
+
+def set_interval(con, name: str, interval) -> None:
+    if not validate_name(name):
+        raise DataError("Invalid name")
+    if not validate_interval(interval):
+        raise DataError(f"Interval must be {INTERVAL_MIN}-{INTERVAL_MAX} seconds")
+    now = int(time.time())
+    with transaction(con):
+        cur = con.execute("UPDATE targets SET interval=?, updated_at=? WHERE name=?;", (int(interval), now, name))
+        if cur.rowcount == 0:
+            raise DataError(f"Not found: {name}")
+        _schedule_first(con, [name], rebalance_phases(con), now)
+
+
+def edit_target(con, old_name: str, new_name: str, ip: str, endpoint: str, interval, enabled) -> None:
+    if not validate_name(old_name):
+        raise DataError("Invalid old_name")
+    if not validate_name(new_name):
+        raise DataError("Invalid new_name")
+    if not validate_ip(ip):
+        raise DataError("Invalid IP")
+    if not validate_endpoint(endpoint):
+        raise DataError("Endpoint must start with http:// or https://")
+    if not validate_interval(interval):
+        raise DataError(f"Interval must be {INTERVAL_MIN}-{INTERVAL_MAX} seconds")
+    if str(enabled) not in ("0", "1"):
+        raise DataError("enabled must be 0 or 1")
+    enabled = int(enabled)
+    now = int(time.time())
+    with transaction(con):
+        old = get_target(con, old_name)
+        if not old:
+            raise DataError(f"Not found: {old_name}")
+        # if renaming, ensure new doesn't exist
+        if old_name != new_name and get_target(con, new_name):
+            raise DataError(f"Target exists: {new_name}")
+        con.execute(
+            "UPDATE targets SET name=?, ip=?, endpoint=?, interval=?, enabled=?, updated_at=? WHERE name=?;",
+            (new_name, ip, endpoint, int(interval), enabled, now, old_name),
+        )
+        # runtime key rename if needed
+        if old_name != new_name:
+            con.execute("UPDATE runtime SET name=? WHERE name=?;", (new_name, old_name))
+            con.execute("DELETE FROM probe_hist WHERE name=?;", (new_name,))
+            con.execute("UPDATE probe_hist SET name=? WHERE name=?;", (new_name, old_name))
+        # a queued heartbeat belongs to the old endpoint/name
+        con.execute("DELETE FROM hb_outbox WHERE name=?;", (old_name,))
+        # reflect enabled state into runtime status (don't force "up")
+        con.execute(
+            "UPDATE runtime SET status=? WHERE name=?;", ("disabled" if enabled == 0 else "unknown", new_name)
+        )
+        phases = rebalance_phases(con)
+        if int(old["interval"]) != int(interval) or (enabled and not old["enabled"]):
+            _schedule_first(con, [new_name], phases, now)
+
+
+def _batch(con, names, apply) -> dict:
+    results, valid = {}, []
+    for n in names:
+        if n in results or n in valid:
+            continue
+        if validate_name(n):
+            valid.append(n)
+        else:
+            results[n] = "invalid name"
+    if valid:
+        with transaction(con):
+            marks = ",".join("?" * len(valid))
+            found = {r[0] for r in con.execute(f"SELECT name FROM targets WHERE name IN ({marks});", valid)}
+            hit = [n for n in valid if n in found]
+            if hit:
+                apply(hit, ",".join("?" * len(hit)))
+        for n in valid:
+            results[n] = "ok" if n in found else "not found"
+    return results
+
+
+def set_enabled(con, names, enabled: bool) -> dict:
+    now = int(time.time())
+
+    def apply(hit, marks):
+        if enabled:
+            woken = [r[0] for r in con.execute(f"SELECT name FROM targets WHERE name IN ({marks}) AND enabled<>1;", hit)]
+            con.execute(f"UPDATE targets SET enabled=1, updated_at=? WHERE name IN ({marks}) AND enabled<>1;", [now] + hit)
+            # runtime will be recalculated at next run; set unknown now
+            con.execute(f"UPDATE runtime SET status='unknown' WHERE name IN ({marks}) AND status='disabled';", hit)
+            # spread the first probes instead of probing all of them at once
+            _schedule_first(con, woken, rebalance_phases(con), now)
+        else:
+            con.execute(f"UPDATE targets SET enabled=0, updated_at=? WHERE name IN ({marks}) AND enabled<>0;", [now] + hit)
+            # keep status coherent
+            con.execute(f"UPDATE runtime SET status='disabled' WHERE name IN ({marks}) AND status<>'disabled';", hit)
+            rebalance_phases(con)
+
+    return _batch(con, names, apply)
+
+
+def remove_targets(con, names) -> dict:
+    def apply(hit, marks):
+        con.execute(f"DELETE FROM targets WHERE name IN ({marks});", hit)
+        con.execute(f"DELETE FROM runtime WHERE name IN ({marks});", hit)
+        con.execute(f"DELETE FROM probe_hist WHERE name IN ({marks});", hit)
+        con.execute(f"DELETE FROM hb_outbox WHERE name IN ({marks});", hit)
+        rebalance_phases(con)
+
+    return _batch(con, names, apply)
+
+
+# ---- CLI (called by interheart.sh) ----
+def _human_list(con):
+    print("Targets:")
+    print("-" * 80)
+    print("NAME                 IP               INTERVAL   ENABLED   ENDPOINT")
+    print("-" * 80)
+    for r in list_targets(con):
+        print(f"{r['name']:<20} {r['ip']:<16} {str(r['interval']):<9}s {str(r['enabled']):<8} {mask_endpoint(r['endpoint'])}")
+
+
+def _human_status(con):
+    now = int(time.time())
+    print("State:")
+    print("-" * 124)
+    print("NAME                 STATUS     NEXT_IN     NEXT_DUE     LAST_PING   LAST_RESP   LAT_MS")
+    print("-" * 124)
+    for r in status_rows(con):
+        next_due = int(r["next_due"] or 0)
+        next_in = max(0, next_due - now) if next_due > 0 else 0
+        print(f"{r['name']:<20} {r['status']:<10} {next_in!s:<10} {next_due!s:<10} "
+              f"{r['last_ping']!s:<10} {r['last_sent']!s:<10} {r['last_rtt_ms']!s:<6}")
+
+
+def _read_names(src: str) -> list:
+    raw = sys.stdin.read() if src == "-" else src
+    names = []
+    for t in raw.replace(",", "\n").splitlines():
+        t = t.strip()
+        if t and t not in names:
+            names.append(t)
+    if not names:
+        raise DataError("Empty --names list")
+    return names
+
+
+def _print_batch(results: dict, verb: str) -> int:
+    for n, res in results.items():
+        print(f"ok: {n}" if res == "ok" else f"error: {n}: {res}")
+    ok = sum(1 for v in results.values() if v == "ok")
+    print(f"OK: {verb} {ok}/{len(results)}")
+    return 0 if ok == len(results) else 1
+
+
+def main(argv) -> int:
+    db_path = DB_PATH
+    if len(argv) >= 2 and argv[0] == "--db":
+        db_path = Path(argv[1])
+        argv = argv[2:]
+    if not argv:
+        print("ERROR: Usage: datastore.py [--db PATH] <command> [args...]", file=sys.stderr)
+        return 2
+    cmd, args = argv[0], argv[1:]
+    state_dir = db_path.parent
+
+    def need(n, usage):
+        if len(args) < n:
+            raise DataError(f"Usage: interheart {usage}")
+
+    try:
+        if cmd in ("init-db", "migrate"):
+            if db_path.exists():
+                con = connect(db_path)
+                try:
+                    migrate(con)
+                finally:
+                    con.close()
+            else:
+                init_db(db_path)
+            if cmd == "init-db":
+                print(f"OK: DB ready at {db_path}")
+            return 0
+
+        con = open_db(db_path)
+        try:
+            if cmd == "add":
+                need(4, "add <name> <ip> <endpoint> <interval_seconds>")
+                add_target(con, *args[:4])
+                notify_scheduler(state_dir)
+                print(f"OK: Added {args[0]}")
+            elif cmd in ("enable", "disable", "remove"):
+                need(1, f"{cmd} <name> | --names <a,b,...|->")
+                if args[0] == "--names":
+                    names = _read_names(args[1] if len(args) > 1 else "")
+                else:
+                    names = [args[0]]
+                if cmd == "remove":
+                    results = remove_targets(con, names)
+                else:
+                    results = set_enabled(con, names, cmd == "enable")
+                if any(v == "ok" for v in results.values()):
+                    notify_scheduler(state_dir)
+                verb = {"enable": "Enabled", "disable": "Disabled", "remove": "Removed"}[cmd]
+                if args[0] == "--names":
+                    return _print_batch(results, verb)
+                res = results[names[0]]
+                if res != "ok":
+                    raise DataError("Invalid name" if res == "invalid name" else f"Not found: {names[0]}")
+                print(f"OK: {verb} {names[0]}")
+            elif cmd == "set-target-interval":
+                need(2, "set-target-interval <name> <interval_seconds>")
+                set_interval(con, args[0], args[1])
+                notify_scheduler(state_dir)
+                print(f"OK: Interval set for {args[0]} -> {args[1]}s")
+            elif cmd == "edit":
+                need(6, "edit <old_name> <new_name> <ip> <endpoint> <interval_seconds> <enabled 0|1>")
+                edit_target(con, *args[:6])
+                notify_scheduler(state_dir)
+                print(f"OK: Updated {args[0]} -> {args[1]}")
+            elif cmd == "get":
+                need(1, "get <name>")
+                if not validate_name(args[0]):
+                    raise DataError("Invalid name")
+                r = get_target(con, args[0])
+                if not r:
+                    raise DataError(f"Not found: {args[0]}")
+                # Output format required by WebUI: name|ip|endpoint|interval|enabled
+                print("|".join(str(r[k]) for k in ("name", "ip", "endpoint", "interval", "enabled")))
+            elif cmd == "list":
+                _human_list(con)
+            elif cmd == "status":
+                _human_status(con)
+            elif cmd == "retention":
+                r = retention(con)
+                # stderr: the runner calls this mid-run, stdout is its result output
+                print(f"retention: partitions={r['partitions']} dropped={len(r['dropped'])} "
+                      f"freed_pages={r['freed_pages']} db_mb={r['db_bytes'] / 1048576:.1f}", file=sys.stderr)
+            else:
+                raise DataError(f"Unknown command: {cmd}")
+        finally:
+            con.close()
+    except DataError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    except sqlite3.Error as e:
+        print(f"ERROR: Database error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
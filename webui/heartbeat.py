@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Heartbeat dispatcher for the interheart runner (stdlib only).
+
+Reads the ping records of webui/icmp.py on stdin, decides reachability and
+sends the heartbeat (HTTP GET of the target's endpoint) for reachable
+targets; prints one result record per target as it completes:
+
+    stdin:  name|ip|loss_pct|min_us|avg_us|max_us|mdev_us|interval|endpoint
+    stdout: name|interval|ping_ok|rtt_ms|http_code|http_ms|loss_pct|min_us|avg_us|max_us|mdev_us
+
+ping_ok=2: deferred by the run deadline; http_ms=-1: no request was made.
+
+Heartbeats to one receiver (scheme://host[:port]) share keep-alive
+connections and TLS sessions, with at most `per_host` requests in flight
+per receiver and `concurrency` overall. A receiver that fails to answer is
+not tried again in the same run: its remaining heartbeats, and any that got
+no response or a 5xx, go to the `hb_outbox` table and are retried by later
+runs (datastore.outbox_*). Send times per receiver go to `receiver_hist`.
+"""
+import argparse
+import collections
+import http.client
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+import datastore
+
+SEND_TIMEOUT = 5.0
+USER_AGENT = "interheart"
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection that resumes the receiver's last TLS session."""
+
+    def __init__(self, receiver, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.receiver = receiver
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host, session=self.receiver.session)
+
+
+class Receiver:
+    """One heartbeat receiver: pending jobs, idle keep-alive connections, stats."""
+
+    def __init__(self, scheme, host, port):
+        self.scheme, self.host, self.port = scheme, host, port
+        self.label = f"{scheme}://{host}" + (f":{port}" if port else "")
+        self.jobs = collections.deque()
+        self.idle = []
+        self.workers = 0
+        self.session = None
+        self.failed = False  # no response once this run: skip straight to the outbox
+        self.ms = []
+        self.errors = 0
+        self.queued = 0
+
+    def connection(self, ctx):
+        if self.idle:
+            return self.idle.pop()
+        if self.scheme == "https":
+            return _HTTPSConnection(self, self.host, self.port, timeout=SEND_TIMEOUT, context=ctx)
+        return http.client.HTTPConnection(self.host, self.port, timeout=SEND_TIMEOUT)
+
+
+class Job:
+    __slots__ = ("name", "url", "path", "ts", "expires", "attempts", "record")
+
+    def __init__(self, name, url, path, ts, expires, attempts=0, record=None):
+        self.name, self.url, self.path = name, url, path
+        self.ts, self.expires, self.attempts = ts, expires, attempts
+        self.record = record  # (interval, rtt_ms, stats) for new heartbeats, None for retries
+
+
+class Dispatcher:
+    def __init__(self, concurrency=32, per_host=4, deadline=0.0, out=sys.stdout):
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.deadline = deadline
+        self.out = out
+        self.ctx = ssl.create_default_context()
+        self.receivers = {}
+        self.workers = 0
+        self.threads = []
+        self.settled = set()  # names whose heartbeat got an answer other than 5xx
+        self.failed = {}
+        self._lock = threading.Lock()
+        self._out_lock = threading.Lock()
+
+    def emit(self, *fields):
+        with self._out_lock:
+            self.out.write("|".join(str(f) for f in fields) + "\n")
+            self.out.flush()
+
+    def submit(self, name, url, ts, expires, attempts=0, record=None) -> bool:
+        """Queue one heartbeat; False for a URL that cannot be sent."""
+        try:
+            u = urllib.parse.urlsplit(url)
+            port = u.port
+        except ValueError:
+            return False
+        if u.scheme not in ("http", "https") or not u.hostname:
+            return False
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        key = (u.scheme, u.hostname.lower(), port)
+        with self._lock:
+            rcv = self.receivers.get(key)
+            if rcv is None:
+                rcv = self.receivers[key] = Receiver(*key)
+            rcv.jobs.append(Job(name, url, path, ts, expires, attempts, record))
+            self._spawn()
+        return True
+
+    def _spawn(self):
+        # under self._lock: start workers for receivers with queued jobs
+        for rcv in self.receivers.values():
+            while rcv.jobs and rcv.workers < self.per_host and self.workers < self.concurrency:
+                rcv.workers += 1
+                self.workers += 1
+                t = threading.Thread(target=self._work, args=(rcv,), daemon=True)
+                self.threads.append(t)
+                t.start()
+
+    def _work(self, rcv):
+        conn = None
+        try:
+            while True:
+                with self._lock:
+                    if not rcv.jobs:
+                        rcv.workers -= 1
+                        self.workers -= 1
+                        if conn is not None:
+                            rcv.idle.append(conn)
+                            conn = None
+                        self._spawn()
+                        return
+                    job = rcv.jobs.popleft()
+                    if conn is None and not rcv.failed:
+                        conn = rcv.connection(self.ctx)
+                conn = self._handle(rcv, conn, job)
+        except BaseException:
+            with self._lock:
+                rcv.workers -= 1
+                self.workers -= 1
+                self._spawn()
+            raise
+
+    def _handle(self, rcv, conn, job):
+        left = self.deadline - time.time() if self.deadline else SEND_TIMEOUT
+        if left < 1.0:
+            # no time left to send: a new heartbeat is deferred (its target
+            # keeps its next_due), a retry stays in the outbox as it is
+            if job.record:
+                interval, _rtt_ms, stats = job.record
+                self.emit(job.name, interval, 2, -1, 0, -1, stats)
+            return conn
+        code, ms = 0, -1
+        attempted = not rcv.failed and conn is not None
+        if attempted:
+            code, ms, conn = self._request(rcv, conn, job.path, min(SEND_TIMEOUT, left))
+        with self._lock:
+            if code:
+                rcv.ms.append(ms)
+            elif attempted:
+                rcv.errors += 1
+                rcv.failed = True
+            if 0 < code < 500:
+                # delivered (or rejected with a 4xx, which a retry won't fix)
+                self.settled.add(job.name)
+                self.failed.pop(job.name, None)
+            elif job.name not in self.settled:
+                # no answer or a server error: retry later; a newer heartbeat
+                # for the same target replaces a queued one
+                prev = self.failed.get(job.name)
+                if prev is None or prev.ts <= job.ts:
+                    job.attempts += 1
+                    self.failed[job.name] = job
+                    rcv.queued += 1
+        if job.record:
+            interval, rtt_ms, stats = job.record
+            self.emit(job.name, interval, 1, rtt_ms, f"{code:03d}" if code == 0 else code, ms, stats)
+        return conn
+
+    def _request(self, rcv, conn, path, timeout):
+        """(http_code, ms, connection); code 0 = no response. Retries once on a
+        fresh connection when a reused keep-alive connection was closed."""
+        for attempt in (0, 1):
+            reused = conn.sock is not None
+            t0 = time.perf_counter()
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request("GET", path, headers={"User-Agent": USER_AGENT})
+                resp = conn.getresponse()
+                resp.read()
+                ms = round((time.perf_counter() - t0) * 1000)
+                if isinstance(conn.sock, ssl.SSLSocket):
+                    rcv.session = conn.sock.session
+                if resp.will_close:
+                    conn.close()
+                return resp.status, ms, conn
+            except (ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                return 0, -1, conn
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                return 0, -1, conn
+        return 0, -1, conn
+
+    def wait(self):
+        while True:
+            with self._lock:
+                if self.workers == 0 and not any(r.jobs for r in self.receivers.values()):
+                    return
+                threads = [t for t in self.threads if t.is_alive()]
+            for t in threads:
+                t.join()
+
+    def close(self):
+        for rcv in self.receivers.values():
+            for conn in rcv.idle:
+                conn.close()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", type=Path, default=datastore.DB_PATH)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--per-host", type=int, default=4, help="max requests in flight per receiver")
+    ap.add_argument("--max-loss", type=int, default=50, help="max ping loss (%%) to count as reachable")
+    ap.add_argument("--deadline-ms", type=int, default=0, help="epoch ms; 0 = none")
+    args = ap.parse_args(argv)
+
+    now = int(time.time())
+    d = Dispatcher(args.concurrency, args.per_host, args.deadline_ms / 1000)
+
+    # retries first, so a receiver that is still down is detected before
+    # this run's heartbeats queue up behind it
+    con = None
+    try:
+        con = datastore.connect(args.db)
+        for r in datastore.outbox_due(con, now):
+            d.submit(r["name"], r["url"], r["ts"], r["expires"], r["attempts"])
+    except Exception as e:
+        print(f"WARN: heartbeat outbox unavailable: {e}", file=sys.stderr)
+        if con is not None:
+            con.close()
+        con = None
+
+    for line in sys.stdin:
+        parts = line.rstrip("\n").split("|", 8)
+        if len(parts) < 9 or not parts[0]:
+            continue
+        name, _ip, loss, min_us, avg_us, max_us, mdev_us, interval, endpoint = parts
+        stats = "|".join((loss, min_us, avg_us, max_us, mdev_us))
+        try:
+            loss_i, avg_i, iv = int(loss), int(avg_us), int(interval)
+        except ValueError:
+            loss_i, avg_i, iv = 100, -1, 60
+        if loss_i < 0:
+            d.emit(name, interval, 2, -1, 0, -1, stats)
+        elif avg_i < 0 or loss_i > args.max_loss:
+            d.emit(name, interval, 0, -1, 0, -1, stats)
+        else:
+            ts = int(time.time())
+            rec = (interval, (avg_i + 500) // 1000, stats)
+            if not d.submit(name, endpoint, ts, ts + max(iv, 60), record=rec):
+                d.emit(name, interval, 1, rec[1], "000", -1, stats)
+    d.wait()
+    d.close()
+
+    if con is not None:
+        try:
+            stats = {r.label: {"ms": r.ms, "errors": r.errors, "queued": r.queued} for r in d.receivers.values()}
+            failed = [(j.name, j.url, j.ts, j.expires, j.attempts) for j in d.failed.values()]
+            datastore.outbox_commit(con, int(time.time()), d.settled, failed, stats)
+        except Exception as e:
+            print(f"WARN: heartbeat outbox not saved: {e}", file=sys.stderr)
+        finally:
+            con.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""ICMP echo prober for the interheart runner (stdlib only).
+
+`interheart run-now`/`test` pipe the due targets through this module: every
+target gets `count` echo requests from one socket, replies are matched by
+identifier/sequence and timed in-process (sub-millisecond), and one stats
+record per target is printed as soon as its last reply arrived or timed out:
+
+    stdin:  name|ip|rest...
+    stdout: name|ip|loss_pct|min_us|avg_us|max_us|mdev_us|rest...
+
+loss_pct is -1 when the deadline expired before the first echo was due
+(deferred); echoes that could not be sent (unreachable network, broadcast
+address, EPERM) count as lost. The RTT fields are -1 without replies. `rest` is passed through unchanged.
+
+Uses a raw socket when running as root, otherwise an unprivileged ICMP
+datagram socket (net.ipv4.ping_group_range); without either it falls back
+to one `ping` process per target.
+"""
+import argparse
+import errno
+import math
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PAYLOAD = b"interheart-probe"
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def open_socket():
+    """(socket, raw): raw ICMP socket as root, else an ICMP datagram socket."""
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    except PermissionError:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+
+
+def echo_request(ident: int, seq: int, payload: bytes = PAYLOAD) -> bytes:
+    header = struct.pack("!BBHHH", 8, 0, 0, ident, seq & 0xFFFF)
+    return struct.pack("!BBHHH", 8, 0, checksum(header + payload), ident, seq & 0xFFFF) + payload
+
+
+def parse_reply(data: bytes, raw: bool):
+    """(ident, seq) of an echo reply, None for anything else."""
+    if raw:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8 or data[0] != 0:
+        return None
+    return struct.unpack("!HH", data[4:8])
+
+
+def summarize(sent: int, rtts_ns: list) -> tuple:
+    """(loss_pct, min_us, avg_us, max_us, mdev_us) like iputils ping."""
+    if not sent:
+        return (-1, -1, -1, -1, -1)
+    loss = round((sent - len(rtts_ns)) * 100 / sent)
+    if not rtts_ns:
+        return (loss, -1, -1, -1, -1)
+    us = [r / 1000 for r in rtts_ns]
+    avg = sum(us) / len(us)
+    mdev = math.sqrt(max(0.0, sum(u * u for u in us) / len(us) - avg * avg))
+    return (loss, round(min(us)), round(avg), round(max(us)), round(mdev))
+
+
+class _Target:
+    __slots__ = ("key", "ip", "tried", "sent", "rtts", "last_tx", "done")
+
+    def __init__(self, key, ip):
+        self.key = key
+        self.ip = ip
+        self.tried = 0  # echoes due so far, including failed sends
+        self.sent = 0
+        self.rtts = []
+        self.last_tx = 0
+        self.done = False
+
+
+def probe(targets, count=3, spacing=0.2, timeout=1.0, rate=2000, deadline=0.0, on_result=None):
+    """Echo every (key, ip) in `targets` `count` times; returns {key: stats}.
+
+    Round r sends echo r to every target, at most `rate` packets/s and at
+    least `spacing` s after the previous round started. A target is final
+    when all its replies arrived or `timeout` s passed after its last echo;
+    `on_result(key, stats)` fires at that point. Targets not reached before
+    `deadline` (epoch seconds, 0 = none) report loss -1; echoes that failed
+    to send count as lost.
+    """
+    sock, raw = open_socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.setblocking(False)
+    ident = os.getpid() & 0xFFFF
+    tgts = [_Target(k, ip) for k, ip in targets]
+    inflight = {}  # seq -> (target, tx ns)
+    results = {}
+    order = [(r, t) for r in range(count) for t in tgts]
+    gap_ns = int(1e9 / max(1, rate))
+    spacing_ns = int(spacing * 1e9)
+    timeout_ns = int(timeout * 1e9)
+    qi = 0
+    next_tx = time.perf_counter_ns()
+    round_start = {}
+    seq = 0
+    pending = list(tgts)
+
+    def finish(t):
+        t.done = True
+        stats = summarize(t.tried, t.rtts)
+        results[t.key] = stats
+        if on_result:
+            on_result(t.key, stats)
+
+    try:
+        while pending:
+            now = time.perf_counter_ns()
+            # send what is due
+            while qi < len(order) and now >= next_tx:
+                r, t = order[qi]
+                if r > 0 and now < round_start.get(r - 1, now) + spacing_ns:
+                    break
+                if deadline and time.time() >= deadline:
+                    qi = len(order)
+                    break
+                qi += 1
+                round_start.setdefault(r, now)
+                if t.done:
+                    continue
+                seq = (seq + 1) & 0xFFFF
+                t.tried += 1
+                if _send(sock, echo_request(ident, seq), t.ip):
+                    inflight[seq] = (t, time.perf_counter_ns())
+                    t.sent += 1
+                    t.last_tx = now
+                next_tx = now + gap_ns
+            # collect replies
+            while True:
+                try:
+                    data, addr = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                rx = time.perf_counter_ns()
+                reply = parse_reply(data, raw)
+                if not reply:
+                    continue
+                rid, rseq = reply
+                # Raw sockets see every echo reply on the host: match our id.
+                # Datagram sockets get only their own (kernel rewrites the id).
+                if raw and rid != ident:
+                    continue
+                hit = inflight.get(rseq)
+                if not hit or hit[0].ip != addr[0]:
+                    continue
+                del inflight[rseq]
+                t, tx = hit
+                if t.done:
+                    continue
+                t.rtts.append(rx - tx)
+                if len(t.rtts) >= count:
+                    finish(t)
+            # expire targets whose last echo timed out
+            now = time.perf_counter_ns()
+            sending = qi < len(order)
+            still = []
+            for t in pending:
+                if t.done:
+                    continue
+                if t.sent == 0 and (not sending or t.tried >= count):
+                    # deadline before the first echo (loss -1) or no echo sent
+                    finish(t)
+                elif t.sent and now - t.last_tx >= timeout_ns and (not sending or t.tried >= count):
+                    finish(t)
+                else:
+                    still.append(t)
+            pending = still
+            if not pending:
+                break
+            wait_ns = 50_000_000
+            if sending:
+                wait_ns = min(wait_ns, max(0, next_tx - now))
+            select.select([sock], [], [], wait_ns / 1e9)
+    finally:
+        sock.close()
+    return results
+
+
+def _send(sock, pkt: bytes, ip: str) -> bool:
+    for _ in range(50):
+        try:
+            sock.sendto(pkt, (ip, 0))
+            return True
+        except (BlockingIOError, InterruptedError):
+            time.sleep(0.002)
+        except OSError as e:
+            # ENOBUFS under bursts: back off briefly; anything else
+            # (unreachable network, EPERM by firewall) counts as lost.
+            if e.errno == errno.ENOBUFS:
+                time.sleep(0.005)
+                continue
+            return False
+    return False
+
+
+_PING_RX_RE = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received")
+_PING_RTT_RE = re.compile(r"= ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+) ms")
+
+
+def ping_fallback(ip: str, count=3, spacing=0.2, timeout=1.0) -> tuple:
+    """Stats from the `ping` binary, for hosts without ICMP socket access."""
+    try:
+        p = subprocess.run(
+            ["ping", "-n", "-q", "-c", str(count), "-i", str(spacing), "-W", str(max(1, math.ceil(timeout))), ip],
+            capture_output=True, text=True, timeout=count * spacing + timeout + 5,
+        )
+    except Exception:
+        return summarize(count, [])
+    m = _PING_RX_RE.search(p.stdout)
+    if not m:
+        return summarize(count, [0] * count if p.returncode == 0 else [])
+    sent, recv = int(m.group(1)), int(m.group(2))
+    loss = round((sent - recv) * 100 / sent) if sent else 100
+    r = _PING_RTT_RE.search(p.stdout)
+    if not recv or not r:
+        return (loss, -1, -1, -1, -1) if not recv else (loss, 0, 0, 0, 0)
+    return (loss,) + tuple(round(float(v) * 1000) for v in r.groups())
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--count", type=int, default=3)
+    ap.add_argument("--spacing-ms", type=int, default=200)
+    ap.add_argument("--timeout-ms", type=int, default=1000)
+    ap.add_argument("--rate", type=int, default=2000, help="max echo requests per second")
+    ap.add_argument("--deadline-ms", type=int, default=0, help="epoch ms; 0 = none")
+    args = ap.parse_args(argv)
+    count = max(1, args.count)
+    spacing, timeout = args.spacing_ms / 1000, args.timeout_ms / 1000
+    deadline = args.deadline_ms / 1000
+
+    lines = {}
+    targets = []
+    for i, line in enumerate(sys.stdin):
+        line = line.rstrip("\n")
+        parts = line.split("|", 2)
+        if len(parts) < 2 or not parts[0]:
+            continue
+        lines[i] = parts
+        targets.append((i, parts[1]))
+
+    def emit(key, stats):
+        parts = lines[key]
+        rec = parts[:2] + [str(v) for v in stats] + parts[2:]
+        sys.stdout.write("|".join(rec) + "\n")
+        sys.stdout.flush()
+
+    try:
+        probe(targets, count, spacing, timeout, args.rate, deadline, emit)
+    except PermissionError:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            futs = {k: pool.submit(ping_fallback, ip, count, spacing, timeout) for k, ip in targets}
+            for k, fut in futs.items():
+                emit(k, fut.result())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""Precomputed /state snapshot (stdlib only).
+
+The target table the WebUI serves at /state is built here: runtime rows
+mapped to UI statuses, formatted timestamps, masked endpoints and the 3-day
+snapshot grid. After committing its results the runner writes the full
+payload once (`python3 statefile.py`, see interheart.sh) to state.json next
+to state.db, atomically, plus a gzip copy with the same mtime:
+
+    {"format":1,"rev":<state_seq.rev>,"day":"YYYY-MM-DD","updated":<epoch>,"ok":true,"targets":[...]}
+
+The header fields come first, so a reader can tell which revision a file
+holds from its first bytes (read_header). The WebUI sends the file as is
+while `rev` matches the DB and `day` is today; otherwise it reads the DB
+and rewrites the file.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import datastore
+from datastore import mask_endpoint
+
+FORMAT = 1
+SNAPSHOT_NAME = "state.json"
+HEADER_BYTES = 128
+_HEADER_RE = re.compile(rb'^\{"format":(\d+),"rev":(\d+),"day":"(\d{4}-\d{2}-\d{2})"')
+
+
+def _safe_int(v, default=0):
+    try:
+        return int(v)
+    except Exception:
+        return default
+
+
+def human_ts(epoch: int):
+    if not epoch or epoch <= 0:
+        return "-"
+    try:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch))
+    except Exception:
+        return "-"
+
+
+def _snapshot_days(days: int):
+    """Return [(date, start_ts)] for the last N local days, oldest first."""
+    today = datetime.date.fromtimestamp(int(time.time()))
+    out = []
+    for di in range(days-1, -1, -1):
+        day = today - datetime.timedelta(days=di)
+        out.append((day, int(datetime.datetime.combine(day, datetime.time.min).timestamp())))
+    return out
+
+
+def _snapshot_cell(day, enabled_now: int, agg):
+    """Map one (target, day) aggregate (has_up, has_down, worst_streak) to {day, state, label}."""
+    dn = day.strftime('%a')
+    if not agg:
+        if enabled_now != 1:
+            return {"day": day.isoformat(), "state": "gray", "label": f"{dn} • disabled"}
+        return {"day": day.isoformat(), "state": "unknown", "label": f"{dn} • no data"}
+    has_up, has_down, worst = agg
+    if has_down and not has_up:
+        return {"day": day.isoformat(), "state": "red", "label": f"{dn} • down"}
+    if worst >= 60:
+        return {"day": day.isoformat(), "state": "yellow", "label": f"{dn} • degraded"}
+    return {"day": day.isoformat(), "state": "green", "label": f"{dn} • ok"}
+
+
+def _table_names(con) -> frozenset:
+    return frozenset(r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table','view');"))
+
+
+def compute_snapshots_batch(con, targets, days: int = 3, names=None, tables=None):
+    """Return {name: [{day, state, label}, ...]} for many targets at once.
+
+    `targets` is an iterable of (name, enabled_now). Everything runs on the
+    caller's connection with a fixed number of queries, no matter how many
+    targets there are:
+      1) finished days come from the history_daily rollup (one row per
+         target/day, maintained by the runner)
+      2) today (or every day, on a DB without the rollup) comes from raw
+         history: per target/day sample counts, then raw samples only for
+         target/days that had both up and down, to find the worst down streak
+
+    `names` optionally restricts the scan to those targets (used by the
+    single-target wrapper); by default every row in `targets` is covered.
+    `tables`: the DB's table/view names when the caller has them cached.
+    """
+    targets = list(targets)
+    if not targets:
+        return {}
+
+    cur = con.cursor()
+    tables = _table_names(con) if tables is None else tables
+    # history layout v5 (integer target ids); older DBs show no history
+    # until the runner has migrated them
+    if "target_ids" not in tables:
+        return {}
+
+    span = _snapshot_days(days)
+    agg = {}
+
+    name_params = list(names or [])
+    in_names = ",".join("?" for _ in name_params)
+
+    # Finished days from the rollup; only today is left for raw history.
+    raw_from = 0
+    if "history_daily" in tables:
+        raw_from = len(span) - 1
+        day_idx = {day.isoformat(): i for i, (day, _start) in enumerate(span[:raw_from])}
+        if day_idx:
+            cur.execute(
+                f"""
+                SELECT name, day, ok_cnt, hb_cnt + down_cnt, worst_down_s
+                FROM history_daily
+                WHERE day >= ? AND day < ?{f" AND name IN ({in_names})" if names else ""};
+                """,
+                [span[0][0].isoformat(), span[raw_from][0].isoformat()] + name_params,
+            )
+            for name, day, ok_cnt, down_cnt, worst in cur.fetchall():
+                i = day_idx.get(day)
+                if i is not None:
+                    agg[(name, i)] = [bool(ok_cnt), bool(down_cnt), int(worst or 0)]
+
+    raw_span = span[raw_from:]
+    bounds = [start for _day, start in raw_span[1:]]
+    window_start = raw_span[0][1]
+    window_end = int(datetime.datetime.combine(raw_span[-1][0], datetime.time.max).timestamp())
+    where_names = f" WHERE t.name IN ({in_names})" if names else ""
+
+    # One row per target and partition with sample/up/down counts per day
+    # (day edges are local midnights, DST-safe unlike ts/86400). CROSS JOIN
+    # keeps targets as the outer loop, so each target's samples are one
+    # contiguous (target_id, ts) range of the partition and rows arrive
+    # already grouped (no temp b-tree). A window crossing a week boundary
+    # touches two partitions.
+    parts = datastore.history_tables(tables, window_start, window_end)
+    edges = [window_start] + bounds + [window_end + 1]
+    cols = []
+    for i in range(len(raw_span)):
+        lo, hi = int(edges[i]), int(edges[i + 1])
+        in_day = f"h.ts >= {lo} AND h.ts < {hi}"
+        cols.append(f"SUM({in_day})")
+        cols.append(f"SUM(h.status = {datastore.STATUS_UP} AND {in_day})")
+        cols.append(f"SUM(h.status >= {datastore.STATUS_HB_FAILED} AND {in_day})")
+    counts = {}
+    for table in parts:
+        cur.execute(
+            f"""
+            SELECT t.name, {', '.join(cols)}
+            FROM targets t
+            CROSS JOIN target_ids i ON i.name = t.name
+            CROSS JOIN {table} h ON h.target_id = i.id AND h.ts >= ? AND h.ts <= ?{where_names}
+            GROUP BY t.name;
+            """,
+            [window_start, window_end] + name_params,
+        )
+        for row in cur.fetchall():
+            acc = counts.setdefault(row[0], [0] * (len(row) - 1))
+            for j, v in enumerate(row[1:]):
+                acc[j] += v or 0
+    mixed = set()
+    for name, row in counts.items():
+        for i in range(len(raw_span)):
+            total, up_cnt, down_cnt = row[3 * i:3 + 3 * i]
+            if not total:
+                continue
+            agg[(name, raw_from + i)] = [bool(up_cnt), bool(down_cnt), 0]
+            if up_cnt and down_cnt:
+                mixed.add(name)
+
+    if mixed:
+        # Same rule as before: a streak starts at the first 'down' of the day
+        # and any non-down sample resets it.
+        mixed_names = sorted(mixed)
+        samples = []
+        for table in parts:
+            cur.execute(
+                f"""
+                SELECT t.name, h.ts, h.status
+                FROM targets t
+                CROSS JOIN target_ids i ON i.name = t.name
+                CROSS JOIN {table} h ON h.target_id = i.id AND h.ts >= ? AND h.ts <= ?
+                WHERE t.name IN ({','.join('?' for _ in mixed_names)})
+                ORDER BY t.name, h.ts;
+                """,
+                [window_start, window_end] + mixed_names,
+            )
+            samples.extend(tuple(r) for r in cur.fetchall())
+        if len(parts) > 1:
+            samples.sort(key=lambda r: (r[0], r[1]))
+        cur_key = None
+        cell = None
+        streak_start = None
+        for name, ts, st in samples:
+            ts = int(ts)
+            d = 0
+            while d < len(bounds) and ts >= bounds[d]:
+                d += 1
+            key = (name, raw_from + d)
+            if key != cur_key:
+                cur_key = key
+                cell = agg.get(key)
+                streak_start = None
+            if cell is None or not (cell[0] and cell[1]):
+                continue
+            if st >= datastore.STATUS_HB_FAILED:
+                if streak_start is None:
+                    streak_start = ts
+                cell[2] = max(cell[2], ts - streak_start)
+            else:
+                streak_start = None
+
+    out = {}
+    for name, enabled_now in targets:
+        out[name] = [
+            _snapshot_cell(day, int(enabled_now or 0), agg.get((name, i)))
+            for i, (day, _start) in enumerate(span)
+        ]
+    return out
+
+
+TARGET_FIELDS = (
+    "name", "ip", "interval", "status", "enabled",
+    "last_ping_human", "last_response_human", "last_ping_epoch", "last_response_epoch",
+    "last_rtt_ms", "endpoint_masked", "snapshots",
+)
+
+
+def target_rows(con, since=None, tables=None, rows=None, fields=None):
+    """Build the /state target dicts on an open connection.
+
+    since=None reads every target; otherwise only targets whose state_rev is
+    newer than `since` (the WebUI's /state deltas). `rows` are already read
+    datastore.target_state_rows/target_state_page rows to use instead;
+    `fields` (subset of TARGET_FIELDS) projects each dict, `name` is always
+    kept and the snapshot grid is only computed when asked for.
+    """
+    partial = since is not None or rows is not None
+    if rows is None:
+        rows = datastore.target_state_rows(con, since=since) or []
+    keep = None if fields is None else {"name"} | set(fields)
+
+    out = []
+    for r in rows:
+        enabled = int(r["enabled"] or 0)
+        status = datastore.ui_status(enabled, r["last_status"])
+
+        last_ping_epoch = _safe_int(r["last_ping"], 0)
+        last_resp_epoch = _safe_int(r["last_response"], 0)
+        last_rtt_ms = _safe_int(r["last_latency"], -1)
+
+        out.append({
+            "name": r["name"],
+            "ip": r["ip"],
+            "interval": _safe_int(r["interval"], 60),
+            "status": str(status),
+            "enabled": enabled,
+            "last_ping_human": human_ts(last_ping_epoch),
+            "last_response_human": human_ts(last_resp_epoch),
+            "last_ping_epoch": last_ping_epoch,
+            "last_response_epoch": last_resp_epoch,
+            "last_rtt_ms": last_rtt_ms,
+            "endpoint_masked": mask_endpoint(r["endpoint"] or ""),
+            "snapshots": [],
+        })
+
+    # One history query for every target's snapshot grid (same connection).
+    if keep is None or "snapshots" in keep:
+        try:
+            snaps = compute_snapshots_batch(
+                con,
+                [(t["name"], t["enabled"]) for t in out],
+                days=3,
+                names=[t["name"] for t in out] if partial else None,
+                tables=tables,
+            )
+        except Exception:
+            snaps = {}
+        for t in out:
+            t["snapshots"] = snaps.get(t["name"], [])
+    if keep is not None:
+        out = [{k: v for k, v in t.items() if k in keep} for t in out]
+    return out
+
+
+# ---- Snapshot file ----
+def snapshot_path(db_path: Path = datastore.DB_PATH) -> Path:
+    return db_path.with_name(SNAPSHOT_NAME)
+
+
+def read_snapshot(con):
+    """(rev, day, targets) read in one transaction; rev None on a DB
+    without state revisions."""
+    day = datetime.date.today().isoformat()  # the grid's last day
+    con.execute("BEGIN;")
+    try:
+        tables = _table_names(con)
+        row = con.execute("SELECT rev FROM state_seq WHERE id=1;").fetchone() if "state_seq" in tables else None
+        targets = target_rows(con, tables=tables)
+    finally:
+        con.execute("COMMIT;")
+    return (int(row[0]) if row else None), day, targets
+
+
+def write(path: Path, rev: int, day: str, targets: list, updated=None) -> int:
+    """Write the payload to `path` and `path`.gz atomically; returns its size.
+
+    The .gz copy is replaced first and both get the same mtime, so a reader
+    that finds equal mtimes knows the two hold the same revision.
+    """
+    header = json.dumps({"format": FORMAT, "rev": int(rev), "day": day}, separators=(",", ":"))
+    body = json.dumps(
+        {"updated": int(updated if updated is not None else time.time()), "ok": True, "targets": targets},
+        separators=(",", ":"),
+    )
+    data = (header[:-1] + "," + body[1:]).encode("utf-8")
+    mtime_ns = time.time_ns()
+    for dst, blob in ((path.with_name(path.name + ".gz"), gzip.compress(data, 6, mtime=0)), (path, data)):
+        tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.chmod(tmp, 0o644)
+            os.utime(tmp, ns=(mtime_ns, mtime_ns))
+            os.replace(tmp, dst)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+    return len(data)
+
+
+def read_header(f):
+    """(format, rev, day) from the start of an open snapshot file, or None.
+    Leaves the file positioned at its start."""
+    head = f.read(HEADER_BYTES)
+    f.seek(0)
+    m = _HEADER_RE.match(head)
+    if not m:
+        return None
+    return int(m.group(1)), int(m.group(2)), m.group(3).decode("ascii")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", type=Path, default=datastore.DB_PATH)
+    ap.add_argument("--out", type=Path, default=None, help="default: state.json next to the DB")
+    args = ap.parse_args(argv)
+    try:
+        con = datastore.connect(args.db)
+        try:
+            rev, day, targets = read_snapshot(con)
+        finally:
+            con.close()
+        if rev is None:
+            return 0
+        write(args.out or snapshot_path(args.db), rev, day, targets)
+    except Exception as e:
+        print(f"WARN: state snapshot not written: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
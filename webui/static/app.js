@@ -38,6 +38,52 @@
     return await res.json();
   }
 
+  // ---- Live events (SSE) ----
+  // One EventSource per tab; polling loops check `liveEvents` and only run
+  // while the stream is down.
+  let liveEvents = false;
+  let eventSource = null;
+
+  function connectEvents(){
+    if (!window.EventSource || eventSource) return;
+    eventSource = new EventSource("/api/events");
+    eventSource.addEventListener("hello", () => {
+      liveEvents = true;
+      // Catch up on anything missed while disconnected.
+      refreshState(false);
+      if (runPoll){ clearInterval(runPoll); runPoll = null; }
+      if (scanPoll){ clearInterval(scanPoll); scanPoll = null; }
+    });
+    eventSource.addEventListener("state", (e) => {
+      // Paged table: deltas may touch rows on other pages or move rows
+      // between pages, so re-read the visible page instead.
+      if (serverMode){ scheduleViewRefresh(); return; }
+      let data = null;
+      try{ data = JSON.parse(e.data); }catch(err){ return; }
+      if (data.reload || data.since !== stateRev){
+        refreshState(!!data.reload);
+        return;
+      }
+      applyState(data, false);
+    });
+    eventSource.addEventListener("run", (e) => {
+      try{ onRunEvent(JSON.parse(e.data)); }catch(err){}
+    });
+    eventSource.addEventListener("scan", (e) => {
+      try{ onScanEvent(JSON.parse(e.data)); }catch(err){}
+    });
+    eventSource.onerror = () => {
+      // EventSource reconnects on its own; fall back to polling meanwhile.
+      liveEvents = false;
+      if (runActive && !runPoll) runPoll = setInterval(pollRun, 600);
+      if (scanModal?.classList.contains("show") && !scanPoll) scanPoll = setInterval(refreshScan, 800);
+      if (eventSource && eventSource.readyState === EventSource.CLOSED){
+        eventSource = null;
+        setTimeout(connectEvents, 5000);
+      }
+    };
+  }
+
   // ---- Logs modal ----
   const logModal = $("#logModal");
   const openLogs = $("#openLogsFooter") || $("#openLogs");
@@ -50,52 +96,90 @@
   const logChips = $("#logChips");
   const logDlMenu = $("#logDlMenu");
   const logLinesLbl = $("#logLinesLbl");
-  let rawLog = "";
   let lastTargets = [];
+  // /state version from the last full/delta payload (null = ask for full)
+  let stateRev = null;
+  let stateDay = null;
   let logLevel = "all"; // all|info|warn|error
 
-  async function loadLogs(){
-    const lines = logLinesLbl ? Number(logLinesLbl.textContent || "200") : 200;
+  // Entries come filtered (level + text) from /logs; while the modal is open
+  // it is polled with ?after=<cursor> and only new entries are appended.
+  let logEntries = [];
+  let logCursor = "";
+  let logFollowTimer = null;
+  let logFilterTimer = null;
+  const LOG_FOLLOW_MS = 3000;
+
+  function logLimit(){
+    return logLinesLbl ? Number(logLinesLbl.textContent || "200") : 200;
+  }
+
+  async function loadLogs(follow = false){
+    const q = (logFilter?.value || "").trim();
+    const params = new URLSearchParams({lines: String(logLimit()), level: logLevel, q});
+    if (follow && logCursor) params.set("after", logCursor);
     try{
-      const data = await apiGet(`/logs?lines=${encodeURIComponent(lines)}`);
-      rawLog = data.text || "";
-      logMeta.textContent = `${data.source || "log"} • ${(data.lines || 0)} lines • ${(data.updated || "")}`;
-      applyLogFilter();
-      logBox.scrollTop = logBox.scrollHeight;
+      const data = await apiGet(`/logs?${params.toString()}`);
+      if (!data.ok){
+        logEntries = [];
+        logCursor = "";
+        logBox.textContent = `(journalctl error: ${data.error || "unavailable"})`;
+        logMeta.textContent = data.source || "error";
+        return;
+      }
+      const atBottom = logBox.scrollTop + logBox.clientHeight >= logBox.scrollHeight - 4;
+      const fresh = data.entries || [];
+      logCursor = data.cursor || "";
+      if (follow && !data.reset){
+        if (!fresh.length) return;
+        logEntries = logEntries.concat(fresh);
+      } else {
+        logEntries = fresh;
+      }
+      const excess = logEntries.length - logLimit();
+      if (excess > 0) logEntries = logEntries.slice(excess);
+      logMeta.textContent = `${data.source || "log"} • ${logEntries.length} lines • ${(data.updated || "")}`;
+      renderLogs(follow && !data.reset ? fresh : null, excess);
+      if (!follow || atBottom) logBox.scrollTop = logBox.scrollHeight;
     }catch(e){
-      rawLog = "";
+      logEntries = [];
+      logCursor = "";
       logBox.textContent = "Failed to fetch logs";
       logMeta.textContent = "error";
     }
   }
 
-  function applyLogFilter(){
-    const q = (logFilter.value || "").trim().toLowerCase();
-    const all = (rawLog || "").split("\n");
-    const levelFiltered = all.filter(l => {
-      if (logLevel === "all") return true;
-      const ll = l.toLowerCase();
-      if (logLevel === "error") return (ll.includes("error") || ll.includes("failed"));
-      if (logLevel === "warn") return (ll.includes("warn") || ll.includes("warning"));
-      if (logLevel === "info") return !(ll.includes("error") || ll.includes("failed") || ll.includes("warn") || ll.includes("warning"));
-      return true;
-    });
-    const lines = !q ? levelFiltered : levelFiltered.filter(l => l.toLowerCase().includes(q));
-
-    if (!lines.length){
-      logBox.textContent = q ? "(no matches)" : "(empty)";
+  function renderLogs(appended, dropped){
+    const esc = (s) => String(s).replace(/&/g,"&amp;").replace(/</g,"&lt;").replace(/>/g,"&gt;");
+    const html = (list) => list.map(e => `<div class="log-line level-${e.level || "info"}">${esc(e.text)}</div>`).join("");
+    if (appended && logBox.querySelector(".log-line")){
+      logBox.insertAdjacentHTML("beforeend", html(appended));
+      for (let i = 0; i < dropped && logBox.firstElementChild; i++) logBox.firstElementChild.remove();
       return;
     }
+    if (!logEntries.length){
+      logBox.textContent = (logFilter?.value || "").trim() || logLevel !== "all" ? "(no matches)" : "(empty)";
+      return;
+    }
+    logBox.innerHTML = html(logEntries);
+  }
 
-    const esc = (s) => String(s).replace(/&/g,"&amp;").replace(/</g,"&lt;").replace(/>/g,"&gt;");
-    const html = lines.map(l => {
-      const ll = l.toLowerCase();
-      let cls = "level-info";
-      if (ll.includes("error") || ll.includes("failed")) cls = "level-error";
-      else if (ll.includes("warn") || ll.includes("warning")) cls = "level-warn";
-      return `<div class="log-line ${cls}">${esc(l)}</div>`;
-    }).join("");
-    logBox.innerHTML = html;
+  function applyLogFilter(){
+    // filters are applied server-side: refetch the tail
+    clearTimeout(logFilterTimer);
+    logFilterTimer = setTimeout(() => loadLogs(false), 200);
+  }
+
+  function startLogFollow(){
+    stopLogFollow();
+    logFollowTimer = setInterval(() => {
+      if (logModal?.getAttribute("aria-hidden") !== "false"){ stopLogFollow(); return; }
+      loadLogs(true);
+    }, LOG_FOLLOW_MS);
+  }
+
+  function stopLogFollow(){
+    if (logFollowTimer){ clearInterval(logFollowTimer); logFollowTimer = null; }
   }
 
   function setActiveChip(){
@@ -113,19 +197,20 @@
     applyLogFilter();
   });
 
-  openLogs?.addEventListener("click", async () => { show(logModal); logFilter?.focus(); await loadLogs(); });
-  closeLogs?.addEventListener("click", () => hide(logModal));
+  openLogs?.addEventListener("click", async () => { show(logModal); logFilter?.focus(); await loadLogs(); startLogFollow(); });
+  closeLogs?.addEventListener("click", () => { hide(logModal); stopLogFollow(); });
   reloadLogs?.addEventListener("click", async () => await loadLogs());
   copyLogs?.addEventListener("click", async () => {
     try{ await navigator.clipboard.writeText(logBox.textContent || ""); toast("Copied", "Logs copied to clipboard"); }catch(e){}
   });
 
   function downloadLogs(fmt){
-    const lines = logLinesLbl ? Number(logLinesLbl.textContent || "200") : 200;
-    const q = (logFilter?.value || "").trim();
-    const lvl = logLevel;
-    const url = `/api/logs-export?fmt=${encodeURIComponent(fmt)}&lines=${encodeURIComponent(lines)}&q=${encodeURIComponent(q)}&level=${encodeURIComponent(lvl)}`;
-    window.open(url, "_blank");
+    // exports are streamed by the server: a range may cover a whole week
+    const hours = ($("#logDlRange")?.value || "").trim();
+    const params = new URLSearchParams({fmt, q: (logFilter?.value || "").trim(), level: logLevel});
+    if (hours) params.set("hours", hours);
+    else params.set("lines", String(logLimit()));
+    window.open(`/api/logs-export?${params.toString()}`, "_blank");
   }
   // Download dropdown
   logDlMenu?.querySelectorAll("[data-dlfmt]").forEach(b => {
@@ -137,7 +222,105 @@
     });
   });
   logFilter?.addEventListener("input", applyLogFilter);
-  logModal?.addEventListener("click", (e) => { if (e.target === logModal) hide(logModal); });
+  logModal?.addEventListener("click", (e) => { if (e.target === logModal){ hide(logModal); stopLogFollow(); } });
+
+  // ---- Runs + events (runs/events tables, indexed search server-side) ----
+  const runsModal = $("#runsModal");
+  const runsList = $("#runsList");
+  const eventsBox = $("#eventsBox");
+  const eventsMeta = $("#eventsMeta");
+  const evChips = $("#evChips");
+  const evTarget = $("#evTarget");
+  const evQuery = $("#evQuery");
+  const evRange = $("#evRange");
+  const btnMoreEvents = $("#btnMoreEvents");
+  let evLevel = "all";
+  let evRun = 0;      // 0 = events of all runs
+  let evNext = null;  // `before` cursor for the next (older) page
+  let evTimer = null;
+
+  function fmtDuration(ms){
+    ms = Number(ms || 0);
+    return ms >= 1000 ? `${(ms / 1000).toFixed(1)} s` : `${ms} ms`;
+  }
+
+  async function loadRuns(){
+    try{
+      const data = await apiGet("/api/runs?limit=50");
+      const runs = (data && data.runs) || [];
+      if (!runs.length){ runsList.textContent = "(no runs yet)"; return; }
+      runsList.innerHTML = runs.map(r => {
+        const s = r.summary;
+        const stats = s
+          ? `${fmtDuration(s.duration_ms)} • ${s.due} checked • ${s.ping_ok} ok • ${s.ping_fail} down • ${s.curl_fail} endpoint failures${s.deferred ? ` • ${s.deferred} deferred` : ""}`
+          : (r.aborted ? "aborted" : "running");
+        const level = r.aborted ? "error" : (!s ? "warn" : (s.ping_fail || s.curl_fail ? "error" : "info"));
+        const sel = Number(r.id) === evRun ? " is-active" : "";
+        return `<div class="log-line run-line level-${level}${sel}" data-run="${r.id}">${escapeHtml(`${r.started_human}  ${r.trigger}  ${stats}`)}</div>`;
+      }).join("");
+    }catch(e){
+      runsList.textContent = "Failed to fetch runs";
+    }
+  }
+
+  async function loadEvents(more = false){
+    const params = new URLSearchParams({limit: "200", level: evLevel});
+    const target = (evTarget?.value || "").trim();
+    const q = (evQuery?.value || "").trim();
+    const hours = (evRange?.value || "").trim();
+    if (target) params.set("target", target);
+    if (q) params.set("q", q);
+    if (evRun) params.set("run", String(evRun));
+    else if (hours) params.set("hours", hours);
+    if (more && evNext) params.set("before", String(evNext));
+    try{
+      const data = await apiGet(`/api/run-events?${params.toString()}`);
+      if (!data.ok){ eventsBox.textContent = data.message || "Failed to fetch events"; return; }
+      const html = (data.events || []).map(e =>
+        `<div class="log-line level-${e.level || "info"}">${escapeHtml(`${e.time}  ${e.target || "-"}  ${e.message}`)}</div>`
+      ).join("");
+      if (more) eventsBox.insertAdjacentHTML("beforeend", html);
+      else eventsBox.innerHTML = html || "(no matching events)";
+      evNext = data.next;
+      if (btnMoreEvents) btnMoreEvents.style.display = evNext ? "" : "none";
+      const shown = eventsBox.querySelectorAll(".log-line").length;
+      eventsMeta.textContent = `${shown} events${evRun ? ` • run #${evRun}` : ""}`;
+    }catch(e){
+      eventsBox.textContent = "Failed to fetch events";
+    }
+  }
+
+  function reloadEvents(){
+    clearTimeout(evTimer);
+    evTimer = setTimeout(() => loadEvents(false), 250);
+  }
+
+  evChips?.addEventListener("click", (e) => {
+    const btn = e.target?.closest?.(".chip-btn");
+    if (!btn) return;
+    evLevel = btn.dataset.level || "all";
+    $$(".chip-btn", evChips).forEach(b => b.classList.toggle("is-active", (b.dataset.level || "all") === evLevel));
+    reloadEvents();
+  });
+  runsList?.addEventListener("click", (e) => {
+    const line = e.target?.closest?.("[data-run]");
+    if (!line) return;
+    // click a run to see its events, again to go back to all events
+    const id = Number(line.dataset.run || 0);
+    evRun = evRun === id ? 0 : id;
+    $$(".run-line", runsList).forEach(l => l.classList.toggle("is-active", Number(l.dataset.run) === evRun));
+    loadEvents(false);
+  });
+  evTarget?.addEventListener("input", reloadEvents);
+  evQuery?.addEventListener("input", reloadEvents);
+  evRange?.addEventListener("change", () => loadEvents(false));
+  btnMoreEvents?.addEventListener("click", () => loadEvents(true));
+  $("#openRuns")?.addEventListener("click", async () => {
+    show(runsModal);
+    await Promise.all([loadRuns(), loadEvents(false)]);
+  });
+  $("#btnCloseRuns")?.addEventListener("click", () => hide(runsModal));
+  runsModal?.addEventListener("click", (e) => { if (e.target === runsModal) hide(runsModal); });
 
   // ---- Filter targets ----
   const filterInput = $("#filterInput");
@@ -146,6 +329,75 @@
   let sortKey = "ip";
   let sortDir = "asc"; // asc|desc
 
+  // ---- Server-side paging ----
+  // With more targets than one page the server sorts, filters and pages
+  // (/state?limit=&offset=&sort=&dir=&q=&fields=) and the table only holds
+  // the visible page; smaller installs keep everything client-side.
+  const pageSize = Number(window.__PAGE_SIZE__ || 200);
+  let serverMode = Number(window.__INITIAL_TOTAL__ || 0) > pageSize;
+  let pageOffset = 0;
+  let pageTotal = Number(window.__INITIAL_TOTAL__ || 0);
+  let viewEtag = null;
+  let viewTimer = null;
+  let filterTimer = null;
+  const VIEW_FIELDS = "name,ip,interval,status,enabled,last_ping_human,last_response_human,"
+    + "last_ping_epoch,last_response_epoch,last_rtt_ms,snapshots";
+  const pager = $("#pager");
+  const pagerInfo = $("#pagerInfo");
+  const pagerPrev = $("#pagerPrev");
+  const pagerNext = $("#pagerNext");
+
+  function viewUrl(){
+    const p = new URLSearchParams({
+      limit: String(pageSize), offset: String(pageOffset),
+      sort: sortKey, dir: sortDir, fields: VIEW_FIELDS,
+    });
+    const q = (filterInput?.value || "").trim();
+    if (q) p.set("q", q);
+    return "/state?" + p.toString();
+  }
+
+  async function refreshView(force=false){
+    const headers = (!force && viewEtag) ? {"If-None-Match": viewEtag} : {};
+    const res = await fetch(viewUrl(), {cache:"no-store", headers});
+    if (res.status === 304 || !res.ok) return;
+    const data = await res.json();
+    pageTotal = Number(data.total || 0);
+    if (pageOffset > 0 && pageOffset >= pageTotal){
+      // the page emptied (targets removed / filter narrowed): step back
+      pageOffset = Math.max(0, Math.ceil(pageTotal / pageSize) - 1) * pageSize;
+      return refreshView(true);
+    }
+    viewEtag = res.headers.get("ETag");
+    applyState(data, force);
+    updatePager();
+  }
+
+  function scheduleViewRefresh(){
+    if (viewTimer) return;
+    viewTimer = setTimeout(() => { viewTimer = null; refreshState(false); }, 500);
+  }
+
+  function updatePager(){
+    if (!pager) return;
+    pager.classList.toggle("is-hidden", !serverMode);
+    if (!serverMode) return;
+    const from = pageTotal ? pageOffset + 1 : 0;
+    const to = Math.min(pageOffset + pageSize, pageTotal);
+    pagerInfo.textContent = `${from}–${to} of ${pageTotal}`;
+    pagerPrev.disabled = pageOffset <= 0;
+    pagerNext.disabled = pageOffset + pageSize >= pageTotal;
+  }
+
+  pagerPrev?.addEventListener("click", () => {
+    pageOffset = Math.max(0, pageOffset - pageSize);
+    refreshState(true);
+  });
+  pagerNext?.addEventListener("click", () => {
+    if (pageOffset + pageSize < pageTotal) pageOffset += pageSize;
+    refreshState(true);
+  });
+
   function ipKey(ip){
     try{
       const p = String(ip||"0.0.0.0").split(".").map(x => Number(x));
@@ -222,6 +474,11 @@
           sortDir = (key === "name" || key === "status") ? "asc" : "asc";
         }
         updateSortIndicators();
+        if (serverMode){
+          pageOffset = 0;
+          refreshState(true);
+          return;
+        }
         renderTargets(lastTargets);
       });
     });
@@ -229,6 +486,11 @@
   }
 
   function applyTargetFilter(){
+    if (serverMode){
+      if (filterTimer) clearTimeout(filterTimer);
+      filterTimer = setTimeout(() => { pageOffset = 0; refreshState(true); }, 250);
+      return;
+    }
     renderTargets(lastTargets);
   }
   filterInput?.addEventListener("input", applyTargetFilter);
@@ -404,6 +666,8 @@ btnConfirmRemove?.addEventListener("click", async () => {
   const infoLastPing = $("#infoLastPing");
   const infoLastResp = $("#infoLastResp");
   const infoLatency = $("#infoLatency");
+  const infoRttRange = $("#infoRttRange");
+  const infoJitterLoss = $("#infoJitterLoss");
   const btnCopyEndpoint = $("#btnCopyEndpoint");
 
   const u24 = $("#u24");
@@ -481,7 +745,7 @@ async function openInfo(name){
     show(infoModal);
 
     // Reset
-    [infoName,infoIp,infoEnabled,infoInterval,infoEndpoint,infoStatus,infoLastPing,infoLastResp,infoLatency].forEach(el => { if (el) el.textContent = "-"; });
+    [infoName,infoIp,infoEnabled,infoInterval,infoEndpoint,infoStatus,infoLastPing,infoLastResp,infoLatency,infoRttRange,infoJitterLoss].forEach(el => { if (el) el.textContent = "-"; });
     [u24,u7,u30,u90].forEach(el => { if (el) el.style.width = "0%"; });
     [u24t,u7t,u30t,u90t].forEach(el => { if (el) el.textContent = "-"; });
 
@@ -501,7 +765,15 @@ async function openInfo(name){
     infoStatus.textContent = (cur.status || "unknown").toUpperCase();
     infoLastPing.textContent = cur.last_ping_human || "-";
     infoLastResp.textContent = cur.last_response_human || "-";
-    infoLatency.textContent = (cur.last_rtt_ms === undefined || cur.last_rtt_ms === null || Number(cur.last_rtt_ms) < 0) ? "-" : `${cur.last_rtt_ms} ms`;
+    const ping = cur.ping || {};
+    const ms = (v) => (v === undefined || v === null) ? "-" : `${Number(v).toFixed(3)} ms`;
+    if (ping.rtt_avg_ms !== undefined && ping.rtt_avg_ms !== null){
+      infoLatency.textContent = ms(ping.rtt_avg_ms);
+    } else {
+      infoLatency.textContent = (cur.last_rtt_ms === undefined || cur.last_rtt_ms === null || Number(cur.last_rtt_ms) < 0) ? "-" : `${cur.last_rtt_ms} ms`;
+    }
+    infoRttRange.textContent = (ping.rtt_min_ms === undefined || ping.rtt_min_ms === null) ? "-" : `${ms(ping.rtt_min_ms)} / ${ms(ping.rtt_max_ms)}`;
+    infoJitterLoss.textContent = (ping.loss_pct === undefined || ping.loss_pct === null) ? "-" : `${ms(ping.jitter_ms)} / ${ping.loss_pct}%`;
 
     const up = data.uptime || {};
     setUptimeRow(u24, u24t, up["24h"]);
@@ -814,7 +1086,8 @@ function renderSnapshots(snaps){
     }
   });
 
-  const q = (filterInput?.value || "").trim().toLowerCase();
+  // server mode: the page arrives filtered and in order
+  const q = serverMode ? "" : (filterInput?.value || "").trim().toLowerCase();
   const filtered = (list || []).filter(t => {
     if (!q) return true;
     const name = String(t.name||"").toLowerCase();
@@ -823,7 +1096,7 @@ function renderSnapshots(snaps){
     return name.includes(q) || ip.includes(q) || st.includes(q);
   });
 
-  const sorted = sortTargets(filtered);
+  const sorted = serverMode ? filtered : sortTargets(filtered);
   tbody.innerHTML = sorted.map(buildRow).join("");
   attachIntervalHandlers();
   attachMenuActions();
@@ -1064,14 +1337,48 @@ function attachMenuActions(){
 
   async function refreshState(force=false){
     try{
-      const data = await apiGet("/state");
-      const incoming = Array.isArray(data.targets) ? data.targets : [];
+      if (serverMode) return await refreshView(force);
+      // Poll with the last known version: the server answers 304 when nothing
+      // changed, or a delta (changed targets + removed names).
+      const useDelta = !force && stateRev !== null && stateDay !== null;
+      const url = useDelta
+        ? `/state?since=${encodeURIComponent(stateRev)}&day=${encodeURIComponent(stateDay)}`
+        : "/state";
+      const res = await fetch(url, {cache:"no-store"});
+      if (res.status === 304) return;
+      const data = await res.json();
+      applyState(data, force);
+    }catch(e){
+      // silent
+    }
+  }
+
+  function applyState(data, force=false){
+    try{
+      stateRev = (data && data.rev !== undefined) ? data.rev : null;
+      stateDay = (data && data.day !== undefined) ? data.day : null;
+
+      let incoming = Array.isArray(data.targets) ? data.targets : [];
+      const changed = incoming;
+      const isDelta = !!(data && data.delta);
+      if (isDelta){
+        const merged = new Map((lastTargets || []).map(t => [t.name, t]));
+        (data.removed || []).forEach(n => merged.delete(n));
+        changed.forEach(t => merged.set(t.name, t));
+        incoming = Array.from(merged.values());
+      }
       const backendOk = (data && data.ok !== false);
       if (!backendOk && incoming.length === 0 && Array.isArray(lastTargets) && lastTargets.length > 0){
         // keep current state
         return;
       }
       lastTargets = incoming;
+      if (!serverMode && lastTargets.length > pageSize){
+        // grew past one page: switch to server-side paging
+        serverMode = true;
+        refreshView(true);
+        return;
+      }
 
       // Only re-render the table if structure changed (add/remove) or if forced.
       const namesNow = new Set((incoming||[]).map(t => String(t.name||"")));
@@ -1080,12 +1387,18 @@ function attachMenuActions(){
       if (!structureChanged){
         for (const n of namesNow){ if (!namesRendered.has(n)){ structureChanged = true; break; } }
       }
+      if (!structureChanged && serverMode){
+        // same rows, new server order (e.g. sorted by last ping)
+        const order = $$("tr[data-name]").map(tr => tr.getAttribute("data-name"));
+        structureChanged = incoming.some((t, i) => String(t.name||"") !== order[i]);
+      }
       if (force || structureChanged){
         renderTargets(lastTargets);
         bindSortHeaders();
       }
+      // Deltas only touch the rows that changed (unless the table was rebuilt).
       const map = new Map();
-      (incoming || []).forEach(t => map.set(t.name, t));
+      ((isDelta && !force && !structureChanged) ? changed : incoming).forEach(t => map.set(t.name, t));
 
       $$("tr[data-name]").forEach(row => {
         const name = row.getAttribute("data-name");
@@ -1169,6 +1482,11 @@ function attachMenuActions(){
 
   let runPoll = null;
   let runDueExpected = 0;
+  let runActive = false;
+  let runStarted = 0;
+  let runLines = [];
+  let runOffset = 0;
+  let runSummary = null;
 
   function setBar(done, due){
     const pct = (!due || due <= 0) ? 0 : Math.max(0, Math.min(100, Math.round((done / due) * 100)));
@@ -1193,6 +1511,9 @@ function attachMenuActions(){
     runNowLine.textContent = "Starting…";
     runDoneLine.textContent = "done: 0 / 0";
     setBar(0, 0);
+    runLines = [];
+    runOffset = 0;
+    runSummary = null;
   }
 
 btnRunDetails?.addEventListener("click", () => {
@@ -1204,16 +1525,51 @@ btnRunDetails?.addEventListener("click", () => {
 
   async function pollRun(){
     // Use output tail only for progress counting (no live output UI)
-    let outText = "";
-    let summary = null;
+    // Only fetch output appended since the last cursor.
     let outResp = null;
     try{
-      outResp = await apiGet("/api/run-output?lines=220");
-      if (outResp && outResp.ok){
-        outText = outResp.text || "";
-        summary = outResp.summary || null;
-      }
+      outResp = await apiGet(`/api/run-output?offset=${encodeURIComponent(runOffset)}`);
     }catch(e){ /* ignore */ }
+    if (outResp && outResp.ok){
+      appendRunLines(String(outResp.text || "").split("\n"));
+      if (outResp.offset !== undefined) runOffset = Number(outResp.offset) || 0;
+      if (outResp.summary) runSummary = outResp.summary;
+    }
+    applyRunProgress(Number(outResp?.done ?? 0));
+
+    const st = await apiGet("/api/run-status");
+    if (st && st.running){
+      runTitleMeta.textContent = "running…";
+      runLive.style.display = "inline-flex";
+      runLiveText.textContent = "Running…";
+      await refreshState(false);
+      return;
+    }
+    await finishRun();
+  }
+
+  // Live run progress from /api/events (replaces the 600ms poll while connected)
+  async function onRunEvent(ev){
+    // Ignore events from an earlier run (the output file is truncated first)
+    if (!runActive || (runStarted && Number(ev.started || 0) !== runStarted)) return;
+    appendRunLines(ev.lines || []);
+    if (ev.offset !== undefined) runOffset = Number(ev.offset) || 0;
+    if (ev.summary) runSummary = ev.summary;
+    applyRunProgress(Number(ev.done ?? 0));
+    if (ev.finished){
+      await apiGet("/api/run-status").catch(() => null);
+      await finishRun();
+    }
+  }
+
+  function appendRunLines(lines){
+    lines.forEach(l => { if (l) runLines.push(l); });
+    if (runLines.length > 220) runLines = runLines.slice(-220);
+  }
+
+  function applyRunProgress(done){
+    const outText = runLines.join("\n");
+    const summary = runSummary;
 
     // Live feed (last lines)
     if (runFeed && runFeedWrap){
@@ -1232,8 +1588,6 @@ btnRunDetails?.addEventListener("click", () => {
     }
 
     // Progress: count completed targets (server-side)
-    const done = Number(outResp?.done ?? 0);
-
     // If summary exists (usually at end), prefer it
     const due = summary ? Number(summary.due || 0) : Math.max(runDueExpected || 0, done || 0);
     if (summary){
@@ -1247,18 +1601,12 @@ btnRunDetails?.addEventListener("click", () => {
     }
     setBar(done, due);
     runDoneLine.textContent = `done: ${done} / ${due}`;
+  }
 
-    const st = await apiGet("/api/run-status");
-    if (st && st.running){
-      runTitleMeta.textContent = "running…";
-      runLive.style.display = "inline-flex";
-      runLiveText.textContent = "Running…";
-      await refreshState(false);
-      return;
-    }
-
-    // finished
-    clearInterval(runPoll);
+  async function finishRun(){
+    if (!runActive) return;
+    runActive = false;
+    if (runPoll) clearInterval(runPoll);
     runPoll = null;
     runLive.style.display = "none";
 
@@ -1278,7 +1626,8 @@ btnRunDetails?.addEventListener("click", () => {
     show(runModal);
     // Expected due count for progress (enabled targets)
     try{
-      runDueExpected = (lastTargets || []).filter(t => Number(t.enabled ?? 0) === 1 && String(t.status||"") !== "disabled").length;
+      // paged table: only the visible page is known, the run reports its due count
+      runDueExpected = serverMode ? 0 : (lastTargets || []).filter(t => Number(t.enabled ?? 0) === 1 && String(t.status||"") !== "disabled").length;
       mDue.textContent = String(runDueExpected || 0);
     }catch(e){ runDueExpected = 0; }
 
@@ -1289,9 +1638,11 @@ btnRunDetails?.addEventListener("click", () => {
         runNowLine.textContent = "Failed";
         runLive.style.display = "none";
       } else {
-        // poll frequently while running
+        // Live events drive progress; poll frequently only without them.
+        runActive = true;
+        runStarted = Number(data.started || 0);
         if (runPoll) clearInterval(runPoll);
-        runPoll = setInterval(pollRun, 600);
+        if (!liveEvents) runPoll = setInterval(pollRun, 600);
         await pollRun();
       }
     }catch(e){
@@ -1344,6 +1695,8 @@ btnRunDetails?.addEventListener("click", () => {
   updateScanScopeUI();
 
   let scanPoll = null;
+  let scanLines = [];
+  let scanOffset = null;
   let scanFound = [];
   let scanNew = [];
   let scanSelected = null;
@@ -1385,45 +1738,25 @@ btnRunDetails?.addEventListener("click", () => {
 
   async function refreshScan(){
     try{
-      const out = await apiGet(`/api/scan-output?lines=260`);
-      const meta = out.meta || {};
-      scanTitleMeta.textContent = meta.cidrs?.length ? `(${meta.cidrs.length} subnets)` : "";
-      scanSubnets.textContent = meta.cidrs?.length ? String(meta.cidrs.length) : "-";
-      scanOutput.textContent = out.text || "";
-      scanOutput.scrollTop = scanOutput.scrollHeight;
-
-      // Simple progress estimate: subnets started vs total
-      const txt = String(out.text||"");
-      const started = (txt.match(/^scan:\s+/gm) || []).length;
-      const total = (meta.cidrs||[]).length || 0;
-      const pct = total ? Math.min(100, Math.round((started/total)*100)) : 0;
-      scanBar.style.width = `${pct}%`;
-      const currentIp = meta.current_ip ? String(meta.current_ip) : "";
-      scanStatusLine.textContent = total ? `Scanning ${Math.min(started+1,total)} / ${total}${currentIp ? " • " + currentIp : ""}` : (meta.error || "Scanning…");
+      // First call tails the file; later calls only fetch new lines.
+      const out = await apiGet(scanOffset === null
+        ? `/api/scan-output?lines=260`
+        : `/api/scan-output?offset=${encodeURIComponent(scanOffset)}`);
+      if (scanOffset === null) scanLines = [];
+      appendScanLines(String(out.text || "").split("\n"));
+      if (out.offset !== undefined) scanOffset = Number(out.offset) || 0;
+      applyScanOutput(out.meta || {});
 
       const st = await apiGet(`/api/scan-status`);
       if (st.running){
-        scanLive.style.display = "flex";
-        if (btnAbortScan) btnAbortScan.style.display = "inline-flex";
-        if (btnScanNow) btnScanNow.style.display = "none";
-        btnSearchNetwork?.classList.add("is-running");
+        setScanRunning(true);
         return;
       }
-      scanLive.style.display = "none";
-      if (btnAbortScan) btnAbortScan.style.display = "none";
-      if (btnScanNow) btnScanNow.style.display = "inline-flex";
-      if (btnScanNow) btnScanNow.textContent = st.finished ? "Scan again" : "Scan now";
-      btnSearchNetwork?.classList.remove("is-running");
+      setScanRunning(false, st.finished);
 
       // finished -> get results
       const res = await apiGet(`/api/scan-result`);
-      scanFound = res.found || [];
-      scanFoundCount.textContent = String(scanFound.length);
-
-      const existingIps = new Set((lastTargets||[]).map(t => String(t.ip||"")));
-      scanNew = scanFound.filter(d => !existingIps.has(String(d.ip||"")));
-      scanNewCount.textContent = String(scanNew.length);
-      renderScanList();
+      applyScanResult(res.found || []);
 
       // Keep polling if modal is open; otherwise stop.
       if (!scanModal?.classList.contains("show")){
@@ -1436,7 +1769,72 @@ btnRunDetails?.addEventListener("click", () => {
     }
   }
 
+  // Live scan progress from /api/events (replaces the 800ms poll while connected)
+  function onScanEvent(ev){
+    if (ev.running) btnSearchNetwork?.classList.add("is-running");
+    else btnSearchNetwork?.classList.remove("is-running");
+    if (!scanModal?.classList.contains("show")) return;
+    appendScanLines(ev.lines || []);
+    if (ev.offset !== undefined) scanOffset = Number(ev.offset) || 0;
+    const meta = ev.meta || {};
+    applyScanOutput(meta);
+    if (ev.running){
+      setScanRunning(true);
+      return;
+    }
+    setScanRunning(false, ev.finished);
+    applyScanResult(meta.found || []);
+  }
+
+  function appendScanLines(lines){
+    lines.forEach(l => { if (l) scanLines.push(l); });
+    if (scanLines.length > 260) scanLines = scanLines.slice(-260);
+  }
+
+  function applyScanOutput(meta){
+    scanTitleMeta.textContent = meta.cidrs?.length ? `(${meta.cidrs.length} subnets)` : "";
+    scanSubnets.textContent = meta.cidrs?.length ? String(meta.cidrs.length) : "-";
+    const txt = scanLines.join("\n");
+    scanOutput.textContent = txt;
+    scanOutput.scrollTop = scanOutput.scrollHeight;
+
+    // Simple progress estimate: subnets started vs total
+    const started = (txt.match(/^scan:\s+/gm) || []).length;
+    const total = (meta.cidrs||[]).length || 0;
+    const pct = total ? Math.min(100, Math.round((started/total)*100)) : 0;
+    scanBar.style.width = `${pct}%`;
+    const currentIp = meta.current_ip ? String(meta.current_ip) : "";
+    scanStatusLine.textContent = total ? `Scanning ${Math.min(started+1,total)} / ${total}${currentIp ? " • " + currentIp : ""}` : (meta.error || "Scanning…");
+  }
+
+  function setScanRunning(running, finished=false){
+    if (running){
+      scanLive.style.display = "flex";
+      if (btnAbortScan) btnAbortScan.style.display = "inline-flex";
+      if (btnScanNow) btnScanNow.style.display = "none";
+      btnSearchNetwork?.classList.add("is-running");
+      return;
+    }
+    scanLive.style.display = "none";
+    if (btnAbortScan) btnAbortScan.style.display = "none";
+    if (btnScanNow) btnScanNow.style.display = "inline-flex";
+    if (btnScanNow) btnScanNow.textContent = finished ? "Scan again" : "Scan now";
+    btnSearchNetwork?.classList.remove("is-running");
+  }
+
+  function applyScanResult(found){
+    scanFound = found || [];
+    scanFoundCount.textContent = String(scanFound.length);
+
+    const existingIps = new Set((serverMode ? allTargetIps : (lastTargets||[])).map(t => String(t.ip||"")));
+    scanNew = scanFound.filter(d => !existingIps.has(String(d.ip||"")));
+    scanNewCount.textContent = String(scanNew.length);
+    renderScanList();
+  }
+
   function resetScanUi(){
+    scanLines = [];
+    scanOffset = null;
     scanBar.style.width = "0%";
     scanFoundCount.textContent = "-";
     scanNewCount.textContent = "-";
@@ -1460,11 +1858,29 @@ btnRunDetails?.addEventListener("click", () => {
     return true;
   }
 
+  // Paged table: the scan's "new" count needs every target's IP, not just
+  // the visible page (fields=ip keeps that to a few bytes per target).
+  let allTargetIps = [];
+  async function loadAllTargetIps(){
+    const out = [];
+    for (let off = 0; ; off += 1000){
+      const data = await apiGet(`/state?fields=ip&sort=ip&limit=1000&offset=${off}`);
+      (data.targets || []).forEach(t => out.push(t));
+      if (!data.ok || off + 1000 >= Number(data.total || 0)) break;
+    }
+    allTargetIps = out;
+  }
+
   btnSearchNetwork?.addEventListener("click", async () => {
     show(scanModal);
-    // Show current status/results and keep polling while the modal is open.
+    if (serverMode){
+      try{ await loadAllTargetIps(); }catch(e){}
+    }
+    scanOffset = null;
+    // Show current status/results; poll while the modal is open unless live
+    // events are connected.
     if (scanPoll) clearInterval(scanPoll);
-    scanPoll = setInterval(refreshScan, 800);
+    scanPoll = liveEvents ? null : setInterval(refreshScan, 800);
     await refreshScan();
   });
 
@@ -1487,7 +1903,7 @@ btnRunDetails?.addEventListener("click", () => {
     }
     toast("Search network", "Scan started");
     if (scanPoll) clearInterval(scanPoll);
-    scanPoll = setInterval(refreshScan, 800);
+    scanPoll = liveEvents ? null : setInterval(refreshScan, 800);
     await refreshScan();
   });
 
@@ -1537,9 +1953,13 @@ btnRunDetails?.addEventListener("click", () => {
   }catch(e){}
 
   bindSortHeaders();
+  updatePager();
   // Ensure Enable/Disable visibility + row datasets are synced immediately
   refreshState(true);
-  setInterval(() => refreshState(false), 2000);
+  // /state polling is the fallback; while /api/events is connected, state
+  // deltas arrive as they happen.
+  setInterval(() => { if (!liveEvents) refreshState(false); }, 2000);
+  connectEvents();
 
   // Keyboard UX: Esc closes sidepanel/modals, Enter toggles sidepanel on focused/selected row
   document.addEventListener("keydown", (e) => {